@@ -0,0 +1,72 @@
+import asyncio
+import time
+import traceback
+
+import config
+import metrics
+
+# Больше элементов в альбоме Telegram не присылает
+MAX_ALBUM_SIZE = 10
+
+
+class AlbumCollector:
+    """
+    Собирает элементы альбома (media_group_id), которые Telegram присылает
+    отдельными обновлениями. Альбом передаётся обработчику целиком, когда
+    новые элементы перестают приходить на ALBUM_COLLECT_DELAY секунд
+    (или сразу, если пришли все 10).
+    """
+
+    def __init__(self, handler, delay=None):
+        self._handler = handler  # async handler(list[Message]) - элементы по порядку
+        self._delay = delay or config.ALBUM_COLLECT_DELAY
+        self._albums = {}  # {media_group_id: [список сообщений, таймер]}
+        self._tasks = set()  # рассылаемые альбомы: без ссылки задачу может собрать сборщик мусора
+
+    def __len__(self):
+        return len(self._albums)
+
+    def add(self, message):
+        album = self._albums.get(message.media_group_id)
+        if album is None:
+            album = self._albums[message.media_group_id] = [[], None]
+        messages, timer = album
+        messages.append(message)
+        if timer:
+            timer.cancel()
+
+        if len(messages) >= MAX_ALBUM_SIZE:
+            self._flush(message.media_group_id)
+        else:
+            album[1] = asyncio.get_running_loop().call_later(self._delay, self._flush, message.media_group_id)
+
+    def _flush(self, media_group_id):
+        album = self._albums.pop(media_group_id, None)
+        if album is None:
+            return
+        messages, timer = album
+        if timer:
+            timer.cancel()
+        messages.sort(key=lambda m: m.message_id)
+        task = asyncio.create_task(self._run(messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        """Рассылает недособранные альбомы и дожидается всех рассылок (при остановке бота)"""
+        for media_group_id in list(self._albums):
+            self._flush(media_group_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self, messages):
+        start_time = time.perf_counter()
+        try:
+            await self._handler(messages)
+            # Альбом обрабатывается вне Dispatcher, поэтому MetricsMiddleware его не видит
+            metrics.handler_seconds.observe(time.perf_counter() - start_time, handler=self._handler.__name__)
+        except Exception as e:
+            print(f"\n{'='*50}")
+            print(f"[ERROR] Failed to handle album {messages[0].media_group_id}: {e}")
+            print(traceback.format_exc())
+            print(f"{'='*50}\n")
@@ -0,0 +1,140 @@
+"""
+Асинхронный слой доступа к базам данных.
+
+Peewee работает синхронно, поэтому все запросы выполняются в отдельных
+потоках: у каждой базы один поток-писатель (SQLite всё равно допускает
+только одного писателя), а чтения идут в общем пуле потоков и в режиме
+WAL не ждут записи. У каждого потока своё соединение с базой.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import profiling
+from database import User, PrisonUser, db
+from messages_db import HistoryRetention, HistoryWriter, history, messages_db
+
+_readers = ThreadPoolExecutor(max_workers=config.DB_READ_THREADS, thread_name_prefix='db-reader')
+_writers = {}  # {база: ThreadPoolExecutor с одним потоком}
+_writer_names = {}  # {база: имя для queue_depths}
+
+
+def register_writer(database, name):
+    """Заводит поток-писатель для базы (state.db подключается только при общем состоянии)"""
+    if database not in _writers:
+        _writers[database] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'db-writer-{name}')
+        _writer_names[database] = name
+
+
+register_writer(db, 'users')
+register_writer(messages_db, 'messages')
+
+
+def _call(database, fn, args, kwargs):
+    database.connect(reuse_if_open=True)
+    return fn(*args, **kwargs)
+
+
+async def run_read(database, fn, *args, **kwargs):
+    """Выполняет fn в пуле читателей"""
+    loop = asyncio.get_running_loop()
+    start_time = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_readers, functools.partial(_call, database, fn, args, kwargs))
+    finally:
+        profiling.record('db', time.perf_counter() - start_time)
+
+
+async def run_write(database, fn, *args, **kwargs):
+    """Выполняет fn в потоке-писателе базы"""
+    loop = asyncio.get_running_loop()
+    start_time = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_writers[database], functools.partial(_call, database, fn, args, kwargs))
+    finally:
+        profiling.record('db', time.perf_counter() - start_time)
+
+
+def queue_depths():
+    """Сколько запросов ждёт свободного потока: {'readers': n, 'users': n, 'messages': n, ...}"""
+    # Очередь ThreadPoolExecutor не публичная, но другого способа узнать её длину нет
+    return {
+        'readers': _readers._work_queue.qsize(),
+        **{_writer_names[database]: executor._work_queue.qsize() for database, executor in _writers.items()},
+    }
+
+
+def shutdown():
+    """Дожидается завершения всех запросов и останавливает потоки"""
+    for executor in (*_writers.values(), _readers):
+        executor.shutdown(wait=True)
+
+
+# Пользователи
+
+async def get_user(user_id):
+    return await run_read(db, User.get_user, user_id)
+
+
+async def get_user_ids():
+    return await run_read(db, lambda: [user_id for (user_id,) in User.select(User.user_id).tuples()])
+
+
+async def create_user(**kwargs):
+    return await run_write(db, User.create, **kwargs)
+
+
+async def update_user_channels(changes):
+    """Пачкой меняет каналы и имена, changes - тройки (user_id, channel, name)"""
+    def update():
+        with db.atomic():
+            for user_id, channel, name in changes:
+                User.update(channel=channel, name=name).where(User.user_id == user_id).execute()
+    await run_write(db, update)
+
+
+async def delete_user(user_id):
+    """Удаляет пользователя вместе с записью о тюрьме"""
+    def delete():
+        with db.atomic():
+            User.delete().where(User.user_id == user_id).execute()
+            PrisonUser.delete().where(PrisonUser.user_id == user_id).execute()
+    await run_write(db, delete)
+
+
+async def save(instance):
+    """Сохраняет модель в её базе"""
+    return await run_write(instance._meta.database, instance.save)
+
+
+# Тюрьма
+
+async def get_prison_user(user_id):
+    return await run_read(db, PrisonUser.get_or_none, PrisonUser.user_id == user_id)
+
+
+async def create_prison_user(**kwargs):
+    return await run_write(db, PrisonUser.create, **kwargs)
+
+
+async def release_prisoners(changes):
+    """Освобождает пачку заключённых, changes - пары (user_id, новый канал)"""
+    def release():
+        with db.atomic():
+            PrisonUser.delete().where(PrisonUser.user_id.in_([user_id for user_id, _ in changes])).execute()
+            for user_id, channel in changes:
+                User.update(channel=channel).where(User.user_id == user_id).execute()
+    await run_write(db, release)
+
+
+# История сообщений: отложенная пачечная запись из обработчиков сообщений
+history_writer = HistoryWriter(functools.partial(run_write, messages_db))
+
+# Очистка старой истории - в том же потоке-писателе, короткими шагами
+history_retention = HistoryRetention(history, functools.partial(run_write, messages_db))
+
+
+async def find_message_details(chat_id, message_id):
+    return await run_read(messages_db, history.find_message_details, chat_id, message_id)
@@ -0,0 +1,123 @@
+"""
+Микробенчмарки функций, которые выполняются на каждое сообщение
+или на каждого пользователя. Данные и размеры - в conftest.py,
+запуск и сравнение с базовой линией - в pytest.ini.
+"""
+import itertools
+import random
+
+import pytest
+
+import main
+from database import User
+from restricted_names import is_name_allowed, is_valid_name, normalize_text
+
+NAMES = [
+    'Linda Crow', 'Иван Петров', 'xXx_Pr0_xXx', 'Мария', 'John Smith Junior',
+    'Админ', 'adm1n', 'Владелец бота', 'Tom', 'Александра Константинова',
+]
+
+
+@pytest.mark.benchmark(group='names')
+def test_normalize_text(benchmark):
+    names = itertools.cycle(NAMES)
+    benchmark(lambda: normalize_text(next(names)))
+
+
+@pytest.mark.benchmark(group='names')
+def test_is_name_allowed(benchmark):
+    names = itertools.cycle(NAMES)
+    benchmark(lambda: is_name_allowed(next(names), 42))
+
+
+@pytest.mark.benchmark(group='names')
+def test_is_valid_name(benchmark):
+    names = itertools.cycle(NAMES)
+    benchmark(lambda: is_valid_name(next(names)))
+
+
+@pytest.mark.benchmark(group='display')
+def test_get_display_name(benchmark):
+    user = User(user_id=1, channel=1000, name='Linda Crow', custom_name='Lin', emoji='🦊')
+    benchmark(main.get_display_name, user)
+
+
+@pytest.mark.benchmark(group='display')
+def test_user_get_display_name(benchmark):
+    user = User(user_id=1, channel=1000, name='Linda Crow', custom_name=None, emoji='🦊')
+    benchmark(user.get_display_name)
+
+
+@pytest.mark.benchmark(group='display')
+def test_create_user_button_cached(benchmark):
+    user = User(user_id=1, channel=1000, name='Linda Crow', emoji='🦊')
+    benchmark(main.create_user_button, user.name, user)
+
+
+@pytest.mark.benchmark(group='display')
+def test_create_user_button_uncached(benchmark):
+    # Имён больше, чем вмещает кеш, - каждая кнопка собирается заново
+    names = itertools.cycle([f'User {number}' for number in range(2 * main.config.MARKUP_CACHE_SIZE)])
+    benchmark(lambda: main.create_user_button(next(names)))
+
+
+@pytest.mark.benchmark(group='quote')
+def test_quote_message(benchmark):
+    benchmark(main.quote_message, 'Linda Crow', 'привет всем', 'и тебе привет')
+
+
+@pytest.mark.benchmark(group='quote')
+def test_quote_message_nested(benchmark):
+    quoted = '╭─ Tom\n╰ старая цитата\n\n' + 'длинный ответ на цитату ' * 20
+    benchmark(main.quote_message, 'Linda Crow', quoted, 'ответ')
+
+
+@pytest.mark.benchmark(group='channels')
+def test_get_random_channel(benchmark, channel_index):
+    benchmark(main.get_random_channel)
+
+
+@pytest.mark.benchmark(group='channels')
+def test_get_least_populated_channel(benchmark, channel_index):
+    benchmark(main.get_least_populated_channel)
+
+
+@pytest.mark.benchmark(group='channels')
+def test_get_least_populated_channel_after_move(benchmark, channel_index):
+    # Переход пользователя между каналами и сразу выбор канала для новичка, как в /start
+    rng = random.Random(1)
+    user_ids = range(1, 1001)  # conftest нумерует пользователей с 1
+
+    def move_and_pick():
+        channel_index.set_channel(rng.choice(user_ids), rng.randint(main.config.MIN_CHANNEL, main.config.MAX_CHANNEL))
+        return main.get_least_populated_channel()
+
+    benchmark(move_and_pick)
+
+
+@pytest.mark.benchmark(group='history')
+def test_stored_message_find_message_details(benchmark, history):
+    partitions, copies = history
+    # Поиск внутри одного раздела - StoredMessage.find_message_details
+    message = partitions.retained()[0]
+    database = message._meta.database
+    database.connect(reuse_if_open=True)
+    lookups = itertools.cycle(copies[-len(copies) // 3:])
+    result = benchmark(lambda: message.find_message_details(*next(lookups)))
+    assert result is not None
+
+
+@pytest.mark.benchmark(group='history')
+def test_history_find_message_details_oldest(benchmark, history):
+    # Копия из самого старого раздела: поиск проходит все разделы
+    partitions, copies = history
+    lookups = itertools.cycle(copies[:len(copies) // 3])
+    result = benchmark(lambda: partitions.find_message_details(*next(lookups)))
+    assert result is not None
+
+
+@pytest.mark.benchmark(group='history')
+def test_history_find_message_details_miss(benchmark, history):
+    partitions, _ = history
+    result = benchmark(partitions.find_message_details, 1, 10 ** 12)
+    assert result is None
@@ -0,0 +1,105 @@
+"""
+Сравнение скомпилированной проверки имён с прежней реализацией.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_restricted_names.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import restricted_names
+from restricted_names import CHAR_MAP, RESTRICTED_NAMES, RestrictedNameMatcher, is_name_allowed, normalize_text
+
+
+# Прежние версии функций - для сравнения скорости и результатов
+def legacy_normalize_text(text):
+    text = text.lower()
+    normalized = ""
+    for char in text:
+        normalized += CHAR_MAP.get(char, char)
+    return normalized
+
+
+def legacy_is_name_allowed(name, user_id):
+    if len(name) > 32:
+        return False, "❌ *Ошибка*: Максимальная длина имени - 32 символа"
+    allowed_chars = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZабвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ 0123456789')
+    invalid_chars = [char for char in name if char not in allowed_chars]
+    if invalid_chars:
+        return False, f"❌ *Ошибка*: Запрещенные символы в имени: `{'`, `'.join(set(invalid_chars))}`"
+    if name.strip() == '':
+        return False, "❌ *Ошибка*: Имя не может состоять только из пробелов"
+    normalized_name = legacy_normalize_text(name)
+    for restricted_name, allowed_users in RESTRICTED_NAMES.items():
+        if legacy_normalize_text(restricted_name) == normalized_name:
+            if not allowed_users or user_id not in allowed_users:
+                return False, "❌ *Ошибка*: Это имя запрещено к использованию"
+    return True, ""
+
+
+def legacy_substring_check(name, user_id):
+    """Наивный поиск подстрок: каждое запрещённое имя проверяется через `in`"""
+    normalized_name = legacy_normalize_text(name)
+    for restricted_name, allowed_users in RESTRICTED_NAMES.items():
+        if legacy_normalize_text(restricted_name) in normalized_name:
+            if not allowed_users or user_id not in allowed_users:
+                return True
+    return False
+
+
+def make_names(count, seed=1):
+    rng = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyzабвгдеёжзийклмнопрстуфхцчшщъыьэюя0134 '
+    names = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            # Попытки обхода: похожие символы, регистр, обрамление
+            base = rng.choice(list(RESTRICTED_NAMES))
+            base = ''.join(char.upper() if rng.random() < 0.5 else char for char in base)
+            names.append(rng.choice(['', 'x', 'the']) + base + rng.choice(['', 'x', '1']))
+        else:
+            names.append(''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 16))))
+    return names
+
+
+def bench(label, fn, names, number):
+    seconds = timeit.timeit(lambda: [fn(name, 1) for name in names], number=number)
+    per_call = seconds / (number * len(names)) * 1e6
+    print(f"{label:<40} {per_call:8.2f} мкс/имя")
+    return per_call
+
+
+def main():
+    names = make_names(2000)
+    number = 20
+
+    # Результаты должны совпадать с прежней реализацией
+    for name in names:
+        assert normalize_text(name) == legacy_normalize_text(name), name
+        assert is_name_allowed(name, 1) == legacy_is_name_allowed(name, 1), name
+
+    substring_matcher = RestrictedNameMatcher(RESTRICTED_NAMES, substrings=True)
+    for name in names:
+        assert substring_matcher.is_restricted(name, 1) == legacy_substring_check(name, 1), name
+
+    print(f"{len(names)} имён, {number} повторов\n")
+    old = bench("normalize_text (прежняя, +=)", lambda name, _: legacy_normalize_text(name), names, number)
+    new = bench("normalize_text (str.translate)", lambda name, _: normalize_text(name), names, number)
+    print(f"{'':<40} x{old / new:.1f}\n")
+
+    old = bench("is_name_allowed (прежняя)", legacy_is_name_allowed, names, number)
+    new = bench("is_name_allowed (скомпилированная)", is_name_allowed, names, number)
+    print(f"{'':<40} x{old / new:.1f}\n")
+
+    old = bench("подстроки (наивно, `in`)", legacy_substring_check, names, number)
+    new = bench("подстроки (Ахо-Корасик)", substring_matcher.is_restricted, names, number)
+    print(f"{'':<40} x{old / new:.1f}")
+    print(f"\nRESTRICTED_NAME_SUBSTRINGS = {restricted_names.restricted_matcher.substrings}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Общие данные для микробенчмарков.
+
+Размеры задаются переменными окружения, по умолчанию - как у живого бота
+на пике и с запасом:
+    BENCH_USERS=10000,100000,1000000  - число пользователей в индексе каналов
+    BENCH_HISTORY_ROWS=1000000        - сообщений в истории (по 3 копии на каждое)
+Базы создаются во временном каталоге и удаляются после прогона.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+
+# main создаёт Bot при импорте, а aiogram проверяет формат токена
+config.BOT_TOKEN = '123456:BENCHMARK'
+config.METRICS_PORT = 0
+
+USER_SIZES = [int(size) for size in os.environ.get('BENCH_USERS', '10000,100000,1000000').split(',')]
+HISTORY_ROWS = int(os.environ.get('BENCH_HISTORY_ROWS', '1000000'))
+COPIES_PER_MESSAGE = 3
+HISTORY_MONTHS = ((2026, 1), (2026, 2), (2026, 3))  # история в трёх разделах
+
+
+@pytest.fixture(scope='session')
+def workdir():
+    path = tempfile.mkdtemp(prefix='bench-')
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+_indexes = {}
+
+
+@pytest.fixture(params=USER_SIZES, ids=lambda size: f'{size}users')
+def channel_index(request, monkeypatch):
+    """ChannelIndex с пользователями, случайно разбросанными по каналам; подменяет main.channel_index"""
+    import main
+    from channel_index import ChannelIndex
+
+    size = request.param
+    if size not in _indexes:
+        rng = random.Random(size)
+        index = ChannelIndex()
+        for user_id in range(1, size + 1):
+            index.set_channel(user_id, rng.randint(config.MIN_CHANNEL, config.MAX_CHANNEL))
+        _indexes[size] = index
+    monkeypatch.setattr(main, 'channel_index', _indexes[size])
+    return _indexes[size]
+
+
+@pytest.fixture(scope='session')
+def history(workdir):
+    """
+    HistoryPartitions с HISTORY_ROWS сообщениями в трёх месячных разделах
+    и пустой messages.db. Возвращает (history, [(recipient_id, message_id)] доставленных копий).
+    """
+    from datetime import datetime
+
+    from messages_db import HistoryPartitions, MIGRATIONS, messages_db
+    from migrations import run_migrations
+
+    messages_db.init(os.path.join(workdir, 'messages.db'), pragmas=config.SQLITE_PRAGMAS)
+    messages_db.connect(reuse_if_open=True)
+    run_migrations(messages_db, MIGRATIONS)
+
+    partitions = HistoryPartitions(directory=os.path.join(workdir, 'history'))
+    rng = random.Random(0)
+    copies = []
+    per_month = HISTORY_ROWS // len(HISTORY_MONTHS)
+    message_ids = iter(range(1, 10 ** 9))
+    for year, month in HISTORY_MONTHS:
+        timestamp = int(datetime(year, month, 15).timestamp())
+        for start in range(0, per_month, 10000):
+            rows = []
+            for _ in range(min(10000, per_month - start)):
+                sender_id = rng.randint(1, 100000)
+                results = [(rng.randint(1, 100000), next(message_ids)) for _ in range(COPIES_PER_MESSAGE)]
+                rows.append((sender_id, 'Bench', results, 'benchmark message', timestamp, next(message_ids)))
+            copies.extend(results[0] for _, _, results, _, _, _ in rows[::100])
+            partitions.save_many(rows)
+    return partitions, copies
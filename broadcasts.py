@@ -0,0 +1,156 @@
+import asyncio
+import time
+import traceback
+from datetime import datetime
+
+from aiogram.utils.exceptions import MessageNotModified
+
+import async_db
+import config
+from database import BroadcastJob, User, db
+
+
+class BroadcastRunner:
+    """
+    Фоновые рассылки всем пользователям.
+    Каждая рассылка - запись BroadcastJob с курсором по user_id.
+    Курсор сохраняется до отправки очередной пачки, поэтому после
+    перезапуска рассылка продолжается без повторных сообщений
+    (ценой того, что прерванная пачка может не дойти).
+    """
+
+    def __init__(self, bot, delivery, make_markup):
+        self._bot = bot
+        self._delivery = delivery
+        self._make_markup = make_markup  # make_markup(button) -> reply_markup
+        self._tasks = {}  # {job_id: asyncio.Task}
+        self._cancelled = set()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def is_running(self, job_id):
+        return job_id in self._tasks
+
+    async def start(self, kind, text, button, status_message):
+        """Создаёт рассылку и запускает её в фоне"""
+        total = await async_db.run_read(db, User.select().count)
+        job = await async_db.run_write(
+            db, BroadcastJob.create,
+            kind=kind,
+            text=text,
+            button=button,
+            total=total,
+            status_chat_id=status_message.chat.id,
+            status_message_id=status_message.message_id
+        )
+        self._spawn(job)
+        return job
+
+    async def resume_all(self):
+        """Продолжает рассылки, прерванные перезапуском"""
+        jobs = await async_db.run_read(
+            db, lambda: list(BroadcastJob.select().where(BroadcastJob.status == 'running'))
+        )
+        for job in jobs:
+            print(f"Resuming broadcast #{job.id} from user_id {job.cursor}")
+            self._spawn(job)
+
+    def cancel(self, job_id):
+        """Останавливает рассылку после текущей пачки"""
+        if job_id not in self._tasks:
+            return False
+        self._cancelled.add(job_id)
+        return True
+
+    def _spawn(self, job):
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+
+    async def _run(self, job):
+        try:
+            markup = self._make_markup(job.button)
+            last_progress = 0.0
+
+            def send(user_id):
+                return self._bot.send_message(
+                    user_id,
+                    job.text,
+                    parse_mode="Markdown",
+                    reply_markup=markup,
+                    disable_web_page_preview=False
+                )
+
+            while job.id not in self._cancelled:
+                cursor = job.cursor
+                user_ids = await async_db.run_read(db, lambda: [
+                    user_id for (user_id,) in
+                    User.select(User.user_id)
+                    .where(User.user_id > cursor)
+                    .order_by(User.user_id)
+                    .limit(config.BROADCAST_BATCH_SIZE)
+                    .tuples()
+                ])
+                if not user_ids:
+                    job.status = 'done'
+                    break
+
+                # Сначала сдвигаем курсор, потом отправляем - так пачка не уйдёт дважды
+                job.cursor = user_ids[-1]
+                await async_db.save(job)
+
+                for result in await self._delivery.fan_out(user_ids, send):
+                    if result.error:
+                        job.failed += 1
+                        print(f"Failed to send broadcast #{job.id} to {result.chat_id}: {result.error}")
+                    else:
+                        job.sent += 1
+
+                if time.monotonic() - last_progress >= config.BROADCAST_PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    await self._show_progress(job)
+
+            if job.id in self._cancelled:
+                job.status = 'cancelled'
+            job.finished_at = datetime.now()
+            await async_db.save(job)
+            await self._show_progress(job)
+
+        except Exception as e:
+            print(f"\n{'='*50}")
+            print(f"[ERROR] Error in broadcast #{job.id}: {e}")
+            print(traceback.format_exc())
+            print(f"{'='*50}\n")
+        finally:
+            self._tasks.pop(job.id, None)
+            self._cancelled.discard(job.id)
+
+    async def _show_progress(self, job):
+        if not job.status_message_id:
+            return
+        try:
+            await self._bot.edit_message_text(
+                format_progress(job),
+                chat_id=job.status_chat_id,
+                message_id=job.status_message_id,
+                parse_mode="Markdown"
+            )
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            print(f"Failed to update broadcast #{job.id} progress: {e}")
+
+
+def format_progress(job):
+    """Текст сообщения с прогрессом рассылки"""
+    title = "Обновление" if job.kind == 'version' else "Рассылка"
+    if job.status == 'done':
+        header = f"✅ *{title} #{job.id} завершена*"
+    elif job.status == 'cancelled':
+        header = f"🛑 *{title} #{job.id} остановлена*"
+    else:
+        header = f"📡 *{title} #{job.id} идёт...*\nОстановить: `/bcancel {job.id}`"
+    return (
+        f"{header}\n\n"
+        f"👥 Отправлено: `{job.sent}/{job.total}`\n"
+        f"❌ Ошибок: `{job.failed}`"
+    )
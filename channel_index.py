@@ -0,0 +1,234 @@
+import asyncio
+import heapq
+import random
+import time
+import traceback
+
+from peewee import chunked, fn
+
+import async_db
+import config
+from database import User
+from state import ChannelChange, ChannelMember, state_db
+
+
+class ChannelIndex:
+    """
+    Индекс канал -> участники, хранится в памяти процесса.
+    Рядом с ним - куча (население, канал) для поиска самого пустого канала;
+    устаревшие записи кучи отбрасываются лениво.
+    """
+
+    def __init__(self):
+        self._members = {}  # {channel: set(user_id)}
+        self._channels = {}  # {user_id: channel}
+        self._snapshots = {}  # {channel: tuple(user_id)} - кеш для рассылки
+        self._heap = []  # [(население, канал)]
+
+    def load(self):
+        """Загружает индекс из users.db"""
+        self._fill(User.select(User.user_id, User.channel).tuples())
+        print(f"Channel index loaded: {len(self._channels)} users in {len(self._members)} channels")
+
+    def _fill(self, pairs):
+        """Заполняет индекс заново, pairs - пары (user_id, канал)"""
+        self._members.clear()
+        self._channels.clear()
+        self._snapshots.clear()
+        for user_id, channel in pairs:
+            self._channels[user_id] = channel
+            self._members.setdefault(channel, set()).add(user_id)
+        self._heap = [(len(members), channel) for channel, members in self._members.items()]
+        heapq.heapify(self._heap)
+
+    def set_channel(self, user_id, channel):
+        """Добавляет пользователя в канал (или переносит из старого)"""
+        old_channel = self._channels.get(user_id)
+        if old_channel == channel:
+            return
+        if old_channel is not None:
+            self._discard(user_id, old_channel)
+        self._channels[user_id] = channel
+        self._members.setdefault(channel, set()).add(user_id)
+        self._snapshots.pop(channel, None)
+        self._push(channel)
+
+    def remove(self, user_id):
+        """Удаляет пользователя из индекса"""
+        channel = self._channels.pop(user_id, None)
+        if channel is not None:
+            self._discard(user_id, channel)
+
+    def _discard(self, user_id, channel):
+        members = self._members.get(channel)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self._members[channel]
+        self._snapshots.pop(channel, None)
+        self._push(channel)
+
+    def _push(self, channel):
+        """Записывает в кучу новое население канала"""
+        members = self._members.get(channel)
+        if members:
+            heapq.heappush(self._heap, (len(members), channel))
+        # Когда устаревших записей становится слишком много - пересобираем кучу
+        if len(self._heap) > 2 * len(self._members) + 64:
+            self._heap = [(len(members), channel) for channel, members in self._members.items()]
+            heapq.heapify(self._heap)
+
+    def get_channel(self, user_id):
+        return self._channels.get(user_id)
+
+    def members(self, channel):
+        """
+        Возвращает неизменяемый снимок участников канала.
+        Снимок кешируется до следующего изменения канала, поэтому
+        его безопасно обходить между await'ами.
+        """
+        snapshot = self._snapshots.get(channel)
+        if snapshot is None:
+            snapshot = tuple(self._members.get(channel, ()))
+            self._snapshots[channel] = snapshot
+        return snapshot
+
+    def count(self, channel):
+        return len(self._members.get(channel, ()))
+
+    def channels(self):
+        return list(self._members)
+
+    def populations(self):
+        """{канал: число участников} для всех непустых каналов"""
+        return {channel: len(members) for channel, members in self._members.items()}
+
+    def least_populated(self, exclude=()):
+        """Канал с наименьшим числом участников или None, если каналов нет"""
+        skipped = []
+        try:
+            while self._heap:
+                population, channel = self._heap[0]
+                if self.count(channel) != population:
+                    heapq.heappop(self._heap)
+                elif channel in exclude:
+                    skipped.append(heapq.heappop(self._heap))
+                else:
+                    return channel
+            return None
+        finally:
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+
+
+class SharedChannelIndex(ChannelIndex):
+    """
+    ChannelIndex, общий для воркеров. Читается из копии в памяти, как и
+    обычный индекс, поэтому выборки остаются O(1) и кучей. Свои изменения
+    копятся и пачкой уходят в state.db, чужие приходят из журнала
+    ChannelChange - с задержкой до STATE_EVENT_POLL_INTERVAL.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pending = {}  # {user_id: канал или None}, ещё не записанные в state.db
+        self._last_change = 0  # последний применённый ChannelChange.id
+
+    def rebuild(self):
+        """Перестраивает таблицу по users.db (делает процесс-родитель до запуска воркеров)"""
+        pairs = list(User.select(User.user_id, User.channel).tuples())
+        with state_db.atomic():
+            ChannelMember.delete().execute()
+            ChannelChange.delete().execute()
+            for start in range(0, len(pairs), 500):
+                ChannelMember.insert_many(
+                    pairs[start:start + 500],
+                    fields=[ChannelMember.user_id, ChannelMember.channel]
+                ).execute()
+        print(f"Shared channel index loaded: {len(pairs)} users")
+
+    def load(self):
+        """Загружает копию индекса из state.db"""
+        # Одна транзакция - снимок таблицы согласован с номером журнала
+        with state_db.atomic():
+            self._last_change = ChannelChange.select(fn.MAX(ChannelChange.id)).scalar() or 0
+            self._fill(ChannelMember.select(ChannelMember.user_id, ChannelMember.channel).tuples())
+        self._pending.clear()
+        print(f"Channel index loaded from state.db: {len(self._channels)} users in {len(self._members)} channels")
+
+    def set_channel(self, user_id, channel):
+        super().set_channel(user_id, channel)
+        self._pending[user_id] = channel
+
+    def remove(self, user_id):
+        super().remove(user_id)
+        self._pending[user_id] = None
+
+    def _exchange(self, pending):
+        """Пишет свои изменения и возвращает чужие, пришедшие раньше них (поток-писатель state.db)"""
+        now = time.time()
+        with state_db.atomic(lock_type='IMMEDIATE'):
+            changes = list(
+                ChannelChange.select(ChannelChange.user_id, ChannelChange.channel)
+                .where((ChannelChange.id > self._last_change) & (ChannelChange.worker != config.WORKER_INDEX))
+                .order_by(ChannelChange.id)
+                .tuples()
+            )
+            if pending:
+                moved = [(user_id, channel) for user_id, channel in pending.items() if channel is not None]
+                removed = [user_id for user_id, channel in pending.items() if channel is None]
+                for batch in chunked(moved, 500):
+                    ChannelMember.replace_many(batch, fields=[ChannelMember.user_id, ChannelMember.channel]).execute()
+                for batch in chunked(removed, 500):
+                    ChannelMember.delete().where(ChannelMember.user_id.in_(batch)).execute()
+                for batch in chunked(list(pending.items()), 200):
+                    ChannelChange.insert_many(
+                        [(user_id, channel, config.WORKER_INDEX, now) for user_id, channel in batch],
+                        fields=[ChannelChange.user_id, ChannelChange.channel, ChannelChange.worker,
+                                ChannelChange.created_at]
+                    ).execute()
+                if random.random() < 0.01:
+                    ChannelChange.delete().where(ChannelChange.created_at < now - config.STATE_EVENT_TTL).execute()
+            self._last_change = ChannelChange.select(fn.MAX(ChannelChange.id)).scalar() or self._last_change
+        return changes
+
+    async def sync(self):
+        """Отправляет свои изменения в state.db и применяет изменения других воркеров"""
+        pending, self._pending = self._pending, {}
+        try:
+            changes = await async_db.run_write(state_db, self._exchange, pending)
+        except Exception:
+            # Вернём неотправленное в очередь; то, что успели изменить за это время, новее
+            for user_id, channel in pending.items():
+                self._pending.setdefault(user_id, channel)
+            raise
+        for user_id, channel in changes:
+            # Чужие изменения старше своих - свои (отправленные и ещё нет) не перетираем
+            if user_id in pending or user_id in self._pending:
+                continue
+            if channel is None:
+                ChannelIndex.remove(self, user_id)
+            else:
+                ChannelIndex.set_channel(self, user_id, channel)
+
+    async def run(self):
+        """Обменивается изменениями с другими воркерами, пока работает бот"""
+        while True:
+            await asyncio.sleep(config.STATE_EVENT_POLL_INTERVAL)
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"\n{'='*50}")
+                print(f"[ERROR] Failed to sync channel index: {e}")
+                print(traceback.format_exc())
+                print(f"{'='*50}\n")
+
+
+def create_channel_index():
+    """Индекс каналов для выбранного STATE_BACKEND"""
+    if config.STATE_BACKEND == 'sqlite':
+        return SharedChannelIndex()
+    return ChannelIndex()
+
+
+channel_index = create_channel_index()
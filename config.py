@@ -1,32 +1,128 @@
-BOT_TOKEN = "YOUR_BOT_TOKEN"  # Токен вашего бота
-OWNER_ID = 123456789  # ID владельца бота
-
-# Настройки каналов
-MIN_CHANNEL = 1000
-MAX_CHANNEL = 9999
-CHANNEL_CREATION_CHANCE = 0.3
-
-# Настройки переключения
-SWITCH_TIME_MIN = 600  # минимальное время до переключения (в секундах)
-SWITCH_TIME_MAX = 1200  # максимальное время до переключения (в секундах)
-
-# Время удаления статистики
-DELETE_STATS_AFTER = 5  # секунды 
-
-PRISON_CHANNEL = 1488  # Специальный канал
-PRISON_MESSAGES = [  # Случайные сообщения-каша
-    "⌘∮≈∰∲∳⊗⊕⊖⊘⊙⊚⊛⊜⊝⊞⊟⊠⊡⋄⋅⋆⋇⋈⋉⋊⋋⋌⋍⋎⋏",
-    "▀▄█▌▐░▒▓■□▢▣▤▥▦▧▨▩▪▫▬▭▮▯▰▱▲△▴▵▶▷▸▹►▻▼▽▾▿◀",
-    "☠☡☢☣☤☥☦☧☨☩☪☫☬☭☮☯☰☱☲☳☴☵☶☷☸☹☺☻☼☽☾☿",
-    "✀✁✂✃✄✅✆✇✈✉✊✋✌✍✎✏✐✑✒✓✔✕✖✗✘✙✚✛✜✝✞✟",
-    "⚈⚉⚊⚋⚌⚍⚎⚏⚐⚑⚒⚓⚔⚕⚖⚗⚘⚙⚚⚛⚜⚝⚞⚟⚠⚡⚢⚣⚤⚥⚦⚧⚨⚩⚪⚫⚬⚭⚮⚯"
-] 
-
-# ID канала для обновлений
-UPDATE_CHANNEL = -100000000000  # Замените на ID вашего канала
-
-MEDIA_ALLOWED_USERS = []  # Добавьте ID пользователей с правом отправки медиа
-
-# Задержки
-BROADCAST_DELAY = 0.1
-MESSAGE_DELAY = 3 
\ No newline at end of file
+BOT_TOKEN = "YOUR_BOT_TOKEN"  # Токен вашего бота
+OWNER_ID = 123456789  # ID владельца бота
+BOT_API_SERVER = ""  # свой сервер Bot API, например http://127.0.0.1:8090 (пусто - api.telegram.org)
+
+# Настройки каналов
+MIN_CHANNEL = 1000
+MAX_CHANNEL = 9999
+CHANNEL_CREATION_CHANCE = 0.3
+
+# Настройки переключения
+SWITCH_TIME_MIN = 600  # минимальное время до переключения (в секундах)
+SWITCH_TIME_MAX = 1200  # максимальное время до переключения (в секундах)
+SWITCH_BATCH_SIZE = 100  # сколько переключений обрабатывать за один проход
+
+# Время удаления статистики
+DELETE_STATS_AFTER = 5  # секунды 
+
+PRISON_CHANNEL = 1488  # Специальный канал
+PRISON_RELEASE_BATCH_SIZE = 100  # сколько заключённых освобождать за один проход
+PRISON_RELEASE_RETRY = 60  # через сколько секунд повторить неудачное освобождение
+PRISON_MESSAGES = [  # Случайные сообщения-каша
+    "⌘∮≈∰∲∳⊗⊕⊖⊘⊙⊚⊛⊜⊝⊞⊟⊠⊡⋄⋅⋆⋇⋈⋉⋊⋋⋌⋍⋎⋏",
+    "▀▄█▌▐░▒▓■□▢▣▤▥▦▧▨▩▪▫▬▭▮▯▰▱▲△▴▵▶▷▸▹►▻▼▽▾▿◀",
+    "☠☡☢☣☤☥☦☧☨☩☪☫☬☭☮☯☰☱☲☳☴☵☶☷☸☹☺☻☼☽☾☿",
+    "✀✁✂✃✄✅✆✇✈✉✊✋✌✍✎✏✐✑✒✓✔✕✖✗✘✙✚✛✜✝✞✟",
+    "⚈⚉⚊⚋⚌⚍⚎⚏⚐⚑⚒⚓⚔⚕⚖⚗⚘⚙⚚⚛⚜⚝⚞⚟⚠⚡⚢⚣⚤⚥⚦⚧⚨⚩⚪⚫⚬⚭⚮⚯"
+] 
+
+# ID канала для обновлений
+UPDATE_CHANNEL = -100000000000  # Замените на ID вашего канала
+
+MEDIA_ALLOWED_USERS = []  # Добавьте ID пользователей с правом отправки медиа
+
+# Дополнительные случайные имена к спискам пакета names
+EXTRA_NAMES = {  # {'first:male' | 'first:female' | 'last': [имена]}
+    # 'first:male': ['Иван', 'Пётр'],
+}
+
+# Запрещённые имена (restricted_names.py)
+RESTRICTED_NAME_SUBSTRINGS = False  # запрещать и имена, содержащие запрещённое ("xAdminx")
+
+# Задержки
+MESSAGE_DELAY = 3
+
+# Защита от флуда
+FLOOD_USER_WINDOWS = [  # (секунд, сообщений): не больше стольких сообщений за окно
+    (MESSAGE_DELAY, 1),
+    (60, 12),
+]
+# Сообщение стоит каналу столько токенов, сколько в нём получателей,
+# поэтому лимит задан в доставках: один канал берёт не больше половины
+# DELIVERY_GLOBAL_RATE и не выедает общий бюджет рассылки
+FLOOD_CHANNEL_RATE = 15  # доставок в секунду на один канал
+FLOOD_CHANNEL_BURST = 150  # сколько доставок канал может сделать подряд
+FLOOD_MAX_USERS = 100000  # максимум пользователей в памяти (сверх этого - самые давние)
+
+# Движок рассылки (лимиты Telegram Bot API)
+DELIVERY_GLOBAL_RATE = 30  # сообщений в секунду на весь бот
+DELIVERY_CHAT_RATE = 1  # сообщений в секунду в один чат
+DELIVERY_CHAT_BURST = 3  # сколько сообщений в чат можно отправить подряд
+DELIVERY_CONCURRENCY = 20  # одновременных запросов к API
+DELIVERY_MAX_RETRIES = 3  # повторов после RetryAfter
+DELIVERY_MAX_CHAT_BUCKETS = 10000  # после этого простаивающие чаты вычищаются
+
+# Рассылки /broadcast и /version
+BROADCAST_BATCH_SIZE = 100  # пользователей за одну пачку (курсор сохраняется после каждой)
+BROADCAST_PROGRESS_INTERVAL = 3  # как часто обновлять сообщение с прогрессом (секунды) 
+
+# Альбомы (media_group_id)
+ALBUM_COLLECT_DELAY = 0.5  # сколько секунд ждать следующий элемент альбома перед рассылкой
+
+# Соответствия копий сообщений (для реакций)
+MAPPING_CACHE_MAX_ENTRIES = 200000  # максимум копий в памяти
+MAPPING_CACHE_TTL = 3600  # сколько секунд держать сообщение в памяти
+# Какие обновления запрашивать у Telegram: message_reaction без явного запроса не приходит
+ALLOWED_UPDATES = ['message', 'callback_query', 'message_reaction']
+
+# База данных
+DB_READ_THREADS = 4  # потоков для чтения из SQLite
+SQLITE_PRAGMAS = {  # применяются к каждому соединению
+    'journal_mode': 'wal',  # чтения не блокируются записью
+    'synchronous': 1,  # NORMAL - в режиме WAL безопасно и без fsync на каждый коммит
+    'cache_size': -64000,  # 64 МБ кеша страниц
+    'mmap_size': 268435456,  # 256 МБ отображения в память
+    'foreign_keys': 1,
+    'busy_timeout': 5000,  # мс ожидания блокировки вместо ошибки
+}
+HISTORY_BATCH_SIZE = 100  # сколько сообщений истории писать одной транзакцией
+HISTORY_FLUSH_INTERVAL_MS = 500  # как часто сбрасывать неполную пачку
+HISTORY_MAX_PENDING = 10000  # максимум сообщений истории в очереди на запись
+HISTORY_RETENTION_DAYS = 0  # сколько дней хранить историю сообщений (0 - хранить всегда, например 90 - удалять старше 90 дней)
+HISTORY_PARTITION = 'month'  # 'month' или 'day' - на какие периоды делить файлы истории
+HISTORY_DIR = 'history'  # каталог с файлами-разделами истории
+HISTORY_PRUNE_INTERVAL = 3600  # как часто запускать очистку истории (секунды)
+HISTORY_PRUNE_BATCH = 500  # сообщений, удаляемых одной транзакцией
+HISTORY_PRUNE_PAUSE = 0.05  # пауза между пачками, чтобы очистка не занимала запись
+HISTORY_VACUUM_PAGES = 1000  # страниц, возвращаемых одним шагом incremental_vacuum
+
+# Кеш профилей пользователей
+USER_CACHE_SIZE = 50000  # максимум профилей в памяти
+MARKUP_CACHE_SIZE = 10000  # максимум готовых кнопок с именами
+
+# Режим webhook (вместо long polling)
+USE_WEBHOOK = False
+WEBHOOK_URL = ""  # публичный адрес, например https://example.com (пусто - не регистрировать)
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_HOST = "127.0.0.1"
+WEBHOOK_PORT = 8080
+WEBHOOK_SECRET = ""  # секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_CONCURRENCY = 100  # одновременно обрабатываемых обновлений
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_HOST = "127.0.0.1"  # только локально, наружу не открывать
+METRICS_PORT = 9100  # 0 - не запускать; воркер i слушает METRICS_PORT + i
+
+# Профилирование обновлений (/slow)
+SLOW_UPDATE_THRESHOLD = 1.0  # обновления дольше стольких секунд считаются медленными
+SLOW_UPDATES_KEEP = 100  # сколько последних медленных обновлений помнить
+PROFILE_SAMPLE_RATE = 0.0  # доля обновлений, снимаемых с cProfile (0 - не снимать, профайлер замедляет бота)
+PROFILE_TOP_FUNCTIONS = 25  # строк отчёта cProfile
+
+# Несколько процессов-воркеров (python sharding.py, только webhook)
+WORKERS = 1  # больше 1 - обновления делятся между воркерами по user_id
+WORKER_BASE_PORT = 8081  # воркер i слушает 127.0.0.1:WORKER_BASE_PORT + i
+WORKER_INDEX = 0  # номер текущего воркера, выставляется при запуске
+STATE_BACKEND = 'memory'  # 'memory' - один процесс, 'sqlite' - общее состояние в state.db
+STATE_EVENT_POLL_INTERVAL = 0.5  # как часто воркер читает события других воркеров (секунды)
+STATE_EVENT_TTL = 3600  # сколько секунд хранить события
@@ -1,116 +1,143 @@
-from peewee import *
-from datetime import datetime
-import json
-
-db = SqliteDatabase('users.db')
-
-class BaseModel(Model):
-    class Meta:
-        database = db
-
-class User(BaseModel):
-    user_id = BigIntegerField(unique=True)
-    channel = IntegerField()
-    name = TextField()  # Базовое имя
-    custom_name = TextField(null=True)  # Кастомное имя
-    emoji = TextField(null=True)  # Эмодзи
-    created_at = DateTimeField(default=datetime.now)
-    
-    @classmethod
-    def create_or_update(cls, **kwargs):
-        user = cls.get_or_none(cls.user_id == kwargs['user_id'])
-        if user:
-            for key, value in kwargs.items():
-                setattr(user, key, value)
-            user.save()
-            return user
-        return cls.create(**kwargs)
-    
-    @classmethod
-    def get_user(cls, user_id):
-        return cls.get_or_none(cls.user_id == user_id)
-    
-    @classmethod
-    def get_channel_users(cls, channel):
-        return cls.select().where(cls.channel == channel)
-    
-    def get_display_name(self):
-        """Получить отображаемое имя пользователя"""
-        display_name = self.custom_name if self.custom_name else self.name
-        if self.emoji:
-            display_name = f"{self.emoji} {display_name}"
-        return display_name
-
-class PrisonUser(BaseModel):
-    user_id = BigIntegerField(unique=True)
-    reason = TextField()
-    until = BigIntegerField(null=True)  # null значит навсегда
-    created_at = DateTimeField(default=datetime.now)
-    
-    @property
-    def remaining_time(self):
-        """Возвращает оставшееся время в секундах"""
-        if self.until is None:  # Если срок вечный
-            return float('inf')
-        remaining = self.until - int(datetime.now().timestamp())
-        return max(0, remaining)  # Не возвращаем отрицательное время
-
-def init_db():
-    db.connect()
-    
-    # Создаем таблицы если их нет
-    db.create_tables([User, PrisonUser], safe=True)
-    
-    # Проверяем существование новых колонок
-    cursor = db.execute_sql('PRAGMA table_info(user)')
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    # Добавляем новые колонки если их нет
-    if 'emoji' not in columns:
-        db.execute_sql('ALTER TABLE user ADD COLUMN emoji TEXT NULL')
-    if 'custom_name' not in columns:
-        db.execute_sql('ALTER TABLE user ADD COLUMN custom_name TEXT NULL')
-        
-    # Удаляем старые ненужные колонки если они есть
-    if 'use_custom_name' in columns:
-        # Копируем данные во временную таблицу
-        db.execute_sql('''
-            CREATE TABLE user_backup(
-                id INTEGER PRIMARY KEY,
-                user_id BIGINT UNIQUE,
-                channel INTEGER,
-                name TEXT,
-                custom_name TEXT,
-                emoji TEXT,
-                created_at DATETIME
-            )
-        ''')
-        db.execute_sql('''
-            INSERT INTO user_backup 
-            SELECT id, user_id, channel, name, custom_name, emoji, created_at 
-            FROM user
-        ''')
-        # Удаляем старую таблицу
-        db.execute_sql('DROP TABLE user')
-        # Создаем новую таблицу
-        db.execute_sql('''
-            CREATE TABLE user(
-                id INTEGER PRIMARY KEY,
-                user_id BIGINT UNIQUE,
-                channel INTEGER,
-                name TEXT,
-                custom_name TEXT,
-                emoji TEXT,
-                created_at DATETIME
-            )
-        ''')
-        # Восстанавливаем данные
-        db.execute_sql('''
-            INSERT INTO user 
-            SELECT id, user_id, channel, name, custom_name, emoji, created_at 
-            FROM user_backup
-        ''')
-        # Удаляем временную таблицу
-        db.execute_sql('DROP TABLE user_backup')
-    
-    print("Database updated successfully")
\ No newline at end of file
+from peewee import *
+from datetime import datetime
+import json
+
+import config
+from migrations import run_migrations, get_columns, add_column, create_index
+
+db = SqliteDatabase('users.db', pragmas=config.SQLITE_PRAGMAS)
+
+class BaseModel(Model):
+    class Meta:
+        database = db
+
+class User(BaseModel):
+    user_id = BigIntegerField(unique=True)
+    channel = IntegerField(index=True)
+    name = TextField()  # Базовое имя
+    custom_name = TextField(null=True)  # Кастомное имя
+    emoji = TextField(null=True)  # Эмодзи
+    created_at = DateTimeField(default=datetime.now)
+    
+    @classmethod
+    def create_or_update(cls, **kwargs):
+        user = cls.get_or_none(cls.user_id == kwargs['user_id'])
+        if user:
+            for key, value in kwargs.items():
+                setattr(user, key, value)
+            user.save()
+            return user
+        return cls.create(**kwargs)
+    
+    @classmethod
+    def get_user(cls, user_id):
+        return cls.get_or_none(cls.user_id == user_id)
+    
+    @classmethod
+    def get_channel_users(cls, channel):
+        return cls.select().where(cls.channel == channel)
+    
+    def get_display_name(self):
+        """Получить отображаемое имя пользователя"""
+        display_name = self.custom_name if self.custom_name else self.name
+        if self.emoji:
+            display_name = f"{self.emoji} {display_name}"
+        return display_name
+
+class PrisonUser(BaseModel):
+    user_id = BigIntegerField(unique=True)
+    reason = TextField()
+    until = BigIntegerField(null=True)  # null значит навсегда
+    created_at = DateTimeField(default=datetime.now)
+    
+    @property
+    def remaining_time(self):
+        """Возвращает оставшееся время в секундах"""
+        if self.until is None:  # Если срок вечный
+            return float('inf')
+        remaining = self.until - int(datetime.now().timestamp())
+        return max(0, remaining)  # Не возвращаем отрицательное время
+
+class BroadcastJob(BaseModel):
+    """Рассылка всем пользователям, которую можно продолжить после перезапуска"""
+    kind = TextField()  # broadcast или version
+    text = TextField()
+    button = TextField()  # имя на кнопке отправителя
+    cursor = BigIntegerField(default=0)  # последний user_id, которому рассылка уже ушла
+    total = IntegerField(default=0)
+    sent = IntegerField(default=0)
+    failed = IntegerField(default=0)
+    status = TextField(default='running', index=True)  # running, done, cancelled
+    status_chat_id = BigIntegerField(null=True)  # сообщение с прогрессом
+    status_message_id = BigIntegerField(null=True)
+    created_at = DateTimeField(default=datetime.now)
+    finished_at = DateTimeField(null=True)
+
+def _create_tables(database):
+    database.create_tables([User, PrisonUser], safe=True)
+
+def _update_user_columns(database):
+    columns = get_columns(database, 'user')
+    
+    # Добавляем новые колонки если их нет
+    add_column(database, 'user', 'emoji', 'TEXT NULL')
+    add_column(database, 'user', 'custom_name', 'TEXT NULL')
+        
+    # Удаляем старые ненужные колонки если они есть
+    if 'use_custom_name' in columns:
+        # Копируем данные во временную таблицу
+        database.execute_sql('''
+            CREATE TABLE user_backup(
+                id INTEGER PRIMARY KEY,
+                user_id BIGINT UNIQUE,
+                channel INTEGER,
+                name TEXT,
+                custom_name TEXT,
+                emoji TEXT,
+                created_at DATETIME
+            )
+        ''')
+        database.execute_sql('''
+            INSERT INTO user_backup 
+            SELECT id, user_id, channel, name, custom_name, emoji, created_at 
+            FROM user
+        ''')
+        # Удаляем старую таблицу
+        database.execute_sql('DROP TABLE user')
+        # Создаем новую таблицу
+        database.execute_sql('''
+            CREATE TABLE user(
+                id INTEGER PRIMARY KEY,
+                user_id BIGINT UNIQUE,
+                channel INTEGER,
+                name TEXT,
+                custom_name TEXT,
+                emoji TEXT,
+                created_at DATETIME
+            )
+        ''')
+        # Восстанавливаем данные
+        database.execute_sql('''
+            INSERT INTO user 
+            SELECT id, user_id, channel, name, custom_name, emoji, created_at 
+            FROM user_backup
+        ''')
+        # Удаляем временную таблицу
+        database.execute_sql('DROP TABLE user_backup')
+
+def _index_user_channel(database):
+    # По каналу фильтруется каждая рассылка
+    create_index(database, 'user_channel', 'user', ['channel'])
+
+# (версия, описание, миграция)
+MIGRATIONS = [
+    (1, 'create user and prisonuser tables', _create_tables),
+    (2, 'add emoji/custom_name, drop use_custom_name', _update_user_columns),
+    (3, 'index user.channel', _index_user_channel),
+    (4, 'create broadcastjob table', lambda database: database.create_tables([BroadcastJob], safe=True)),
+]
+
+def init_db():
+    db.connect(reuse_if_open=True)
+    run_migrations(db, MIGRATIONS)
+    print("Database updated successfully")
@@ -0,0 +1,184 @@
+import asyncio
+import time
+import traceback
+from collections import deque, namedtuple
+
+from aiogram.utils.exceptions import BotBlocked, ChatNotFound, UserDeactivated, RetryAfter
+
+import config
+import metrics
+
+# Результат доставки одному получателю: message - ответ API, error - исключение
+DeliveryResult = namedtuple('DeliveryResult', ['chat_id', 'message', 'error'])
+
+# Ошибки, после которых получатель считается ушедшим
+GONE_ERRORS = (BotBlocked, ChatNotFound, UserDeactivated)
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now, cost=1):
+        """Сколько секунд ждать до появления cost токенов (0 - токены есть)"""
+        self._refill(now)
+        # Дороже полной корзины платить нечем: ждём полную, а остаток уходит в долг
+        need = min(cost, self.capacity)
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self, now, cost=1):
+        self._refill(now)
+        self.tokens -= cost
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class TokenBuckets:
+    """Именованные token bucket'ы в памяти процесса"""
+
+    def __init__(self, max_buckets=None):
+        self._max_buckets = max_buckets or config.DELIVERY_MAX_CHAT_BUCKETS
+        self._buckets = {}  # {key: TokenBucket}
+        self._paused = {}  # {key: time.monotonic(), до которого корзина закрыта}
+
+    def _bucket(self, key, rate, capacity):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._max_buckets:
+                self._prune()
+            bucket = self._buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    def _prune(self):
+        """Удаляет полностью восстановившиеся (простаивающие) корзины"""
+        now = time.monotonic()
+        for key in [key for key, bucket in self._buckets.items() if bucket.is_idle(now)]:
+            del self._buckets[key]
+
+    async def acquire(self, limits, cost=1):
+        """
+        limits - [(key, rate, capacity)]. Берёт по cost токенов из каждой
+        корзины, если токены есть во всех, и возвращает 0; иначе ничего
+        не берёт и возвращает, сколько секунд ждать.
+        """
+        now = time.monotonic()
+        buckets = [self._bucket(key, rate, capacity) for key, rate, capacity in limits]
+        wait = max(bucket.wait_time(now, cost) for bucket in buckets)
+        for key, _, _ in limits:
+            wait = max(wait, self._paused.get(key, 0.0) - now)
+        if wait > 0:
+            return wait
+        for bucket in buckets:
+            bucket.take(now, cost)
+        return 0.0
+
+    async def pause(self, key, seconds):
+        """Закрывает корзину key на seconds секунд (после RetryAfter)"""
+        self._paused[key] = max(self._paused.get(key, 0.0), time.monotonic() + seconds)
+
+
+def create_buckets():
+    """Корзины лимитов для выбранного STATE_BACKEND"""
+    if config.STATE_BACKEND == 'sqlite':
+        from state import SharedTokenBuckets
+        return SharedTokenBuckets()
+    return TokenBuckets()
+
+
+class DeliveryEngine:
+    """
+    Общий движок рассылки для всех fan-out путей бота.
+    Соблюдает глобальный лимит и лимит на чат (token bucket),
+    ограничивает число одновременных запросов и переотправляет
+    сообщения после RetryAfter.
+    """
+
+    def __init__(self, global_rate=None, chat_rate=None, chat_burst=None,
+                 concurrency=None, max_retries=None, on_gone=None, buckets=None):
+        self._global_rate = global_rate or config.DELIVERY_GLOBAL_RATE
+        self._chat_rate = chat_rate or config.DELIVERY_CHAT_RATE
+        self._chat_burst = chat_burst or config.DELIVERY_CHAT_BURST
+        self._buckets = buckets or create_buckets()  # при общем состоянии лимиты делят все воркеры
+        self._concurrency = concurrency or config.DELIVERY_CONCURRENCY
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        self._max_retries = config.DELIVERY_MAX_RETRIES if max_retries is None else max_retries
+        self._on_gone = on_gone  # async on_gone(chat_id) - получатель заблокировал бота / удалён
+
+    async def _acquire(self, chat_id):
+        limits = [
+            ('global', self._global_rate, self._global_rate),
+            (f'chat:{chat_id}', self._chat_rate, self._chat_burst),
+        ]
+        while True:
+            wait = await self._buckets.acquire(limits)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _attempt(self, chat_id, send):
+        await self._acquire(chat_id)
+        async with self._semaphore:
+            return await send(chat_id)
+
+    async def send(self, chat_id, send):
+        """Отправляет одно сообщение через движок, send(chat_id) -> coroutine"""
+        return (await self.fan_out([chat_id], send))[0]
+
+    async def fan_out(self, chat_ids, send):
+        """
+        Рассылает сообщение списку получателей.
+        send(chat_id) должен возвращать новую корутину отправки.
+        Возвращает список DeliveryResult в порядке chat_ids.
+        """
+        start_time = time.perf_counter()
+        chat_ids = list(chat_ids)
+        queue = deque((index, 0) for index in range(len(chat_ids)))
+        results = [None] * len(chat_ids)
+
+        async def worker():
+            while queue:
+                index, attempt = queue.popleft()
+                chat_id = chat_ids[index]
+                try:
+                    message = await self._attempt(chat_id, send)
+                    results[index] = DeliveryResult(chat_id, message, None)
+                except RetryAfter as e:
+                    metrics.send_failures.inc(error=type(e).__name__)
+                    # После RetryAfter ждёт весь бот - при общем состоянии все воркеры
+                    await self._buckets.pause('global', e.timeout)
+                    if attempt < self._max_retries:
+                        # Возвращаем получателя в конец очереди
+                        queue.append((index, attempt + 1))
+                    else:
+                        results[index] = DeliveryResult(chat_id, None, e)
+                except GONE_ERRORS as e:
+                    metrics.send_failures.inc(error=type(e).__name__)
+                    results[index] = DeliveryResult(chat_id, None, e)
+                    if self._on_gone:
+                        try:
+                            await self._on_gone(chat_id)
+                        except Exception as cleanup_error:
+                            print(f"[ERROR] Failed to forget user {chat_id}: {cleanup_error}")
+                            print(traceback.format_exc())
+                except Exception as e:
+                    metrics.send_failures.inc(error=type(e).__name__)
+                    results[index] = DeliveryResult(chat_id, None, e)
+
+        workers = min(self._concurrency, len(chat_ids))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        metrics.fanout_seconds.observe(time.perf_counter() - start_time, size=metrics.fanout_size(len(chat_ids)))
+        return results
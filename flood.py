@@ -0,0 +1,115 @@
+import time
+from collections import OrderedDict, deque
+
+import config
+from delivery import create_buckets
+
+
+class FloodControl:
+    """
+    Защита от флуда: скользящие окна на пользователя и лимит на канал.
+    Проверка не обращается к API, а к базе - только за общим лимитом
+    канала при STATE_BACKEND = 'sqlite'. Записи пользователей истекают
+    вместе с самым длинным окном, поэтому память ограничена числом
+    недавно писавших, а не всех, кто когда-либо писал.
+    """
+
+    def __init__(self, windows=None, channel_rate=None, channel_burst=None, max_users=None, buckets=None):
+        self._windows = sorted(windows or config.FLOOD_USER_WINDOWS)  # [(секунд, сообщений)]
+        self._horizon = max(seconds for seconds, _ in self._windows)
+        self._depth = max(limit for _, limit in self._windows)
+        self._channel_rate = channel_rate or config.FLOOD_CHANNEL_RATE
+        self._channel_burst = channel_burst or config.FLOOD_CHANNEL_BURST
+        self._max_users = max_users or config.FLOOD_MAX_USERS
+        self._users = OrderedDict()  # {user_id: deque(время сообщений)}, по последней активности
+        self._warned = set()  # кого уже предупредили о текущей блокировке
+        self._buckets = buckets or create_buckets()  # лимиты каналов - общие при STATE_BACKEND = 'sqlite'
+        self.allowed = 0
+        self.rejected_user = 0
+        self.rejected_channel = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def _expire(self, now):
+        while self._users:
+            user_id, hits = next(iter(self._users.items()))
+            if hits[-1] + self._horizon > now:
+                break
+            del self._users[user_id]
+            self._warned.discard(user_id)
+
+    def _user_wait(self, hits, now):
+        wait = 0.0
+        for seconds, limit in self._windows:
+            if len(hits) >= limit:
+                # Ждём, пока limit-е с конца сообщение не выйдет из окна
+                wait = max(wait, hits[-limit] + seconds - now)
+        return wait
+
+    async def check(self, user_id, channel=None, recipients=1, now=None):
+        """
+        Пропускает сообщение или нет: 0 - можно отправлять (и сообщение
+        засчитано), иначе - сколько секунд подождать. Канал платит
+        за сообщение числом его получателей recipients.
+        """
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+
+        hits = self._users.get(user_id)
+        if hits:
+            wait = self._user_wait(hits, now)
+            if wait > 0:
+                self.rejected_user += 1
+                return wait
+
+        if channel is not None:
+            # Окна пользователя ничего не списывают, а acquire при отказе не берёт токенов,
+            # поэтому отклонённое сообщение при повторе не оплачивается дважды
+            wait = await self._buckets.acquire(
+                [(f'flood:{channel}', self._channel_rate, self._channel_burst)], max(1, recipients)
+            )
+            if wait > 0:
+                self.rejected_channel += 1
+                return wait
+
+        if hits is None:
+            hits = self._users[user_id] = deque(maxlen=self._depth)
+            if len(self._users) > self._max_users:
+                evicted, _ = self._users.popitem(last=False)
+                self._warned.discard(evicted)
+        else:
+            self._users.move_to_end(user_id)
+        hits.append(now)
+        self._warned.discard(user_id)
+        self.allowed += 1
+        return 0.0
+
+    def should_warn(self, user_id):
+        """Предупреждать о блокировке один раз, а не на каждое сообщение флуда"""
+        if user_id in self._warned:
+            return False
+        if user_id in self._users:
+            self._warned.add(user_id)
+        return True
+
+    def refund(self, user_id):
+        """Не засчитывать последнее сообщение (например, его не отправили)"""
+        hits = self._users.get(user_id)
+        if hits:
+            hits.pop()
+            if not hits:
+                # Пустая очередь сломала бы _expire - убираем пользователя целиком
+                del self._users[user_id]
+                self._warned.discard(user_id)
+
+    def stats(self):
+        return {
+            'users': len(self._users),
+            'allowed': self.allowed,
+            'rejected_user': self.rejected_user,
+            'rejected_channel': self.rejected_channel,
+        }
+
+
+flood_control = FloodControl()
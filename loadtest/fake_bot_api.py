@@ -0,0 +1,249 @@
+"""
+Локальная замена Bot API для нагрузочных тестов.
+
+Отвечает на запросы бота так же, как api.telegram.org, но без сети:
+с настраиваемой задержкой, лимитами отправки (ответ 429 с retry_after,
+как у Telegram) и внедрением ошибок RetryAfter и BotBlocked.
+Считает вызовы по методам, поэтому видно, сколько запросов к API
+уходит на одно логическое сообщение.
+
+Отдельный запуск (бот подключается через BOT_API_SERVER = "http://127.0.0.1:8090"):
+    python loadtest/fake_bot_api.py --port 8090 --latency 0.05
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+# Методы отправки: на них действуют лимиты и внедряемые ошибки
+SEND_METHODS = {
+    'sendMessage', 'sendPhoto', 'sendVideo', 'sendAnimation', 'sendDocument',
+    'sendSticker', 'sendMediaGroup', 'copyMessage', 'forwardMessage',
+}
+MEDIA_METHODS = {
+    'sendPhoto': 'photo', 'sendVideo': 'video', 'sendAnimation': 'animation',
+    'sendDocument': 'document', 'sendSticker': 'sticker',
+}
+TRUE_METHODS = {
+    'deleteMessage', 'deleteMessages', 'setMessageReaction', 'answerCallbackQuery',
+    'deleteWebhook', 'setWebhook', 'setMyCommands', 'close', 'logOut',
+}
+
+
+class FakeBotAPI:
+    """
+    aiohttp-приложение с маршрутом /bot{token}/{method}.
+
+    latency, jitter - задержка ответа: latency + random(0, jitter) секунд.
+    global_rate, chat_rate - лимиты отправок в секунду (0 - без лимита).
+    retry_after_rate - доля отправок, отвечающих 429 с retry_after секунд.
+    blocked_rate - доля получателей, заблокировавших бота (всегда одни и те же chat_id).
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, global_rate=0, chat_rate=0,
+                 retry_after_rate=0.0, retry_after=1, blocked_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.blocked_rate = blocked_rate
+        self._random = random.Random(seed)
+
+        self.calls = Counter()  # {method: число вызовов}
+        self.errors = Counter()  # {описание ошибки: число}
+        self.in_flight = 0
+        self._message_ids = defaultdict(lambda: itertools.count(1))  # {chat_id: счётчик message_id}
+        self._global_sends = deque()  # время последних отправок для лимитов
+        self._chat_sends = defaultdict(deque)
+        self._updates = []  # обновления для getUpdates
+        self._update_ids = itertools.count(1)
+        self._new_update = asyncio.Event()
+
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+        self.app.router.add_get('/bot{token}/{method}', self.handle)
+
+    # Обновления для getUpdates
+
+    def push_update(self, update):
+        """Ставит обновление в очередь getUpdates, update_id назначается сам"""
+        update = dict(update, update_id=next(self._update_ids))
+        self._updates.append(update)
+        self._new_update.set()
+        return update['update_id']
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        if offset < 0:
+            # skip_updates: отдать только последнее
+            self._updates = self._updates[-1:]
+        elif offset:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and float(params.get('timeout') or 0) > 0:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params['timeout']))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit') or 100)
+        return self._updates[:limit]
+
+    # Ответы
+
+    def _message(self, chat_id, **fields):
+        return {
+            'message_id': next(self._message_ids[chat_id]),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot'},
+            **fields,
+        }
+
+    def _error(self, code, description, **parameters):
+        self.errors[description] += 1
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return web.json_response(body, status=code)
+
+    def _is_blocked(self, chat_id):
+        # Один и тот же chat_id всегда либо заблокирован, либо нет
+        return self.blocked_rate and random.Random(chat_id).random() < self.blocked_rate
+
+    def _rate_limited(self, chat_id):
+        now = time.monotonic()
+        limits = []
+        if self.global_rate:
+            limits.append((self._global_sends, self.global_rate))
+        if self.chat_rate:
+            limits.append((self._chat_sends[chat_id], self.chat_rate))
+        for sends, rate in limits:
+            while sends and sends[0] <= now - 1:
+                sends.popleft()
+            if len(sends) >= rate:
+                return True
+        for sends, _ in limits:
+            sends.append(now)
+        return False
+
+    def _result(self, method, params):
+        chat_id = int(params.get('chat_id') or 0)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': len(self._updates)}
+        if method in TRUE_METHODS:
+            return True
+        if method == 'sendMessage':
+            return self._message(chat_id, text=params.get('text', ''))
+        if method in MEDIA_METHODS:
+            kind = MEDIA_METHODS[method]
+            file_id = params.get(kind, '')
+            media = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1, 'height': 1}] if kind == 'photo' \
+                else {'file_id': file_id, 'file_unique_id': file_id, 'width': 1, 'height': 1, 'duration': 1,
+                      'is_animated': False, 'is_video': False, 'type': 'regular'}
+            return self._message(chat_id, **{kind: media}, caption=params.get('caption'))
+        if method == 'sendMediaGroup':
+            media = params.get('media') or '[]'
+            media = json.loads(media) if isinstance(media, str) else media
+            group_id = str(self._random.getrandbits(62))
+            return [self._message(chat_id, media_group_id=group_id) for _ in media]
+        if method == 'copyMessage':
+            return {'message_id': next(self._message_ids[chat_id])}
+        if method == 'forwardMessage':
+            return self._message(chat_id)
+        if method in ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'):
+            return self._message(chat_id, text=params.get('text', ''))
+        return None
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+        self.in_flight += 1
+        try:
+            if method == 'getUpdates':
+                return web.json_response({'ok': True, 'result': await self._get_updates(params)})
+
+            if self.latency or self.jitter:
+                await asyncio.sleep(self.latency + self._random.random() * self.jitter)
+
+            if method in SEND_METHODS:
+                chat_id = int(params.get('chat_id') or 0)
+                if self._is_blocked(chat_id):
+                    return self._error(403, 'Forbidden: bot was blocked by the user')
+                if self._rate_limited(chat_id) or \
+                        (self.retry_after_rate and self._random.random() < self.retry_after_rate):
+                    return self._error(429, f'Too Many Requests: retry after {self.retry_after}',
+                                       retry_after=self.retry_after)
+
+            result = self._result(method, params)
+            if result is None:
+                return self._error(404, f'Not Found: method {method} is not emulated')
+            return web.json_response({'ok': True, 'result': result})
+        finally:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {'calls': dict(self.calls), 'errors': dict(self.errors)}
+
+    async def idle(self, quiet=0.2):
+        """Ждёт, пока запросы не перестанут приходить на quiet секунд"""
+        total = -1
+        while self.in_flight or total != sum(self.calls.values()):
+            total = sum(self.calls.values())
+            await asyncio.sleep(quiet)
+
+    async def start(self, host='127.0.0.1', port=8090):
+        """Запускает сервер в текущем цикле событий, возвращает web.AppRunner"""
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def add_arguments(parser):
+    """Параметры FakeBotAPI для командной строки (общие с run_load.py)"""
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, секунд')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, секунд')
+    parser.add_argument('--api-global-rate', type=int, default=0, help='лимит отправок в секунду (0 - нет)')
+    parser.add_argument('--api-chat-rate', type=int, default=0, help='лимит отправок в чат в секунду (0 - нет)')
+    parser.add_argument('--retry-after-rate', type=float, default=0.0, help='доля отправок с ответом 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after в ответах 429, секунд')
+    parser.add_argument('--blocked-rate', type=float, default=0.0, help='доля получателей, заблокировавших бота')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def from_arguments(args):
+    return FakeBotAPI(
+        latency=args.latency, jitter=args.jitter,
+        global_rate=args.api_global_rate, chat_rate=args.api_chat_rate,
+        retry_after_rate=args.retry_after_rate, retry_after=args.retry_after,
+        blocked_rate=args.blocked_rate, seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная замена Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    api = from_arguments(args)
+    print(f"Fake Bot API on http://{args.host}:{args.port} (BOT_API_SERVER = \"http://{args.host}:{args.port}\")")
+    web.run_app(api.app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
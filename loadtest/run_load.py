@@ -0,0 +1,178 @@
+"""
+Нагрузочный тест рассылки: Dispatcher из main.py против FakeBotAPI.
+
+Для каждого размера канала создаются синтетические пользователи,
+их сообщения подаются в dp так же, как при polling/webhook, а все
+запросы бота уходят в локальную замену Bot API. Итог по каждому
+размеру: сообщений в секунду, p50/p99 времени доставки (от приёма
+обновления до конца обработчика) и число запросов к API на одно сообщение.
+
+Запуск из корня репозитория (базы создаются во временном каталоге):
+    python loadtest/run_load.py --channels 10,100,1000 --messages 50 --latency 0.03
+
+Лимиты рассылки по умолчанию берутся из config.py (30 в секунду на бота,
+1 в секунду на чат), поэтому большие каналы упираются в них - как в Telegram.
+Чтобы измерить накладные расходы самого бота, поднимите их:
+    python loadtest/run_load.py --global-rate 100000 --chat-rate 1000 --chat-burst 1000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import config
+from fake_bot_api import add_arguments, from_arguments
+
+# Синтетические пользователи каждого канала: user_id = USER_ID_BASE * номер + i
+USER_ID_BASE = 10_000_000
+CHANNEL_BASE = 7000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест рассылки через Dispatcher и FakeBotAPI')
+    parser.add_argument('--channels', default='10,100', help='размеры каналов через запятую')
+    parser.add_argument('--messages', type=int, default=20, help='сообщений на каждый канал')
+    parser.add_argument('--concurrency', type=int, default=4, help='одновременно обрабатываемых сообщений')
+    parser.add_argument('--global-rate', type=float, default=config.DELIVERY_GLOBAL_RATE)
+    parser.add_argument('--chat-rate', type=float, default=config.DELIVERY_CHAT_RATE)
+    parser.add_argument('--chat-burst', type=int, default=config.DELIVERY_CHAT_BURST)
+    parser.add_argument('--delivery-concurrency', type=int, default=config.DELIVERY_CONCURRENCY)
+    parser.add_argument('--port', type=int, default=8090, help='порт FakeBotAPI')
+    parser.add_argument('--keep', action='store_true', help='не удалять каталог с базами')
+    add_arguments(parser)
+    return parser.parse_args()
+
+
+def configure(args, api_url):
+    """Настройки до импорта main: движок рассылки и защита от флуда читают их при создании"""
+    config.BOT_TOKEN = '123456:LOADTEST'
+    config.BOT_API_SERVER = api_url
+    config.OWNER_ID = 0
+    config.METRICS_PORT = 0
+    config.DELETE_STATS_AFTER = 0  # удаление статуса тоже считается в запросах на сообщение
+    config.DELIVERY_GLOBAL_RATE = args.global_rate
+    config.DELIVERY_CHAT_RATE = args.chat_rate
+    config.DELIVERY_CHAT_BURST = args.chat_burst
+    config.DELIVERY_CONCURRENCY = args.delivery_concurrency
+    # Синтетические пользователи пишут чаще живых - флуд-контроль не должен их отсекать
+    config.FLOOD_USER_WINDOWS = [(1, 1_000_000)]
+    config.FLOOD_CHANNEL_RATE = 1_000_000
+    config.FLOOD_CHANNEL_BURST = 1_000_000
+
+
+def create_users(sizes):
+    """Пользователи для каждого канала одной транзакцией, возвращает {канал: [user_id]}"""
+    from database import User, db
+
+    channels = {}
+    rows = []
+    for index, size in enumerate(sizes, start=1):
+        channel = CHANNEL_BASE + index
+        user_ids = [USER_ID_BASE * index + i for i in range(size)]
+        channels[channel] = user_ids
+        rows.extend((user_id, channel, f'Load {user_id}') for user_id in user_ids)
+    with db.atomic():
+        for start in range(0, len(rows), 500):
+            User.insert_many(rows[start:start + 500], fields=[User.user_id, User.channel, User.name]).execute()
+    return channels
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def run_channel(main, api, channel, user_ids, args, ids):
+    """Прогоняет args.messages сообщений через канал, возвращает строку отчёта"""
+    from aiogram import types
+
+    calls_before = api.calls.copy()
+    queue = asyncio.Queue()
+    for number in range(args.messages):
+        queue.put_nowait(number)
+    latencies = []
+
+    async def sender():
+        while not queue.empty():
+            number = queue.get_nowait()
+            user_id = random.choice(user_ids)
+            update = types.Update(update_id=next(ids), message={
+                'message_id': next(ids), 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+                'text': f'load test message {number}',
+            })
+            start_time = time.perf_counter()
+            await main.dp.updates_handler.notify(update)
+            latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start_time
+    await api.idle()
+
+    calls = api.calls - calls_before
+    per_message = ', '.join(f'{method} {count / args.messages:.2f}' for method, count in sorted(calls.items()))
+    return (
+        f"{len(user_ids):>7} | {args.messages / elapsed:>9.2f} | {args.messages * len(user_ids) / elapsed:>12.1f} | "
+        f"{percentile(latencies, 0.5) * 1000:>8.1f} | {percentile(latencies, 0.99) * 1000:>8.1f} | {per_message}"
+    )
+
+
+async def run(args, workdir):
+    api = from_arguments(args)
+    runner = await api.start(port=args.port)
+    configure(args, f'http://127.0.0.1:{args.port}')
+
+    import main
+    from aiogram import Bot, Dispatcher
+    from database import init_db
+    from messages_db import init_messages_db
+
+    init_db()
+    init_messages_db()
+    sizes = [int(size) for size in args.channels.split(',')]
+    channels = create_users(sizes)
+    main.channel_index.load()
+    main.prison_index.load()
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+
+    print(f"Databases in {workdir}")
+    print(f"Fake API latency {args.latency}s + {args.jitter}s jitter, "
+          f"delivery rate {args.global_rate}/s global, {args.chat_rate}/s per chat\n")
+    print("channel |     msg/s | deliveries/s |  p50, ms |  p99, ms | API calls per message")
+    ids = itertools.count(1)
+    try:
+        for channel, user_ids in channels.items():
+            print(await run_channel(main, api, channel, user_ids, args, ids))
+        await main.async_db.history_writer.flush()
+        if api.errors:
+            print(f"\nInjected errors: {dict(api.errors)}")
+    finally:
+        await (await main.bot.get_session()).close()
+        await runner.cleanup()
+        main.async_db.shutdown()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    os.chdir(workdir)
+    try:
+        asyncio.run(run(args, workdir))
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,1291 +1,1597 @@
-from aiogram import Bot, Dispatcher, types, executor
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database import User, init_db, PrisonUser
-from messages_db import StoredMessage, init_messages_db
-from aiogram.utils.exceptions import BotBlocked, ChatNotFound, UserDeactivated
-import config
-import random
-import asyncio
-import names
-import time
-import traceback
-import json
-from restricted_names import is_name_allowed
-from datetime import datetime
-
-# Инициализация бота
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
-
-active_channels = set()
-
-# Добавим словарь для хранения времени последнего сообщения
-last_message_time = {}
-
-# Глобальный словарь для хранения соответствий ID сообщений
-message_mappings = {}  # {channel: {original_id: {user_id: message_id}}}
-
-def owner_only(func):
-    async def wrapper(message: types.Message):
-        if message.from_user.id != config.OWNER_ID:
-            await message.answer(
-                "🚫 *Ошибка*: Недостаточно прав",
-                parse_mode="Markdown"
-            )
-            return
-        return await func(message)
-    return wrapper
-
-def get_current_version():
-    try:
-        with open('version.txt', 'r') as f:
-            return f.read().strip()
-    except:
-        return "1.0.0"
-
-def generate_name():
-    return f"{names.get_first_name()} {names.get_last_name()}"
-
-def get_random_channel():
-    """Получить случайный канал"""
-    if random.random() < config.CHANNEL_CREATION_CHANCE:
-        new_channel = random.randint(config.MIN_CHANNEL, config.MAX_CHANNEL)
-        active_channels.add(new_channel)
-        return new_channel
-    return random.choice(list(active_channels)) if active_channels else random.randint(config.MIN_CHANNEL, config.MAX_CHANNEL)
-
-def get_display_name(user: User):
-    """Получить отображаемое имя пользователя"""
-    display_name = user.custom_name if user.custom_name else user.name
-    if user.emoji:
-        display_name = f"{user.emoji} {display_name}"
-    return display_name
-
-def create_user_button(name, user=None):
-    """Создать кнопку с именем пользователя"""
-    markup = InlineKeyboardMarkup()
-    display_name = get_display_name(user) if user else name
-    
-    # Определяем callback_data в зависимости от типа кнопки
-    if name == "Система":
-        callback_data = "system"
-    elif name == "Владелец":
-        callback_data = "owner"
-    else:
-        callback_data = "name"
-        
-    markup.add(InlineKeyboardButton(display_name, callback_data=callback_data))
-    return markup
-
-@dp.errors_handler()
-async def errors_handler(update: types.Update, exception: Exception):
-    """
-    Глобальный обработчик ошибок
-    """
-    print(f"\n{'='*50}\n[ERROR] Unexpected error: {exception}")
-    print(f"Update: {update}")
-    print(traceback.format_exc())
-    print(f"{'='*50}\n")
-    return True
-
-async def send_message(**kwargs):
-    """Универсальная функция отправки сообщения"""
-    try:
-        return await bot.send_message(**kwargs)
-    except (BotBlocked, ChatNotFound, UserDeactivated) as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Failed to send message: {e}")
-        print(f"Arguments: {kwargs}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        
-        user_id = kwargs.get('chat_id')
-        if user_id:
-            user = User.get_user(user_id)
-            if user:
-                user.delete_instance()
-            
-            prison_user = PrisonUser.get_or_none(PrisonUser.user_id == user_id)
-            if prison_user:
-                prison_user.delete_instance()
-        raise e
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Unexpected error while sending message: {e}")
-        print(f"Arguments: {kwargs}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        raise e
-
-async def start_channel_switchers():
-    """Запускает таймеры переключения каналов"""
-    users = User.select()
-    for user in users:
-        asyncio.create_task(switch_channel(user.user_id))
-    print(f"Started channel switchers for {len(list(users))} users")
-
-async def switch_channel(user_id):
-    """Автоматическое переключение канала для одного пользователя"""
-    while True:
-        wait_time = random.randint(config.SWITCH_TIME_MIN, config.SWITCH_TIME_MAX)
-        await asyncio.sleep(wait_time)
-        
-        user = User.get_user(user_id)
-        if user:
-            prison_user = PrisonUser.get_or_none(PrisonUser.user_id == user_id)
-            if prison_user:
-                continue
-                
-            new_channel = get_random_channel()
-            new_name = generate_name()
-            
-            # Обновляем только если нет кастомного имени
-            if not user.custom_name:
-                user.name = new_name
-            user.channel = new_channel
-            user.save()
-            
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"👁 *Моргнув*, ты оказался на канале `{new_channel}Hz`\n"
-                    f"🎭 *Твоё имя*: `{get_display_name(user)}`",
-                    parse_mode="Markdown",
-                    reply_markup=create_user_button(new_name, user)
-                )
-            except Exception as e:
-                print(f"\n{'='*50}")
-                print(f"[ERROR] Failed to send channel switch message to {user_id}: {e}")
-                print(traceback.format_exc())
-                print(f"{'='*50}\n")
-
-@dp.message_handler(commands=['start'])
-async def cmd_start(message: types.Message):
-    try:
-        user = User.get_or_none(User.user_id == message.from_user.id)
-        if not user:
-            channel = get_least_populated_channel()
-            name = generate_name()
-            
-            user = User.create(
-                user_id=message.from_user.id,
-                name=name,
-                channel=channel,
-                created_at=datetime.now()
-            )
-            
-            channel_users = User.get_channel_users(channel)
-            users_count = len(list(channel_users))
-            
-            await message.answer(
-                f"👋 Привет!\n\n"
-                f"📡 Твой канал: `{channel}Hz`\n"
-                f"👤 Твоё имя: `{get_display_name(user)}`\n"
-                f"👥 Пользователей на канале: `{users_count}`\n\n"
-                "📝 Команды:\n"
-                "/help - справка",
-                parse_mode="Markdown"
-            )
-        else:
-            channel_users = User.get_channel_users(user.channel)
-            users_count = len(list(channel_users))
-            
-            await message.answer(
-                f"📡 Твой канал: `{user.channel}Hz`\n"
-                f"👤 Твоё имя: `{get_display_name(user)}`\n"
-                f"👥 Пользователей на канале: `{users_count}`\n\n"
-                "📝 Команды:\n"
-                "/help - справка",
-                parse_mode="Markdown"
-            )
-            
-    except Exception as e:
-        await bot.send_message(
-            config.OWNER_ID,
-            f"❌ *Error in cmd_start*:\n"
-            f"User ID: `{message.from_user.id}`\n"
-            f"Error: `{str(e)}`\n"
-            f"Traceback: ```\n{traceback.format_exc()}```",
-            parse_mode="Markdown"
-        )
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_start: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при выполнении команды*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(commands=['help'])
-async def cmd_help(message: types.Message):
-    try:
-        current_version = get_current_version()
-        base_commands = (
-            f"*📡 Версия бота: {current_version}*\n\n"
-            "*Доступные команды:*\n\n"
-            "• /start - Начать использование бота\n"
-            "• /help - Показать это сообщение\n"
-            "• /name [имя] - Установить своё имя\n"
-            "• /scan - Просканировать каналы\n"
-            "• /goto [канал] - Переместиться на канал\n"
-            "_Каналы переключаются автоматически_"
-        )
-        
-        owner_commands = (
-            "\n\n*👑 Команды владельца:*\n\n"
-            "• /version [номер] [текст] - Отправить обновление\n"
-            "• /broadcast [текст] - Отправить сообщение всем пользователям\n"
-            "• /zov [user_id] [время] [причина] - Отправить в тюрьму\n"
-            "• /unzov [user_id] - Освободить из тюрьмы\n"
-            "• /emoji [user_id] [emoji] - Установить эмодзи пользователю\n"
-            "• /resetname [user_id] - Сбросить кастомное имя\n"
-            "• /del - Удалить сообщение (ответом на сообщение)"
-        )
-        
-        help_text = base_commands + (owner_commands if message.from_user.id == config.OWNER_ID else "")
-        await message.answer(help_text, parse_mode="Markdown")
-        
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_help: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer("Произошла ошибка при отображении помощи.")
-
-@dp.message_handler(commands=['scan'])
-async def cmd_scan(message: types.Message):
-    try:
-        scan_results = []
-        
-        # Получаем все уникальные каналы из базы данных
-        channels = User.select(User.channel).distinct()
-        
-        for channel_record in channels:
-            users = User.get_channel_users(channel_record.channel)
-            user_count = len(list(users))
-            
-            scan_results.append(
-                f"👁 Канал: `{channel_record.channel}Hz`\n"
-                f"👥 Пользователей: `{user_count}`\n"
-            )
-        
-        if scan_results:
-            await message.answer(
-                "🔍 *Результаты сканирования:*\n\n" + "\n".join(scan_results),
-                parse_mode="Markdown"
-            )
-        else:
-            await message.answer(
-                "😔 *Не найдено активных каналов...*",
-                parse_mode="Markdown"
-            )
-            
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_scan: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer("❌ *Ошибка при сканировании*", parse_mode="Markdown")
-
-@dp.message_handler(commands=['goto', 'channel'])
-async def cmd_goto(message: types.Message):
-    if message.get_command() == '/channel':
-        await message.answer(
-            "❗️ Ссылка на /goto\n"
-            "Пример команды: `/channel канал`, `/goto канал`",
-            parse_mode="Markdown"
-        )
-    try:
-        args = message.text.split()
-        if len(args) != 2:
-            await message.answer(
-                "❌ *Ошибка*: Неверный формат команды\n"
-                "Используйте: `/goto канал`",
-                parse_mode="Markdown"
-            )
-            return
-            
-        channel = int(args[1])
-        user_id = message.from_user.id
-        
-        # Проверка на тюремный канал
-        if channel == config.PRISON_CHANNEL:
-            await message.answer(
-                random.choice(config.PRISON_MESSAGES),
-                parse_mode="Markdown"
-            )
-            return
-            
-        if channel < config.MIN_CHANNEL or channel > config.MAX_CHANNEL:
-            await message.answer(
-                "❌ *Ошибка*: Недопустимый канал\n"
-                f"Диапазон: от `{config.MIN_CHANNEL}` до `{config.MAX_CHANNEL}`",
-                parse_mode="Markdown"
-            )
-            return
-            
-        user = User.get_user(user_id)
-        if not user:
-            await message.answer(
-                "❌ *Ошибка*: Пользователь не найден",
-                parse_mode="Markdown"
-            )
-            return
-
-        # Обновляем только канал, имя не трогаем если есть кастомное
-        if not user.custom_name:
-            user.name = generate_name()
-        user.channel = channel
-        user.save()
-        
-        # Сообщение пользователю
-        await message.answer(
-            "😌 *Ты ненадолго закрыл глаза*...\n"
-            f"_И оказался на канале_ `{channel}Hz`",
-            parse_mode="Markdown",
-            reply_markup=create_user_button(user.name, user)
-        )
-            
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_goto: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при выполнении команды*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(commands=['name', 'tag'])
-async def cmd_name(message: types.Message):
-    if message.get_command() == '/tag':
-        await message.answer(
-            "❗️ Ссылка на команду /name\n"
-            "Пример команды: `/tag ник`, `/name ник`",
-            parse_mode="Markdown"
-        )
-    try:
-        args = message.text.split(maxsplit=1)
-        if len(args) != 2:
-            await message.answer(
-                "❌ *Ошибка*: Укажите имя\n"
-                "Используйте: `/name Новое Имя`",
-                parse_mode="Markdown"
-            )
-            return
-            
-        new_name = args[1]
-        user_id = message.from_user.id
-        
-        # Проверяем, разрешено ли имя
-        is_allowed, error_msg = is_name_allowed(new_name, user_id)
-        if not is_allowed:
-            await message.answer(error_msg, parse_mode="Markdown")
-            return
-            
-        # Получаем или создаем пользователя
-        user = User.get_or_none(User.user_id == user_id)
-        if not user:
-            await message.answer(
-                "❌ *Ошибка*: Сначала используйте /start",
-                parse_mode="Markdown"
-            )
-            return
-            
-        # Обновляем имя
-        user.custom_name = new_name
-        user.save()
-        
-        await message.answer(
-            f"✅ Установлено имя: `{new_name}`",
-            parse_mode="Markdown"
-        )
-        
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_name: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при выполнении команды*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(commands=['resetname'])
-@owner_only
-async def cmd_resetname(message: types.Message):
-    try:
-        args = message.text.split()
-        user_id = None
-        
-        # Если это ответ на сообщение
-        if message.reply_to_message:
-            user_id = message.reply_to_message.from_user.id
-        else:
-            # Стандартный вариант через ID
-            if len(args) != 2:
-                await message.answer(
-                    "❌ *Ошибка*: Неверный формат команды\n"
-                    "Используйте:\n"
-                    "• `/resetname user_id`\n"
-                    "• Ответом на сообщение: `/resetname`",
-                    parse_mode="Markdown"
-                )
-                return
-            user_id = int(args[1])
-            
-        user = User.get_user(user_id)
-        if not user:
-            await message.answer(
-                "❌ *Ошибка*: Пользователь не найден",
-                parse_mode="Markdown"
-            )
-            return
-            
-        user.custom_name = None
-        user.save()
-        
-        await message.answer(
-            "✅ Кастомное имя удалено",
-            parse_mode="Markdown"
-        )
-        
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_resetname: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при выполнении команды*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(commands=['emoji'])
-@owner_only
-async def cmd_emoji(message: types.Message):
-    try:
-        args = message.text.split()
-        user_id = None
-        emoji = None
-        
-        # Если это ответ на сообщение
-        if message.reply_to_message:
-            user_id = message.reply_to_message.from_user.id
-            if len(args) != 2:
-                await message.answer(
-                    "❌ *Ошибка*: Укажите эмодзи\n"
-                    "Используйте: `/emoji 🌟`",
-                    parse_mode="Markdown"
-                )
-                return
-            emoji = args[1]
-        else:
-            # Стандартный вариант через ID
-            if len(args) != 3:
-                await message.answer(
-                    "❌ *Ошибка*: Неверный формат команды\n"
-                    "Используйте:\n"
-                    "• `/emoji user_id emoji`\n"
-                    "• Ответом на сообщение: `/emoji emoji`",
-                    parse_mode="Markdown"
-                )
-                return
-            user_id = int(args[1])
-            emoji = args[2]
-            
-        user = User.get_user(user_id)
-        if not user:
-            await message.answer(
-                "❌ *Ошибка*: Пользователь не найден",
-                parse_mode="Markdown"
-            )
-            return
-            
-        user.emoji = emoji
-        user.save()
-        
-        await message.answer(
-            f"✅ Установлен эмодзи: {emoji}",
-            parse_mode="Markdown"
-        )
-        
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_emoji: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при выполнении команды*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(commands=['version'])
-@owner_only
-async def cmd_version(message: types.Message):
-    try:
-        args = message.text.split(maxsplit=2)
-        if len(args) < 3:
-            await message.answer(
-                "❌ *Ошибка*: Неверный формат команды\n"
-                "Используйте: `/version номер текст`",
-                parse_mode="Markdown"
-            )
-            return
-            
-        version = args[1]
-        text = args[2]
-        
-        # Обновляем версию
-        with open('version.txt', 'w') as f:
-            f.write(version)
-            
-        # Формируем сообщение об обновлении
-        update_message = (
-            "🌟 *Обновление!*\n\n"
-            f"📦 Версия: `{version}`\n"
-            "📝 Что нового:\n"
-            f"{text}"
-        )
-        
-        # Создаем кнопку "Система"
-        markup = create_user_button("Система")
-        
-        # Отправляем в канал обновлений
-        try:
-            await bot.send_message(
-                chat_id=config.UPDATE_CHANNEL,
-                text=update_message,
-                parse_mode="Markdown"
-            )
-        except Exception as e:
-            print(f"Failed to send update to channel: {e}")
-        
-        # Отправляем всем пользователям
-        users = User.select()
-        sent_count = 0
-        
-        for user in users:
-            try:
-                await send_message(
-                    chat_id=user.user_id,
-                    text=update_message,
-                    parse_mode="Markdown",
-                    reply_markup=markup
-                )
-                if user.user_id != message.from_user.id:  # Не считаем отправителя
-                    sent_count += 1
-            except Exception as e:
-                print(f"Failed to send update to {user.user_id}: {e}")
-        
-        # Отправляем статистику
-        await message.answer(
-            f"✅ Обновление отправлено {sent_count} пользователям и в канал",
-            parse_mode="Markdown"
-        )
-        
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_version: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при отправке обновления*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(commands=['broadcast', 'broad'])
-@owner_only
-async def cmd_broadcast(message: types.Message):
-    try:
-        args = message.text.split(maxsplit=1)
-        if len(args) != 2:
-            await message.answer(
-                "❌ *Ошибка*: Укажите сообщение\n"
-                "Используйте: `/broadcast текст` или `/broad текст`\n\n"
-                "Форматирование:\n"
-                "`nn` - код\n"
-                "*nn* - жирный текст\n"
-                "_nn_ - курсив\n"
-                "~nn~ - зачеркнутый\n"
-                "||nn|| - спойлер\n"
-                "@username - упоминание\n"
-                "`#ffffff` - цвет (HEX)",
-                parse_mode="Markdown"
-            )
-            return
-            
-        text = args[1]
-        users = User.select()
-        sent_count = 0
-        markup = create_user_button("Владелец")
-        
-        # Заменяем тире на обычное
-        text = text.replace('—', '-')
-        
-        for user in users:
-            try:
-                await bot.send_message(
-                    user.user_id,
-                    text,
-                    parse_mode="Markdown",
-                    reply_markup=markup,
-                    disable_web_page_preview=False
-                )
-                sent_count += 1
-                # Добавляем задержку между отправками
-                await asyncio.sleep(config.BROADCAST_DELAY)
-                
-            except BotBlocked:
-                print(f"Bot was blocked by user {user.user_id}, removing from database")
-                user.delete_instance()
-            except Exception as e:
-                print(f"Failed to send broadcast to {user.user_id}: {e}")
-                continue
-                
-        status_msg = await message.answer(
-            f"✅ Сообщение отправлено `{sent_count}` пользователям",
-            parse_mode="Markdown"
-        )
-        asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
-            
-    except Exception as e:
-        await bot.send_message(
-            config.OWNER_ID,
-            f"❌ *Error in cmd_broadcast*:\n"
-            f"Error: `{str(e)}`\n"
-            f"Traceback: ```\n{traceback.format_exc()}```",
-            parse_mode="Markdown"
-        )
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_broadcast: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при отправке сообщения*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(commands=['zov'])
-@owner_only
-async def cmd_zov(message: types.Message):
-    try:
-        args = message.text.split()
-        if len(args) < 2:
-            await message.answer(
-                "❌ *Ошибка*: Укажите user_id\n"
-                "Используйте:\n"
-                "• `/zov user_id` _(навсегда)_\n"
-                "• `/zov user_id 30m` _(на 30 минут)_\n"
-                "• `/zov user_id 2h` _(на 2 часа)_\n"
-                "• `/zov user_id 1d` _(на 1 день)_\n"
-                "• `/zov user_id причина` _(навсегда с причиной)_\n"
-                "• `/zov user_id 30m причина` _(на время с причиной)_",
-                parse_mode="Markdown"
-            )
-            return
-
-        user_id = int(args[1])
-        until = None
-        reason = None
-        
-        if len(args) > 2:
-            # Проверяем, является ли второй аргумент временем
-            time_str = args[2].lower()
-            if any(time_str.endswith(unit) for unit in ['m', 'h', 'd']):
-                try:
-                    # Парсим время
-                    multiplier = {'m': 60, 'h': 3600, 'd': 86400}
-                    time_value = int(time_str[:-1])
-                    time_unit = time_str[-1]
-                    
-                    if time_unit in multiplier:
-                        until = int(time.time()) + (time_value * multiplier[time_unit])
-                        # Если есть причина после времени
-                        if len(args) > 3:
-                            reason = ' '.join(args[3:])
-                except ValueError:
-                    # Если не удалось распарсить время, считаем это причиной
-                    reason = ' '.join(args[2:])
-            else:
-                # Если второй аргумент не время, значит это причина
-                reason = ' '.join(args[2:])
-        
-        user = User.get_user(user_id)
-        if not user:
-            await message.answer(
-                "❌ *Ошибка*: Пользователь не найден",
-                parse_mode="Markdown"
-            )
-            return
-        
-        # Сохраняем в базу
-        PrisonUser.create(
-            user_id=user_id,
-            reason=reason or "Не указана",
-            until=until
-        )
-        
-        # Перемещаем пользователя
-        user.channel = config.PRISON_CHANNEL
-        user.save()
-        
-        # Формируем сообщение для владельца
-        status = []
-        status.append(f"👤 *Пользователь*: `{get_display_name(user)}`")
-        
-        if until:
-            time_left = until - int(time.time())
-            hours = time_left // 3600
-            minutes = (time_left % 3600) // 60
-            status.append(f"⏱ *Время*: `{hours}ч {minutes}м`")
-        else:
-            status.append("⏱ *Время*: `навсегда`")
-            
-        if reason:
-            status.append(f"📝 *Причина*: `{reason}`")
-        
-        # Отправляем сообщение пользователю
-        await bot.send_message(
-            user_id,
-            "😵 *Ты потерял сознание*...\n"
-            f"_После того, как ты очнулся, ты оказался на канале_ `{config.PRISON_CHANNEL}Hz`...\n"
-            "💀 *Ты не можешь говорить*...",
-            parse_mode="Markdown"
-        )
-        
-        # Отправляем подтверждение владельцу
-        await message.answer(
-            f"✅ *Пользователь помещен в тюрьму*\n\n" + 
-            '\n'.join(status),
-            parse_mode="Markdown"
-        )
-        
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_zov: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при выполнении команды*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(commands=['unzov'])
-@owner_only
-async def cmd_unzov(message: types.Message):
-    try:
-        args = message.text.split()
-        if len(args) != 2:
-            await message.answer(
-                "❌ *Ошибка*: Неверный формат команды\n"
-                "Используйте: `/unzov user_id`",
-                parse_mode="Markdown"
-            )
-            return
-            
-        user_id = int(args[1])
-        prison_user = PrisonUser.get_or_none(PrisonUser.user_id == user_id)
-        
-        if not prison_user:
-            await message.answer(
-                "❌ *Ошибка*: Пользователь не находится в тюрьме",
-                parse_mode="Markdown"
-            )
-            return
-            
-        prison_user.delete_instance()
-        
-        # Перемещаем пользователя на случайный канал
-        user = User.get_user(user_id)
-        if user:
-            channel = get_random_channel()
-            user.channel = channel
-            user.save()
-            
-            await bot.send_message(
-                user_id,
-                "🌟 *Ты пришел в себя*...\n"
-                f"_И оказался на канале_ `{channel}Hz`",
-                parse_mode="Markdown"
-            )
-        
-        await message.answer(
-            "✅ Пользователь освобожден",
-            parse_mode="Markdown"
-        )
-        
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_unzov: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при выполнении команды*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(commands=['del'])
-@owner_only
-async def cmd_del(message: types.Message):
-    try:
-        # Получаем сообщение, на которое ответили
-        if not message.reply_to_message:
-            await message.answer(
-                "❌ *Ошибка*: Ответьте на сообщение, которое хотите удалить",
-                parse_mode="Markdown"
-            )
-            return
-            
-        # Получаем всех пользователей
-        users = User.select()
-        deleted_count = 0
-        base_message_id = message.reply_to_message.message_id
-        
-        # Удаляем сообщение у всех пользователей
-        for i, user in enumerate(users):
-            try:
-                msg_id = base_message_id + i  # Увеличиваем ID для каждого следующего пользователя
-                await bot.delete_message(user.user_id, msg_id)
-                deleted_count += 1
-            except Exception as e:
-                print(f"Failed to delete message {msg_id} for user {user.user_id}: {e}")
-                continue
-                    
-        # Отправляем подтверждение
-        status_msg = await message.answer(
-            f"✅ Удалено сообщений: `{deleted_count}`",
-            parse_mode="Markdown"
-        )
-        asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
-            
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in cmd_del: {e}")
-        print(f"Message: {message.text}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при удалении сообщения*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(content_types=['text'])
-async def handle_message(message: types.Message):
-    try:
-        # Проверяем время последнего сообщения в самом начале
-        current_time = time.time()
-        last_time = last_message_time.get(message.from_user.id, 0)
-        if current_time - last_time < config.MESSAGE_DELAY:
-            remaining = round(config.MESSAGE_DELAY - (current_time - last_time))
-            await message.answer(
-                f"⏳ Подождите еще `{remaining}` сек.",
-                parse_mode="Markdown"
-            )
-            return
-            
-        # Сразу обновляем время последнего сообщения
-        last_message_time[message.from_user.id] = current_time
-        
-        user = User.get_user(message.from_user.id)
-        if not user:
-            await message.answer(
-                "❌ *Ошибка*: Пользователь не найден\n"
-                "Используйте /start для регистрации",
-                parse_mode="Markdown"
-            )
-            return
-            
-        # Проверяем тюрьму
-        prison_user = PrisonUser.get_or_none(PrisonUser.user_id == message.from_user.id)
-        if prison_user:
-            await message.answer(
-                f"🚔 Вы в тюрьме еще `{prison_user.remaining_time}` секунд",
-                parse_mode="Markdown"
-            )
-            # Если в тюрьме, сбрасываем таймер
-            last_message_time.pop(message.from_user.id, None)
-            return
-            
-        channel_users = User.get_channel_users(user.channel)
-        recipients_count = sum(1 for u in channel_users if u.user_id != message.from_user.id)
-            
-        if recipients_count == 0:
-            status_msg = await message.answer(
-                f"📡 На канале `{user.channel}Hz` никого нет...",
-                parse_mode="Markdown"
-            )
-            asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
-            return
-
-        markup = create_user_button(user.name, user)
-        
-        text = message.text
-        reply_msg = None
-        
-        if message.reply_to_message:
-            quoted_user = User.get_user(message.reply_to_message.from_user.id)
-            quoted_name = quoted_user.get_display_name() if quoted_user else message.reply_to_message.from_user.first_name
-            quoted_text = message.reply_to_message.text
-            
-            if "╭─" in quoted_text:
-                lines = quoted_text.split("\n")
-                for i in range(len(lines)-1, -1, -1):
-                    if not lines[i].startswith("╭─") and not lines[i].startswith("╰"):
-                        quoted_text = lines[i]
-                        break
-                        
-            text_with_quote = (
-                f"╭─ {quoted_name}\n"
-                f"╰ {quoted_text}\n"
-                f"\n"
-                f"{text}"
-            )
-            reply_msg = message.reply_to_message
-
-        # Отправляем сообщения
-        status_msg = await message.answer(
-            "📡 *Отправляю...*",
-            parse_mode="Markdown"
-        )
-        
-        start_time = time.time()
-        tasks = []
-        results = []
-
-        # Создаем задачи для отправки
-        for channel_user in channel_users:
-            if channel_user.user_id == message.from_user.id and reply_msg:
-                task = bot.send_message(
-                    channel_user.user_id,
-                    text,
-                    reply_to_message_id=reply_msg.message_id,
-                    reply_markup=markup
-                )
-            else:
-                task = bot.send_message(
-                    channel_user.user_id,
-                    text_with_quote if reply_msg else text,
-                    reply_markup=markup
-                )
-            tasks.append(task)
-
-        # Выполняем все задачи параллельно
-        try:
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
-            for i, response in enumerate(responses):
-                if isinstance(response, Exception):
-                    print(f"Failed to send message to {channel_users[i].user_id}: {response}")
-                else:
-                    results.append(f"{channel_users[i].user_id}:{response.message_id}")
-        except Exception as e:
-            print(f"Error in gather: {e}")
-
-        # Сохраняем результаты
-        if results:
-            StoredMessage.save_message_with_timestamp(
-                message.from_user.id,
-                user.get_display_name(),
-                results,
-                text,
-                int(time.time())
-            )
-
-        execution_time = int((time.time() - start_time) * 1000)
-        time_str = f"{execution_time}ms" if execution_time < 1000 else f"{execution_time/1000:.1f}s"
-        
-        await status_msg.edit_text(
-            f"📡 Твой сигнал доставлен на канал `{user.channel}Hz`\n"
-            f"👥 Получателей: `{recipients_count}`\n"
-            f"⚡️ Время доставки: `{time_str}`",
-            parse_mode="Markdown"
-        )
-        
-        asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
-
-        # После отправки сообщений
-        channel_mapping = message_mappings.setdefault(user.channel, {})
-        message_mapping = channel_mapping.setdefault(message.message_id, {})
-        
-        for result in results:
-            if isinstance(result, types.Message):
-                message_mapping[result.chat.id] = result.message_id
-
-    except Exception as e:
-        print(f"[ERROR] Error in handle_message: {e}")
-        traceback.print_exc()
-        try:
-            await message.answer(
-                f"🚫 *Ошибка*: {str(e)}",
-                parse_mode="Markdown"
-            )
-        except:
-            pass
-
-async def delete_message_after(message: types.Message, delay: int):
-    """Удаляет сообщение после задержки"""
-    await asyncio.sleep(delay)
-    try:
-        await message.delete()
-    except Exception as e:
-        print(f"Failed to delete message: {e}")
-
-@dp.callback_query_handler()
-async def process_callback(callback_query: types.CallbackQuery):
-    try:
-        # Получаем данные из callback_data
-        callback_data = callback_query.data
-        
-        if callback_data == "name":
-            # Кнопка с именем пользователя
-            await callback_query.answer(
-                "Это имя пользователя",
-                show_alert=True
-            )
-            
-        elif callback_data == "system":
-            # Системное сообщение
-            await callback_query.answer(
-                "Это системное сообщение",
-                show_alert=True
-            )
-            
-        elif callback_data == "owner":
-            # Сообщение от владельца
-            await callback_query.answer(
-                "Это рассылка от владельца",
-                show_alert=True
-            )
-            
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in process_callback: {e}")
-        print(f"Callback data: {callback_query.data}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-
-def get_least_populated_channel() -> int:
-    """
-    Возвращает канал с наименьшим количеством пользователей
-    или случайный новый канал
-    """
-    try:
-        # Получаем все каналы и количество пользователей в них
-        channels = {}
-        for user in User.select():
-            channels[user.channel] = channels.get(user.channel, 0) + 1
-            
-        # Если есть каналы с пользователями
-        if channels:
-            # Находим канал с минимальным количеством пользователей
-            min_channel = min(channels.items(), key=lambda x: x[1])[0]
-            # С вероятностью CHANNEL_CREATION_CHANCE создаем новый канал
-            if random.random() < config.CHANNEL_CREATION_CHANCE:
-                return random.randint(config.MIN_CHANNEL, config.MAX_CHANNEL)
-            return min_channel
-            
-        # Если нет каналов, создаем случайный
-        return random.randint(config.MIN_CHANNEL, config.MAX_CHANNEL)
-        
-    except Exception as e:
-        print(f"Error in get_least_populated_channel: {e}")
-        # В случае ошибки возвращаем случайный канал
-        return random.randint(config.MIN_CHANNEL, config.MAX_CHANNEL)
-
-@dp.message_handler(content_types=['photo', 'video', 'animation', 'document', 'media_group', 'sticker'])
-async def handle_media(message: types.Message):
-    try:
-        # Убираем проверку на MEDIA_ALLOWED_USERS
-        start_time = time.time()
-        user = User.get_user(message.from_user.id)
-        if not user:
-            await message.answer(
-                "❌ *Ошибка*: Пользователь не найден\n"
-                "Используйте /start для регистрации",
-                parse_mode="Markdown"
-            )
-            return
-            
-        # Проверяем задержку между сообщениями
-        current_time = time.time()
-        last_time = last_message_time.get(message.from_user.id, 0)
-        if current_time - last_time < config.MESSAGE_DELAY:
-            await message.answer(
-                f"⏳ Подождите еще `{int(config.MESSAGE_DELAY - (current_time - last_time))}` секунд",
-                parse_mode="Markdown"
-            )
-            return
-
-        # Сразу обновляем время последнего сообщения
-        last_message_time[message.from_user.id] = current_time
-
-        channel_users = User.get_channel_users(user.channel)
-        recipients_count = sum(1 for u in channel_users if u.user_id != message.from_user.id)
-            
-        if recipients_count == 0:
-            status_msg = await message.answer(
-                f"📡 На канале `{user.channel}Hz` никого нет...",
-                parse_mode="Markdown"
-            )
-            asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
-            return
-
-        # Сначала отправляем статус
-        status_msg = await message.answer(
-            f"📡 Отправка сигнала на канал `{user.channel}Hz`\n"
-            f"👥 Получателей: `{recipients_count}`",
-            parse_mode="Markdown"
-        )
-
-        markup = create_user_button(user.name, user)
-        
-        # Получаем медиа и подпись
-        file_id = None
-        caption = message.caption or ""
-        media_type = None
-        
-        # Определяем тип медиа и file_id
-        if message.sticker:
-            file_id = message.sticker.file_id
-            media_type = 'sticker'
-        elif message.media_group_id:
-            if message.photo:
-                file_id = message.photo[-1].file_id
-                media_type = 'photo'
-            elif message.video:
-                file_id = message.video.file_id
-                media_type = 'video'
-            elif message.document:
-                file_id = message.document.file_id
-                media_type = 'document'
-        else:
-            if message.photo:
-                file_id = message.photo[-1].file_id
-                media_type = 'photo'
-            elif message.video:
-                file_id = message.video.file_id
-                media_type = 'video'
-            elif message.animation:
-                file_id = message.animation.file_id
-                media_type = 'animation'
-            elif message.document:
-                file_id = message.document.file_id
-                media_type = 'document'
-            
-        if not file_id:
-            return
-
-        # Создаем список задач для отправки
-        tasks = []
-        for channel_user in channel_users:
-            async def send_with_delay(user_id):
-                await asyncio.sleep(config.BROADCAST_DELAY)
-                if media_type == 'sticker':
-                    return await bot.send_sticker(user_id, file_id, reply_markup=markup)
-                elif media_type == 'photo':
-                    return await bot.send_photo(user_id, file_id, caption=caption, reply_markup=markup)
-                elif media_type == 'video':
-                    return await bot.send_video(user_id, file_id, caption=caption, reply_markup=markup)
-                elif media_type == 'animation':
-                    return await bot.send_animation(user_id, file_id, caption=caption, reply_markup=markup)
-                elif media_type == 'document':
-                    return await bot.send_document(user_id, file_id, caption=caption, reply_markup=markup)
-
-            tasks.append(send_with_delay(channel_user.user_id))
-
-        # Отправляем всем параллельно
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Считаем успешные отправки
-        successful_sends = sum(1 for r in results if not isinstance(r, Exception))
-        
-        execution_time = int((time.time() - start_time) * 1000)
-        time_str = f"{execution_time}ms" if execution_time < 1000 else f"{execution_time/1000:.1f}s"
-
-        # Обновляем статус
-        await status_msg.edit_text(
-            f"📡 Сигнал доставлен на канал `{user.channel}Hz`\n"
-            f"👥 Получателей: `{successful_sends}/{recipients_count}`\n"
-            f"⚡️ Время доставки: `{time_str}`",
-            parse_mode="Markdown"
-        )
-        
-        asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
-
-    except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"[ERROR] Error in handle_media: {e}")
-        print(traceback.format_exc())
-        print(f"{'='*50}\n")
-        await message.answer(
-            "❌ *Ошибка при отправке медиа*",
-            parse_mode="Markdown"
-        )
-
-@dp.message_handler(content_types=['message_reaction'])
-async def handle_reaction(message: types.Message):
-    try:
-        # Получаем информацию о реакции
-        reaction = message.message_reaction
-        if not reaction:
-            return
-            
-        # Получаем канал пользователя
-        user = User.get_user(message.from_user.id)
-        if not user:
-            return
-            
-        # Получаем mapping сообщений для этого канала
-        channel_mapping = message_mappings.get(user.channel, {})
-        if not channel_mapping:
-            return
-            
-        # Получаем mapping для конкретного сообщения
-        message_mapping = channel_mapping.get(message.message_id, {})
-        if not message_mapping:
-            return
-            
-        # Устанавливаем реакцию на все связанные сообщения
-        for user_id, msg_id in message_mapping.items():
-            try:
-                await bot.set_message_reaction(
-                    chat_id=user_id,
-                    message_id=msg_id,
-                    reaction=[types.ReactionType(type="emoji", emoji=reaction.emoji)]
-                )
-            except Exception as e:
-                print(f"Failed to set reaction for user {user_id}: {e}")
-                continue
-                
-        # Устанавливаем реакцию на оригинальное сообщение
-        try:
-            await bot.set_message_reaction(
-                chat_id=message.chat.id,
-                message_id=message.message_id,
-                reaction=[types.ReactionType(type="emoji", emoji=reaction.emoji)]
-            )
-        except Exception as e:
-            print(f"Failed to set reaction on original message: {e}")
-
-    except Exception as e:
-        print(f"[ERROR] Error in handle_reaction: {e}")
-        traceback.print_exc()
-
-if __name__ == '__main__':
-    init_db()
-    init_messages_db()
-    asyncio.get_event_loop().create_task(start_channel_switchers())
-    executor.start_polling(dp, skip_updates=True)
\ No newline at end of file
+from aiogram import Bot, Dispatcher, types, executor
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from database import User, init_db
+from messages_db import init_messages_db
+from channel_index import channel_index
+from scheduler import SwitchScheduler
+from delivery import DeliveryEngine
+from mappings import message_mappings
+import async_db
+from user_cache import user_cache, make_profile, update_profile
+from prison import PrisonIndex
+from flood import flood_control
+from albums import AlbumCollector
+from markup import markup_cache
+from name_pool import name_pool
+from broadcasts import BroadcastRunner
+from webhook import start_webhook
+from state import is_shared, init_state_db, publish_event, watch_events
+from sharding import is_local
+import metrics
+from profiling import profiling_middleware, format_profile
+import config
+import functools
+import random
+import asyncio
+import time
+import traceback
+import json
+from restricted_names import is_name_allowed
+from datetime import datetime
+
+# Инициализация бота
+bot = Bot(
+    token=config.BOT_TOKEN,
+    server=TelegramAPIServer.from_base(config.BOT_API_SERVER) if config.BOT_API_SERVER else TELEGRAM_PRODUCTION
+)
+storage = MemoryStorage()
+dp = Dispatcher(bot, storage=storage)
+metrics.instrument_bot(bot)
+dp.middleware.setup(metrics.MetricsMiddleware())
+dp.middleware.setup(profiling_middleware)
+
+def owner_only(func):
+    @functools.wraps(func)
+    async def wrapper(message: types.Message):
+        if message.from_user.id != config.OWNER_ID:
+            await message.answer(
+                "🚫 *Ошибка*: Недостаточно прав",
+                parse_mode="Markdown"
+            )
+            return
+        return await func(message)
+    return wrapper
+
+def get_current_version():
+    try:
+        with open('version.txt', 'r') as f:
+            return f.read().strip()
+    except:
+        return "1.0.0"
+
+def generate_name():
+    return name_pool.full_name()
+
+def get_random_channel():
+    """Получить случайный канал"""
+    if random.random() < config.CHANNEL_CREATION_CHANCE:
+        return random.randint(config.MIN_CHANNEL, config.MAX_CHANNEL)
+    # Активные каналы берём из индекса - при общем состоянии он один на все воркеры
+    active_channels = [channel for channel in channel_index.channels() if channel != config.PRISON_CHANNEL]
+    return random.choice(active_channels) if active_channels else random.randint(config.MIN_CHANNEL, config.MAX_CHANNEL)
+
+def get_display_name(user: User):
+    """Получить отображаемое имя пользователя"""
+    display_name = user.custom_name if user.custom_name else user.name
+    if user.emoji:
+        display_name = f"{user.emoji} {display_name}"
+    return display_name
+
+def quote_message(quoted_name, quoted_text, text):
+    """Текст ответа с цитатой; из цитаты с цитатой берём только последнюю строку"""
+    if "╭─" in quoted_text:
+        lines = quoted_text.split("\n")
+        for i in range(len(lines)-1, -1, -1):
+            if not lines[i].startswith("╭─") and not lines[i].startswith("╰"):
+                quoted_text = lines[i]
+                break
+                
+    return (
+        f"╭─ {quoted_name}\n"
+        f"╰ {quoted_text}\n"
+        f"\n"
+        f"{text}"
+    )
+
+def create_user_button(name, user=None):
+    """Кнопка с именем пользователя (готовый JSON из markup_cache)"""
+    display_name = get_display_name(user) if user else name
+    
+    # Определяем callback_data в зависимости от типа кнопки
+    if name == "Система":
+        callback_data = "system"
+    elif name == "Владелец":
+        callback_data = "owner"
+    else:
+        callback_data = "name"
+        
+    return markup_cache.get(callback_data, display_name)
+
+@dp.errors_handler()
+async def errors_handler(update: types.Update, exception: Exception):
+    """
+    Глобальный обработчик ошибок
+    """
+    print(f"\n{'='*50}\n[ERROR] Unexpected error: {exception}")
+    print(f"Update: {update}")
+    print(traceback.format_exc())
+    print(f"{'='*50}\n")
+    return True
+
+async def user_changed(user_id):
+    """Сбрасывает профиль в кеше и сообщает об изменении остальным воркерам"""
+    profile = user_cache.peek(user_id)
+    if profile:
+        markup_cache.invalidate(profile.display_name)
+    user_cache.invalidate(user_id)
+    await publish_event('user', user_id)
+
+async def on_state_event(kind, user_id):
+    """Пользователя изменил другой воркер - перечитываем то, что держим в памяти"""
+    profile = user_cache.peek(user_id)
+    if profile:
+        markup_cache.invalidate(profile.display_name)
+    user_cache.invalidate(user_id)
+    prisoner = await async_db.get_prison_user(user_id)
+    if prisoner:
+        prison_index.jail(user_id, prisoner.until)
+    else:
+        prison_index.release(user_id)
+
+async def forget_user(user_id):
+    """Удаляет пользователя, который заблокировал бота или удалил аккаунт"""
+    print(f"User {user_id} is unreachable, removing from database")
+    channel_index.remove(user_id)
+    switch_scheduler.unschedule(user_id)
+    prison_index.release(user_id)
+    await user_changed(user_id)
+    await async_db.delete_user(user_id)
+
+delivery = DeliveryEngine(on_gone=forget_user)
+
+async def start_channel_switchers():
+    """Запускает планировщик переключения каналов"""
+    for user_id in await async_db.get_user_ids():
+        # Каждый воркер переключает только своих пользователей
+        if is_local(user_id):
+            switch_scheduler.schedule(user_id)
+    asyncio.create_task(switch_scheduler.run())
+    print(f"Started channel switcher for {len(switch_scheduler)} users")
+
+async def switch_channel(user_ids):
+    """Автоматическое переключение канала для пачки пользователей"""
+    profiles = await user_cache.get_many(user_ids)
+    
+    # Пользователей, которых больше нет в базе, убираем из расписания
+    for user_id in user_ids:
+        if user_id not in profiles:
+            switch_scheduler.unschedule(user_id)
+    
+    switched = []
+    new_names = iter(name_pool.full_names(len(profiles)))
+    for user in profiles.values():
+        if prison_index.is_jailed(user.user_id):
+            continue
+            
+        new_channel = get_random_channel()
+        new_name = next(new_names)
+        
+        # Обновляем только если нет кастомного имени
+        if not user.custom_name:
+            markup_cache.invalidate(user.display_name)
+        switched.append((
+            update_profile(user, channel=new_channel, name=user.name if user.custom_name else new_name),
+            new_name
+        ))
+    
+    if not switched:
+        return
+        
+    generation = user_cache.generation
+    await async_db.update_user_channels([(user.user_id, user.channel, user.name) for user, _ in switched])
+    for user, _ in switched:
+        channel_index.set_channel(user.user_id, user.channel)
+        # Если профиль успели изменить во время записи, просто перечитаем его позже
+        if user_cache.generation == generation:
+            user_cache.put(user)
+        else:
+            user_cache.invalidate(user.user_id)
+    
+    switched_users = {user.user_id: (user, new_name) for user, new_name in switched}
+    
+    def notify(user_id):
+        user, new_name = switched_users[user_id]
+        return bot.send_message(
+            user_id,
+            f"👁 *Моргнув*, ты оказался на канале `{user.channel}Hz`\n"
+            f"🎭 *Твоё имя*: `{get_display_name(user)}`",
+            parse_mode="Markdown",
+            reply_markup=create_user_button(new_name, user)
+        )
+    
+    for result in await delivery.fan_out(switched_users, notify):
+        if result.error:
+            print(f"\n{'='*50}")
+            print(f"[ERROR] Failed to send channel switch message to {result.chat_id}: {result.error}")
+            print(f"{'='*50}\n")
+
+switch_scheduler = SwitchScheduler(switch_channel)
+
+async def release_prisoners(user_ids):
+    """Освобождает пачку заключённых и переносит их на случайные каналы"""
+    changes = [(user_id, get_random_channel()) for user_id in user_ids]
+    registered = {user_id for user_id, _ in changes if channel_index.get_channel(user_id) is not None}
+    await async_db.release_prisoners(changes)
+    
+    channels = {}
+    for user_id, channel in changes:
+        prison_index.release(user_id)
+        await user_changed(user_id)
+        if user_id in registered:
+            channel_index.set_channel(user_id, channel)
+            channels[user_id] = channel
+    
+    def notify(user_id):
+        return bot.send_message(
+            user_id,
+            "🌟 *Ты пришел в себя*...\n"
+            f"_И оказался на канале_ `{channels[user_id]}Hz`",
+            parse_mode="Markdown"
+        )
+    
+    for result in await delivery.fan_out(channels, notify):
+        if result.error:
+            print(f"Failed to send release message to {result.chat_id}: {result.error}")
+
+prison_index = PrisonIndex(release_prisoners)
+
+broadcasts = BroadcastRunner(bot, delivery, create_user_button)
+
+@dp.message_handler(commands=['start'])
+async def cmd_start(message: types.Message):
+    try:
+        user = await user_cache.get(message.from_user.id)
+        if not user:
+            channel = get_least_populated_channel()
+            name = generate_name()
+            
+            user = await async_db.create_user(
+                user_id=message.from_user.id,
+                name=name,
+                channel=channel,
+                created_at=datetime.now()
+            )
+            user_cache.put(make_profile(user))
+            channel_index.set_channel(user.user_id, channel)
+            switch_scheduler.schedule(user.user_id)
+            
+            users_count = channel_index.count(channel)
+            
+            await message.answer(
+                f"👋 Привет!\n\n"
+                f"📡 Твой канал: `{channel}Hz`\n"
+                f"👤 Твоё имя: `{get_display_name(user)}`\n"
+                f"👥 Пользователей на канале: `{users_count}`\n\n"
+                "📝 Команды:\n"
+                "/help - справка",
+                parse_mode="Markdown"
+            )
+        else:
+            users_count = channel_index.count(user.channel)
+            
+            await message.answer(
+                f"📡 Твой канал: `{user.channel}Hz`\n"
+                f"👤 Твоё имя: `{get_display_name(user)}`\n"
+                f"👥 Пользователей на канале: `{users_count}`\n\n"
+                "📝 Команды:\n"
+                "/help - справка",
+                parse_mode="Markdown"
+            )
+            
+    except Exception as e:
+        await bot.send_message(
+            config.OWNER_ID,
+            f"❌ *Error in cmd_start*:\n"
+            f"User ID: `{message.from_user.id}`\n"
+            f"Error: `{str(e)}`\n"
+            f"Traceback: ```\n{traceback.format_exc()}```",
+            parse_mode="Markdown"
+        )
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_start: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['help'])
+async def cmd_help(message: types.Message):
+    try:
+        current_version = get_current_version()
+        base_commands = (
+            f"*📡 Версия бота: {current_version}*\n\n"
+            "*Доступные команды:*\n\n"
+            "• /start - Начать использование бота\n"
+            "• /help - Показать это сообщение\n"
+            "• /name [имя] - Установить своё имя\n"
+            "• /scan - Просканировать каналы\n"
+            "• /goto [канал] - Переместиться на канал\n"
+            "_Каналы переключаются автоматически_"
+        )
+        
+        owner_commands = (
+            "\n\n*👑 Команды владельца:*\n\n"
+            "• /version [номер] [текст] - Отправить обновление\n"
+            "• /broadcast [текст] - Отправить сообщение всем пользователям\n"
+            "• /bcancel [номер] - Остановить рассылку\n"
+            "• /flood - Статистика защиты от флуда\n"
+            "• /slow [update_id] - Самые медленные обновления (с номером - профиль)\n"
+            "• /zov [user_id] [время] [причина] - Отправить в тюрьму\n"
+            "• /unzov [user_id] - Освободить из тюрьмы\n"
+            "• /emoji [user_id] [emoji] - Установить эмодзи пользователю\n"
+            "• /resetname [user_id] - Сбросить кастомное имя\n"
+            "• /del - Удалить сообщение (ответом на сообщение)"
+        )
+        
+        help_text = base_commands + (owner_commands if message.from_user.id == config.OWNER_ID else "")
+        await message.answer(help_text, parse_mode="Markdown")
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_help: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer("Произошла ошибка при отображении помощи.")
+
+@dp.message_handler(commands=['scan'])
+async def cmd_scan(message: types.Message):
+    try:
+        scan_results = []
+        
+        # Население каналов - из индекса в памяти, без запросов к базе
+        populations = channel_index.populations()
+        for channel, user_count in sorted(populations.items()):
+            scan_results.append(
+                f"👁 Канал: `{channel}Hz`\n"
+                f"👥 Пользователей: `{user_count}`\n"
+            )
+        
+        if scan_results:
+            await message.answer(
+                "🔍 *Результаты сканирования:*\n\n" + "\n".join(scan_results),
+                parse_mode="Markdown"
+            )
+        else:
+            await message.answer(
+                "😔 *Не найдено активных каналов...*",
+                parse_mode="Markdown"
+            )
+            
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_scan: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer("❌ *Ошибка при сканировании*", parse_mode="Markdown")
+
+@dp.message_handler(commands=['goto', 'channel'])
+async def cmd_goto(message: types.Message):
+    if message.get_command() == '/channel':
+        await message.answer(
+            "❗️ Ссылка на /goto\n"
+            "Пример команды: `/channel канал`, `/goto канал`",
+            parse_mode="Markdown"
+        )
+    try:
+        args = message.text.split()
+        if len(args) != 2:
+            await message.answer(
+                "❌ *Ошибка*: Неверный формат команды\n"
+                "Используйте: `/goto канал`",
+                parse_mode="Markdown"
+            )
+            return
+            
+        channel = int(args[1])
+        user_id = message.from_user.id
+        
+        # Проверка на тюремный канал
+        if channel == config.PRISON_CHANNEL:
+            await message.answer(
+                random.choice(config.PRISON_MESSAGES),
+                parse_mode="Markdown"
+            )
+            return
+            
+        if channel < config.MIN_CHANNEL or channel > config.MAX_CHANNEL:
+            await message.answer(
+                "❌ *Ошибка*: Недопустимый канал\n"
+                f"Диапазон: от `{config.MIN_CHANNEL}` до `{config.MAX_CHANNEL}`",
+                parse_mode="Markdown"
+            )
+            return
+            
+        user = await async_db.get_user(user_id)
+        if not user:
+            await message.answer(
+                "❌ *Ошибка*: Пользователь не найден",
+                parse_mode="Markdown"
+            )
+            return
+
+        # Обновляем только канал, имя не трогаем если есть кастомное
+        if not user.custom_name:
+            user.name = generate_name()
+        user.channel = channel
+        await async_db.save(user)
+        await user_changed(user_id)
+        channel_index.set_channel(user_id, channel)
+        
+        # Сообщение пользователю
+        await message.answer(
+            "😌 *Ты ненадолго закрыл глаза*...\n"
+            f"_И оказался на канале_ `{channel}Hz`",
+            parse_mode="Markdown",
+            reply_markup=create_user_button(user.name, user)
+        )
+            
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_goto: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['name', 'tag'])
+async def cmd_name(message: types.Message):
+    if message.get_command() == '/tag':
+        await message.answer(
+            "❗️ Ссылка на команду /name\n"
+            "Пример команды: `/tag ник`, `/name ник`",
+            parse_mode="Markdown"
+        )
+    try:
+        args = message.text.split(maxsplit=1)
+        if len(args) != 2:
+            await message.answer(
+                "❌ *Ошибка*: Укажите имя\n"
+                "Используйте: `/name Новое Имя`",
+                parse_mode="Markdown"
+            )
+            return
+            
+        new_name = args[1]
+        user_id = message.from_user.id
+        
+        # Проверяем, разрешено ли имя
+        is_allowed, error_msg = is_name_allowed(new_name, user_id)
+        if not is_allowed:
+            await message.answer(error_msg, parse_mode="Markdown")
+            return
+            
+        # Получаем или создаем пользователя
+        user = await async_db.get_user(user_id)
+        if not user:
+            await message.answer(
+                "❌ *Ошибка*: Сначала используйте /start",
+                parse_mode="Markdown"
+            )
+            return
+            
+        # Обновляем имя
+        user.custom_name = new_name
+        await async_db.save(user)
+        await user_changed(user_id)
+        
+        await message.answer(
+            f"✅ Установлено имя: `{new_name}`",
+            parse_mode="Markdown"
+        )
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_name: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['resetname'])
+@owner_only
+async def cmd_resetname(message: types.Message):
+    try:
+        args = message.text.split()
+        user_id = None
+        
+        # Если это ответ на сообщение
+        if message.reply_to_message:
+            user_id = message.reply_to_message.from_user.id
+        else:
+            # Стандартный вариант через ID
+            if len(args) != 2:
+                await message.answer(
+                    "❌ *Ошибка*: Неверный формат команды\n"
+                    "Используйте:\n"
+                    "• `/resetname user_id`\n"
+                    "• Ответом на сообщение: `/resetname`",
+                    parse_mode="Markdown"
+                )
+                return
+            user_id = int(args[1])
+            
+        user = await async_db.get_user(user_id)
+        if not user:
+            await message.answer(
+                "❌ *Ошибка*: Пользователь не найден",
+                parse_mode="Markdown"
+            )
+            return
+            
+        user.custom_name = None
+        await async_db.save(user)
+        await user_changed(user_id)
+        
+        await message.answer(
+            "✅ Кастомное имя удалено",
+            parse_mode="Markdown"
+        )
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_resetname: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['emoji'])
+@owner_only
+async def cmd_emoji(message: types.Message):
+    try:
+        args = message.text.split()
+        user_id = None
+        emoji = None
+        
+        # Если это ответ на сообщение
+        if message.reply_to_message:
+            user_id = message.reply_to_message.from_user.id
+            if len(args) != 2:
+                await message.answer(
+                    "❌ *Ошибка*: Укажите эмодзи\n"
+                    "Используйте: `/emoji 🌟`",
+                    parse_mode="Markdown"
+                )
+                return
+            emoji = args[1]
+        else:
+            # Стандартный вариант через ID
+            if len(args) != 3:
+                await message.answer(
+                    "❌ *Ошибка*: Неверный формат команды\n"
+                    "Используйте:\n"
+                    "• `/emoji user_id emoji`\n"
+                    "• Ответом на сообщение: `/emoji emoji`",
+                    parse_mode="Markdown"
+                )
+                return
+            user_id = int(args[1])
+            emoji = args[2]
+            
+        user = await async_db.get_user(user_id)
+        if not user:
+            await message.answer(
+                "❌ *Ошибка*: Пользователь не найден",
+                parse_mode="Markdown"
+            )
+            return
+            
+        user.emoji = emoji
+        await async_db.save(user)
+        await user_changed(user_id)
+        
+        await message.answer(
+            f"✅ Установлен эмодзи: {emoji}",
+            parse_mode="Markdown"
+        )
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_emoji: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['version'])
+@owner_only
+async def cmd_version(message: types.Message):
+    try:
+        args = message.text.split(maxsplit=2)
+        if len(args) < 3:
+            await message.answer(
+                "❌ *Ошибка*: Неверный формат команды\n"
+                "Используйте: `/version номер текст`",
+                parse_mode="Markdown"
+            )
+            return
+            
+        version = args[1]
+        text = args[2]
+        
+        # Обновляем версию
+        with open('version.txt', 'w') as f:
+            f.write(version)
+            
+        # Формируем сообщение об обновлении
+        update_message = (
+            "🌟 *Обновление!*\n\n"
+            f"📦 Версия: `{version}`\n"
+            "📝 Что нового:\n"
+            f"{text}"
+        )
+        
+        # Отправляем в канал обновлений
+        try:
+            await bot.send_message(
+                chat_id=config.UPDATE_CHANNEL,
+                text=update_message,
+                parse_mode="Markdown"
+            )
+        except Exception as e:
+            print(f"Failed to send update to channel: {e}")
+        
+        # Отправляем всем пользователям в фоне, прогресс в статусном сообщении
+        status_msg = await message.answer(
+            "📡 *Обновление отправлено в канал, начинаю рассылку...*",
+            parse_mode="Markdown"
+        )
+        await broadcasts.start("version", update_message, "Система", status_msg)
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_version: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при отправке обновления*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['broadcast', 'broad'])
+@owner_only
+async def cmd_broadcast(message: types.Message):
+    try:
+        args = message.text.split(maxsplit=1)
+        if len(args) != 2:
+            await message.answer(
+                "❌ *Ошибка*: Укажите сообщение\n"
+                "Используйте: `/broadcast текст` или `/broad текст`\n\n"
+                "Форматирование:\n"
+                "`nn` - код\n"
+                "*nn* - жирный текст\n"
+                "_nn_ - курсив\n"
+                "~nn~ - зачеркнутый\n"
+                "||nn|| - спойлер\n"
+                "@username - упоминание\n"
+                "`#ffffff` - цвет (HEX)",
+                parse_mode="Markdown"
+            )
+            return
+            
+        text = args[1]
+        
+        # Заменяем тире на обычное
+        text = text.replace('—', '-')
+        
+        # Рассылка идёт в фоне, прогресс в статусном сообщении
+        status_msg = await message.answer(
+            "📡 *Начинаю рассылку...*",
+            parse_mode="Markdown"
+        )
+        await broadcasts.start("broadcast", text, "Владелец", status_msg)
+            
+    except Exception as e:
+        await bot.send_message(
+            config.OWNER_ID,
+            f"❌ *Error in cmd_broadcast*:\n"
+            f"Error: `{str(e)}`\n"
+            f"Traceback: ```\n{traceback.format_exc()}```",
+            parse_mode="Markdown"
+        )
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_broadcast: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при отправке сообщения*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['bcancel'])
+@owner_only
+async def cmd_bcancel(message: types.Message):
+    try:
+        args = message.text.split()
+        if len(args) != 2:
+            await message.answer(
+                "❌ *Ошибка*: Неверный формат команды\n"
+                "Используйте: `/bcancel номер_рассылки`",
+                parse_mode="Markdown"
+            )
+            return
+            
+        job_id = int(args[1])
+        if not broadcasts.cancel(job_id):
+            await message.answer(
+                "❌ *Ошибка*: Рассылка не найдена или уже завершена",
+                parse_mode="Markdown"
+            )
+            return
+            
+        await message.answer(
+            f"🛑 Рассылка #{job_id} будет остановлена",
+            parse_mode="Markdown"
+        )
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_bcancel: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['flood'])
+@owner_only
+async def cmd_flood(message: types.Message):
+    try:
+        stats = flood_control.stats()
+        await message.answer(
+            "🛡 *Защита от флуда*\n\n"
+            f"✅ Пропущено: `{stats['allowed']}`\n"
+            f"👤 Отклонено (пользователь): `{stats['rejected_user']}`\n"
+            f"📡 Отклонено (канал): `{stats['rejected_channel']}`\n"
+            f"🧠 Пользователей в памяти: `{stats['users']}`",
+            parse_mode="Markdown"
+        )
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_flood: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['slow'])
+@owner_only
+async def cmd_slow(message: types.Message):
+    try:
+        args = message.text.split()
+        if len(args) > 1:
+            if not args[1].isdigit():
+                await message.answer(
+                    "❌ *Использование*: /slow [update\\_id]",
+                    parse_mode="Markdown"
+                )
+                return
+            profile = profiling_middleware.find(int(args[1]))
+            if not profile:
+                await message.answer("❌ *Обновление не найдено среди медленных*", parse_mode="Markdown")
+                return
+            await message.answer(format_profile(profile), parse_mode="Markdown")
+            if profile.stats:
+                # Отчёт cProfile без разметки, в пределах лимита Telegram
+                await message.answer(profile.stats[:4000])
+            return
+
+        slowest = profiling_middleware.slowest()
+        if not slowest:
+            await message.answer(
+                f"🐢 Медленных обновлений (> {config.SLOW_UPDATE_THRESHOLD}s) пока нет",
+                parse_mode="Markdown"
+            )
+            return
+        await message.answer(
+            f"🐢 *Самые медленные обновления* (> {config.SLOW_UPDATE_THRESHOLD}s)\n\n" +
+            "\n".join(format_profile(profile) for profile in slowest),
+            parse_mode="Markdown"
+        )
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_slow: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['zov'])
+@owner_only
+async def cmd_zov(message: types.Message):
+    try:
+        args = message.text.split()
+        if len(args) < 2:
+            await message.answer(
+                "❌ *Ошибка*: Укажите user_id\n"
+                "Используйте:\n"
+                "• `/zov user_id` _(навсегда)_\n"
+                "• `/zov user_id 30m` _(на 30 минут)_\n"
+                "• `/zov user_id 2h` _(на 2 часа)_\n"
+                "• `/zov user_id 1d` _(на 1 день)_\n"
+                "• `/zov user_id причина` _(навсегда с причиной)_\n"
+                "• `/zov user_id 30m причина` _(на время с причиной)_",
+                parse_mode="Markdown"
+            )
+            return
+
+        user_id = int(args[1])
+        until = None
+        reason = None
+        
+        if len(args) > 2:
+            # Проверяем, является ли второй аргумент временем
+            time_str = args[2].lower()
+            if any(time_str.endswith(unit) for unit in ['m', 'h', 'd']):
+                try:
+                    # Парсим время
+                    multiplier = {'m': 60, 'h': 3600, 'd': 86400}
+                    time_value = int(time_str[:-1])
+                    time_unit = time_str[-1]
+                    
+                    if time_unit in multiplier:
+                        until = int(time.time()) + (time_value * multiplier[time_unit])
+                        # Если есть причина после времени
+                        if len(args) > 3:
+                            reason = ' '.join(args[3:])
+                except ValueError:
+                    # Если не удалось распарсить время, считаем это причиной
+                    reason = ' '.join(args[2:])
+            else:
+                # Если второй аргумент не время, значит это причина
+                reason = ' '.join(args[2:])
+        
+        user = await async_db.get_user(user_id)
+        if not user:
+            await message.answer(
+                "❌ *Ошибка*: Пользователь не найден",
+                parse_mode="Markdown"
+            )
+            return
+        
+        # Сохраняем в базу
+        await async_db.create_prison_user(
+            user_id=user_id,
+            reason=reason or "Не указана",
+            until=until
+        )
+        prison_index.jail(user_id, until)
+        
+        # Перемещаем пользователя
+        user.channel = config.PRISON_CHANNEL
+        await async_db.save(user)
+        await user_changed(user_id)
+        channel_index.set_channel(user_id, config.PRISON_CHANNEL)
+        
+        # Формируем сообщение для владельца
+        status = []
+        status.append(f"👤 *Пользователь*: `{get_display_name(user)}`")
+        
+        if until:
+            time_left = until - int(time.time())
+            hours = time_left // 3600
+            minutes = (time_left % 3600) // 60
+            status.append(f"⏱ *Время*: `{hours}ч {minutes}м`")
+        else:
+            status.append("⏱ *Время*: `навсегда`")
+            
+        if reason:
+            status.append(f"📝 *Причина*: `{reason}`")
+        
+        # Отправляем сообщение пользователю
+        await bot.send_message(
+            user_id,
+            "😵 *Ты потерял сознание*...\n"
+            f"_После того, как ты очнулся, ты оказался на канале_ `{config.PRISON_CHANNEL}Hz`...\n"
+            "💀 *Ты не можешь говорить*...",
+            parse_mode="Markdown"
+        )
+        
+        # Отправляем подтверждение владельцу
+        await message.answer(
+            f"✅ *Пользователь помещен в тюрьму*\n\n" + 
+            '\n'.join(status),
+            parse_mode="Markdown"
+        )
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_zov: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['unzov'])
+@owner_only
+async def cmd_unzov(message: types.Message):
+    try:
+        args = message.text.split()
+        if len(args) != 2:
+            await message.answer(
+                "❌ *Ошибка*: Неверный формат команды\n"
+                "Используйте: `/unzov user_id`",
+                parse_mode="Markdown"
+            )
+            return
+            
+        user_id = int(args[1])
+        
+        if user_id not in prison_index:
+            await message.answer(
+                "❌ *Ошибка*: Пользователь не находится в тюрьме",
+                parse_mode="Markdown"
+            )
+            return
+            
+        # Перемещаем пользователя на случайный канал
+        await release_prisoners([user_id])
+        
+        await message.answer(
+            "✅ Пользователь освобожден",
+            parse_mode="Markdown"
+        )
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_unzov: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при выполнении команды*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(commands=['del'])
+@owner_only
+async def cmd_del(message: types.Message):
+    try:
+        # Получаем сообщение, на которое ответили
+        if not message.reply_to_message:
+            await message.answer(
+                "❌ *Ошибка*: Ответьте на сообщение, которое хотите удалить",
+                parse_mode="Markdown"
+            )
+            return
+            
+        # Сначала дописываем историю, чтобы найти и самые свежие сообщения
+        await async_db.history_writer.flush()
+        details = await async_db.find_message_details(
+            message.chat.id,
+            message.reply_to_message.message_id
+        )
+        if not details:
+            await message.answer(
+                "❌ *Ошибка*: Сообщение не найдено в истории",
+                parse_mode="Markdown"
+            )
+            return
+            
+        # Группируем копии по чатам: {chat_id: [message_id]}
+        copies = {}
+        for chat_id, msg_id in details[4]:
+            copies.setdefault(chat_id, []).append(msg_id)
+        
+        def delete_copies(chat_id):
+            msg_ids = copies[chat_id]
+            if len(msg_ids) == 1:
+                return bot.delete_message(chat_id, msg_ids[0])
+            # Несколько сообщений в одном чате удаляются одним запросом
+            return bot.request('deleteMessages', {'chat_id': chat_id, 'message_ids': json.dumps(msg_ids)})
+        
+        # Удаляем все копии параллельно через движок рассылки
+        deleted_count = 0
+        failed_count = 0
+        for result in await delivery.fan_out(copies, delete_copies):
+            if result.error:
+                failed_count += len(copies[result.chat_id])
+                print(f"Failed to delete messages {copies[result.chat_id]} for user {result.chat_id}: {result.error}")
+            else:
+                deleted_count += len(copies[result.chat_id])
+                    
+        # Отправляем подтверждение
+        status_msg = await message.answer(
+            f"✅ Удалено сообщений: `{deleted_count}`" +
+            (f"\n❌ Не удалось удалить: `{failed_count}`" if failed_count else ""),
+            parse_mode="Markdown"
+        )
+        asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
+            
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in cmd_del: {e}")
+        print(f"Message: {message.text}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при удалении сообщения*",
+            parse_mode="Markdown"
+        )
+
+@dp.message_handler(content_types=['text'])
+async def handle_message(message: types.Message):
+    try:
+        # Флуд отсекаем в самом начале, до обращений к базе и API
+        channel = channel_index.get_channel(message.from_user.id)
+        wait = await flood_control.check(message.from_user.id, channel, channel_index.count(channel))
+        if wait > 0:
+            if flood_control.should_warn(message.from_user.id):
+                await message.answer(
+                    f"⏳ Подождите еще `{max(1, round(wait))}` сек.",
+                    parse_mode="Markdown"
+                )
+            return
+        
+        user = await user_cache.get(message.from_user.id)
+        if not user:
+            await message.answer(
+                "❌ *Ошибка*: Пользователь не найден\n"
+                "Используйте /start для регистрации",
+                parse_mode="Markdown"
+            )
+            return
+            
+        # Проверяем тюрьму
+        if prison_index.is_jailed(message.from_user.id):
+            await message.answer(
+                f"🚔 Вы в тюрьме еще `{prison_index.remaining_time(message.from_user.id)}` секунд",
+                parse_mode="Markdown"
+            )
+            # Если в тюрьме, сообщение не засчитываем
+            flood_control.refund(message.from_user.id)
+            return
+            
+        channel_users = channel_index.members(user.channel)
+        recipients_count = len(channel_users) - (channel_index.get_channel(message.from_user.id) == user.channel)
+            
+        if recipients_count == 0:
+            status_msg = await message.answer(
+                f"📡 На канале `{user.channel}Hz` никого нет...",
+                parse_mode="Markdown"
+            )
+            asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
+            return
+
+        markup = create_user_button(user.name, user)
+        
+        text = message.text
+        reply_msg = None
+        
+        if message.reply_to_message:
+            quoted_user = await user_cache.get(message.reply_to_message.from_user.id)
+            quoted_name = quoted_user.display_name if quoted_user else message.reply_to_message.from_user.first_name
+            text_with_quote = quote_message(quoted_name, message.reply_to_message.text, text)
+            reply_msg = message.reply_to_message
+
+        # Отправляем сообщения
+        status_msg = await message.answer(
+            "📡 *Отправляю...*",
+            parse_mode="Markdown"
+        )
+        
+        start_time = time.time()
+        results = []
+
+        def send_text(channel_user_id):
+            if channel_user_id == message.from_user.id and reply_msg:
+                return bot.send_message(
+                    channel_user_id,
+                    text,
+                    reply_to_message_id=reply_msg.message_id,
+                    reply_markup=markup
+                )
+            return bot.send_message(
+                channel_user_id,
+                text_with_quote if reply_msg else text,
+                reply_markup=markup
+            )
+
+        # Рассылаем через общий движок с учётом лимитов
+        for result in await delivery.fan_out(channel_users, send_text):
+            if result.error:
+                print(f"Failed to send message to {result.chat_id}: {result.error}")
+            else:
+                results.append((result.chat_id, result.message.message_id))
+
+        # Сохраняем результаты
+        if results:
+            await message_mappings.put(results)
+            await async_db.history_writer.add(
+                message.from_user.id,
+                user.display_name,
+                results,
+                text,
+                int(time.time()),
+                sender_message_id=message.message_id
+            )
+
+        execution_time = int((time.time() - start_time) * 1000)
+        time_str = f"{execution_time}ms" if execution_time < 1000 else f"{execution_time/1000:.1f}s"
+        
+        await status_msg.edit_text(
+            f"📡 Твой сигнал доставлен на канал `{user.channel}Hz`\n"
+            f"👥 Получателей: `{recipients_count}`\n"
+            f"⚡️ Время доставки: `{time_str}`",
+            parse_mode="Markdown"
+        )
+        
+        asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
+
+    except Exception as e:
+        print(f"[ERROR] Error in handle_message: {e}")
+        traceback.print_exc()
+        try:
+            await message.answer(
+                f"🚫 *Ошибка*: {str(e)}",
+                parse_mode="Markdown"
+            )
+        except:
+            pass
+
+async def delete_message_after(message: types.Message, delay: int):
+    """Удаляет сообщение после задержки"""
+    await asyncio.sleep(delay)
+    try:
+        await message.delete()
+    except Exception as e:
+        print(f"Failed to delete message: {e}")
+
+@dp.callback_query_handler()
+async def process_callback(callback_query: types.CallbackQuery):
+    try:
+        # Получаем данные из callback_data
+        callback_data = callback_query.data
+        
+        if callback_data == "name":
+            # Кнопка с именем пользователя
+            await callback_query.answer(
+                "Это имя пользователя",
+                show_alert=True
+            )
+            
+        elif callback_data == "system":
+            # Системное сообщение
+            await callback_query.answer(
+                "Это системное сообщение",
+                show_alert=True
+            )
+            
+        elif callback_data == "owner":
+            # Сообщение от владельца
+            await callback_query.answer(
+                "Это рассылка от владельца",
+                show_alert=True
+            )
+            
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in process_callback: {e}")
+        print(f"Callback data: {callback_query.data}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+
+def get_least_populated_channel() -> int:
+    """
+    Возвращает канал с наименьшим количеством пользователей
+    или случайный новый канал
+    """
+    # Население каналов берём из индекса; в тюремный канал новичков не отправляем
+    channel = channel_index.least_populated(exclude=(config.PRISON_CHANNEL,))
+    
+    # Если каналов нет или с вероятностью CHANNEL_CREATION_CHANCE создаем новый канал
+    if channel is None or random.random() < config.CHANNEL_CREATION_CHANCE:
+        return random.randint(config.MIN_CHANNEL, config.MAX_CHANNEL)
+    return channel
+
+@dp.message_handler(content_types=['photo', 'video', 'animation', 'document', 'media_group', 'sticker'])
+async def handle_media(message: types.Message):
+    try:
+        # Убираем проверку на MEDIA_ALLOWED_USERS
+        start_time = time.time()
+        
+        # Элементы альбома копим и рассылаем целиком (см. handle_album)
+        if message.media_group_id:
+            album_collector.add(message)
+            return
+        
+        # Флуд отсекаем в самом начале, до обращений к базе и API
+        channel = channel_index.get_channel(message.from_user.id)
+        wait = await flood_control.check(message.from_user.id, channel, channel_index.count(channel))
+        if wait > 0:
+            if flood_control.should_warn(message.from_user.id):
+                await message.answer(
+                    f"⏳ Подождите еще `{max(1, round(wait))}` секунд",
+                    parse_mode="Markdown"
+                )
+            return
+        
+        user = await user_cache.get(message.from_user.id)
+        if not user:
+            await message.answer(
+                "❌ *Ошибка*: Пользователь не найден\n"
+                "Используйте /start для регистрации",
+                parse_mode="Markdown"
+            )
+            return
+
+        channel_users = channel_index.members(user.channel)
+        recipients_count = len(channel_users) - (channel_index.get_channel(message.from_user.id) == user.channel)
+            
+        if recipients_count == 0:
+            status_msg = await message.answer(
+                f"📡 На канале `{user.channel}Hz` никого нет...",
+                parse_mode="Markdown"
+            )
+            asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
+            return
+
+        # Сначала отправляем статус
+        status_msg = await message.answer(
+            f"📡 Отправка сигнала на канал `{user.channel}Hz`\n"
+            f"👥 Получателей: `{recipients_count}`",
+            parse_mode="Markdown"
+        )
+
+        markup = create_user_button(user.name, user)
+        
+        # Получаем медиа и подпись
+        file_id = None
+        caption = message.caption or ""
+        media_type = None
+        
+        # Определяем тип медиа и file_id
+        if message.sticker:
+            file_id = message.sticker.file_id
+            media_type = 'sticker'
+        else:
+            if message.photo:
+                file_id = message.photo[-1].file_id
+                media_type = 'photo'
+            elif message.video:
+                file_id = message.video.file_id
+                media_type = 'video'
+            elif message.animation:
+                file_id = message.animation.file_id
+                media_type = 'animation'
+            elif message.document:
+                file_id = message.document.file_id
+                media_type = 'document'
+            
+        if not file_id:
+            return
+
+        def send_media(user_id):
+            if media_type == 'sticker':
+                return bot.send_sticker(user_id, file_id, reply_markup=markup)
+            elif media_type == 'photo':
+                return bot.send_photo(user_id, file_id, caption=caption, reply_markup=markup)
+            elif media_type == 'video':
+                return bot.send_video(user_id, file_id, caption=caption, reply_markup=markup)
+            elif media_type == 'animation':
+                return bot.send_animation(user_id, file_id, caption=caption, reply_markup=markup)
+            elif media_type == 'document':
+                return bot.send_document(user_id, file_id, caption=caption, reply_markup=markup)
+
+        # Рассылаем через общий движок с учётом лимитов
+        results = await delivery.fan_out(channel_users, send_media)
+        
+        # Считаем успешные отправки
+        delivered = [(r.chat_id, r.message.message_id) for r in results if not r.error]
+        successful_sends = len(delivered)
+        
+        # Сохраняем копии, чтобы работали реакции
+        if delivered:
+            await message_mappings.put(delivered)
+            await async_db.history_writer.add(
+                message.from_user.id,
+                user.display_name,
+                delivered,
+                caption,
+                int(time.time()),
+                sender_message_id=message.message_id
+            )
+        
+        execution_time = int((time.time() - start_time) * 1000)
+        time_str = f"{execution_time}ms" if execution_time < 1000 else f"{execution_time/1000:.1f}s"
+
+        # Обновляем статус
+        await status_msg.edit_text(
+            f"📡 Сигнал доставлен на канал `{user.channel}Hz`\n"
+            f"👥 Получателей: `{successful_sends}/{recipients_count}`\n"
+            f"⚡️ Время доставки: `{time_str}`",
+            parse_mode="Markdown"
+        )
+        
+        asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
+
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in handle_media: {e}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при отправке медиа*",
+            parse_mode="Markdown"
+        )
+
+def album_media(messages, header):
+    """InputMedia для send_media_group; имя отправителя - в подписи первого элемента"""
+    media = []
+    for item in messages:
+        caption = item.caption or ""
+        if not media:
+            caption = f"{header}\n{caption}" if caption else header
+        caption = caption[:1024] or None
+        
+        if item.photo:
+            media.append(types.InputMediaPhoto(item.photo[-1].file_id, caption=caption))
+        elif item.video:
+            media.append(types.InputMediaVideo(item.video.file_id, caption=caption))
+        elif item.document:
+            media.append(types.InputMediaDocument(item.document.file_id, caption=caption))
+    return media
+
+async def handle_album(messages):
+    """Рассылка альбома: один send_media_group на получателя и один статус на альбом"""
+    message = messages[0]
+    try:
+        start_time = time.time()
+        
+        # Альбом - одно сообщение и для защиты от флуда
+        channel = channel_index.get_channel(message.from_user.id)
+        wait = await flood_control.check(message.from_user.id, channel, channel_index.count(channel))
+        if wait > 0:
+            if flood_control.should_warn(message.from_user.id):
+                await message.answer(
+                    f"⏳ Подождите еще `{max(1, round(wait))}` секунд",
+                    parse_mode="Markdown"
+                )
+            return
+        
+        user = await user_cache.get(message.from_user.id)
+        if not user:
+            await message.answer(
+                "❌ *Ошибка*: Пользователь не найден\n"
+                "Используйте /start для регистрации",
+                parse_mode="Markdown"
+            )
+            return
+        
+        media = album_media(messages, f"👤 {user.display_name}")
+        if not media:
+            return
+        
+        channel_users = channel_index.members(user.channel)
+        recipients_count = len(channel_users) - (channel_index.get_channel(message.from_user.id) == user.channel)
+        
+        if recipients_count == 0:
+            status_msg = await message.answer(
+                f"📡 На канале `{user.channel}Hz` никого нет...",
+                parse_mode="Markdown"
+            )
+            asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
+            return
+        
+        status_msg = await message.answer(
+            f"📡 Отправка альбома на канал `{user.channel}Hz`\n"
+            f"🖼 Файлов: `{len(media)}`\n"
+            f"👥 Получателей: `{recipients_count}`",
+            parse_mode="Markdown"
+        )
+        
+        def send_album(user_id):
+            return bot.send_media_group(user_id, media)
+        
+        results = await delivery.fan_out(channel_users, send_album)
+        
+        # Копии по элементам: реакция на любое фото альбома доходит до тех же фото у остальных
+        delivered = {r.chat_id: [m.message_id for m in r.message] for r in results if not r.error}
+        for index in range(len(media)):
+            await message_mappings.put(
+                (chat_id, message_ids[index]) for chat_id, message_ids in delivered.items()
+                if index < len(message_ids)
+            )
+        
+        # В историю альбом попадает одной записью со всеми копиями - /del удалит его целиком
+        if delivered:
+            await async_db.history_writer.add(
+                message.from_user.id,
+                user.display_name,
+                [(chat_id, message_id) for chat_id, message_ids in delivered.items() for message_id in message_ids],
+                next((item.caption for item in messages if item.caption), ""),
+                int(time.time()),
+                sender_message_id=message.message_id
+            )
+        
+        execution_time = int((time.time() - start_time) * 1000)
+        time_str = f"{execution_time}ms" if execution_time < 1000 else f"{execution_time/1000:.1f}s"
+        
+        await status_msg.edit_text(
+            f"📡 Альбом доставлен на канал `{user.channel}Hz`\n"
+            f"🖼 Файлов: `{len(media)}`\n"
+            f"👥 Получателей: `{len(delivered)}/{recipients_count}`\n"
+            f"⚡️ Время доставки: `{time_str}`",
+            parse_mode="Markdown"
+        )
+        
+        asyncio.create_task(delete_message_after(status_msg, config.DELETE_STATS_AFTER))
+        
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"[ERROR] Error in handle_album: {e}")
+        print(traceback.format_exc())
+        print(f"{'='*50}\n")
+        await message.answer(
+            "❌ *Ошибка при отправке альбома*",
+            parse_mode="Markdown"
+        )
+
+album_collector = AlbumCollector(handle_album)
+
+def register_metrics():
+    """Показатели очередей и кешей, которые метрики читают на лету"""
+    registry = metrics.registry
+    registry.gauge('bot_scheduled_switches', 'Пользователи в расписании переключения каналов', fn=lambda: len(switch_scheduler))
+    registry.gauge('bot_prisoners', 'Пользователи в тюрьме', fn=lambda: len(prison_index))
+    registry.gauge('bot_broadcasts_running', 'Идущие рассылки', fn=lambda: len(broadcasts))
+    registry.gauge('bot_albums_pending', 'Альбомы, ожидающие остальных элементов', fn=lambda: len(album_collector))
+    registry.gauge('bot_history_pending', 'Сообщения истории в очереди на запись', fn=lambda: len(async_db.history_writer))
+    registry.gauge('bot_db_queue_depth', 'Запросы к базам, ждущие свободного потока', ['executor'], fn=async_db.queue_depths)
+    registry.gauge('bot_asyncio_tasks', 'Задачи asyncio в процессе', fn=lambda: len(asyncio.all_tasks()))
+
+    caches = {'users': user_cache, 'markup': markup_cache}
+    registry.gauge('bot_cache_size', 'Записей в кеше', ['cache'], fn=lambda: {
+        **{name: len(cache) for name, cache in caches.items()},
+        'mappings': len(message_mappings),
+    })
+    registry.counter('bot_cache_hits_total', 'Попадания в кеш', ['cache'],
+                     fn=lambda: {name: cache.hits for name, cache in caches.items()})
+    registry.counter('bot_cache_misses_total', 'Промахи кеша', ['cache'],
+                     fn=lambda: {name: cache.misses for name, cache in caches.items()})
+    registry.counter('bot_flood_messages_total', 'Сообщения, прошедшие через защиту от флуда', ['result'],
+                     fn=lambda: {result: value for result, value in flood_control.stats().items() if result != 'users'})
+
+def is_reaction_update(update: types.Update):
+    return 'message_reaction' in update.values
+
+async def handle_reaction(update: types.Update):
+    """
+    Ставит ту же реакцию на все копии сообщения.
+    В aiogram 2 нет типа message_reaction, поэтому обновление разбираем
+    из сырого JSON, а реакцию ставим прямым запросом setMessageReaction.
+    """
+    try:
+        reaction = update.values['message_reaction']
+        # Реакции от имени чата (анонимные) приходят без user
+        if not reaction.get('user'):
+            return
+            
+        user = await user_cache.get(reaction['user']['id'])
+        if not user:
+            return
+            
+        # Получаем все копии сообщения, на которое поставили реакцию
+        chat_id = reaction['chat']['id']
+        message_mapping = await message_mappings.get(chat_id, reaction['message_id'])
+        if not message_mapping:
+            return
+            
+        # Бот ставит не больше одной реакции; пустой список снимает её вслед за пользователем
+        emoji = [item for item in reaction.get('new_reaction', []) if item.get('type') == 'emoji'][:1]
+        payload = json.dumps(emoji, ensure_ascii=False)
+        
+        # Устанавливаем реакцию на все связанные сообщения
+        def send_reaction(user_id):
+            return bot.request('setMessageReaction', {
+                'chat_id': user_id,
+                'message_id': message_mapping[user_id],
+                'reaction': payload
+            })
+        
+        other_copies = [user_id for user_id in message_mapping if user_id != chat_id]
+        for result in await delivery.fan_out(other_copies, send_reaction):
+            if result.error:
+                print(f"Failed to set reaction for user {result.chat_id}: {result.error}")
+                
+        # Устанавливаем реакцию на оригинальное сообщение
+        try:
+            await bot.request('setMessageReaction', {
+                'chat_id': chat_id,
+                'message_id': reaction['message_id'],
+                'reaction': payload
+            })
+        except Exception as e:
+            print(f"Failed to set reaction on original message: {e}")
+
+    except Exception as e:
+        print(f"[ERROR] Error in handle_reaction: {e}")
+        traceback.print_exc()
+
+# Раньше process_update: обработчики обновлений вызываются до первого сработавшего
+dp.updates_handler.register(handle_reaction, [is_reaction_update], index=0)
+
+async def on_startup(dp):
+    """Общий запуск для polling и webhook"""
+    init_db()
+    init_messages_db()
+    if is_shared():
+        # Общий индекс каналов процесс-родитель уже собрал в state.db (sharding.py)
+        init_state_db()
+        channel_index.load()
+        asyncio.create_task(channel_index.run())
+        asyncio.create_task(watch_events(on_state_event))
+    else:
+        channel_index.load()
+    prison_index.load()
+    await start_channel_switchers()
+    asyncio.create_task(prison_index.run())
+    register_metrics()
+    if config.METRICS_PORT:
+        await metrics.start_metrics_server(port=config.METRICS_PORT + config.WORKER_INDEX)
+    # Рассылки живут у воркера владельца: туда же приходят /broadcast и /bcancel
+    if is_local(config.OWNER_ID):
+        asyncio.create_task(broadcasts.resume_all())
+    if config.WORKER_INDEX == 0 and config.HISTORY_RETENTION_DAYS:
+        asyncio.create_task(async_db.history_retention.run())
+
+async def on_shutdown(dp):
+    """Дорассылает альбомы, дописывает историю и дожидается незавершённых запросов к базам"""
+    await album_collector.drain()
+    await async_db.history_writer.drain()
+    await async_db.history_writer.flush()
+    if is_shared():
+        await channel_index.sync()
+    async_db.shutdown()
+
+if __name__ == '__main__':
+    if config.WORKERS > 1:
+        print("WORKERS > 1: запускайте бота через python sharding.py")
+    elif config.USE_WEBHOOK:
+        start_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown,
+                               allowed_updates=config.ALLOWED_UPDATES)
\ No newline at end of file
@@ -0,0 +1,84 @@
+import itertools
+import time
+from collections import OrderedDict
+
+import async_db
+import config
+from messages_db import item_copies
+
+
+class MessageMappings:
+    """
+    Соответствия между копиями одного сообщения у разных пользователей.
+    Свежие сообщения держатся в памяти (LRU с TTL и жёстким лимитом копий),
+    всё остальное читается из таблицы Delivery в messages.db, куда
+    копии попадают вместе с историей сообщений.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self._max_entries = max_entries or config.MAPPING_CACHE_MAX_ENTRIES
+        self._ttl = ttl or config.MAPPING_CACHE_TTL
+        self._groups = OrderedDict()  # {group_id: (expires_at, {chat_id: message_id})}
+        self._index = {}  # {(chat_id, message_id): group_id}
+        self._entries = 0
+        self._ids = itertools.count()
+
+    def __len__(self):
+        return self._entries
+
+    async def put(self, copies):
+        """Запоминает копии одного сообщения, copies - {chat_id: message_id}"""
+        copies = dict(copies)
+        if not copies or len(copies) > self._max_entries:
+            return
+        for key in copies.items():
+            if key in self._index:
+                self._drop(self._index[key])
+        group_id = next(self._ids)
+        self._groups[group_id] = (time.monotonic() + self._ttl, copies)
+        for key in copies.items():
+            self._index[key] = group_id
+        self._entries += len(copies)
+        self._evict()
+
+    async def get(self, chat_id, message_id):
+        """Возвращает {chat_id: message_id} для всех копий сообщения или None"""
+        group_id = self._index.get((chat_id, message_id))
+        if group_id is not None:
+            expires_at, copies = self._groups[group_id]
+            if expires_at > time.monotonic():
+                self._groups.move_to_end(group_id)
+                return copies
+            self._drop(group_id)
+
+        details = await async_db.find_message_details(chat_id, message_id)
+        if not details:
+            return None
+        copies = item_copies(details[4], chat_id, message_id)
+        await self.put(copies)
+        return copies
+
+    def _drop(self, group_id):
+        _, copies = self._groups.pop(group_id)
+        for key in copies.items():
+            self._index.pop(key, None)
+        self._entries -= len(copies)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._groups:
+            group_id, (expires_at, _) = next(iter(self._groups.items()))
+            if self._entries <= self._max_entries and expires_at > now:
+                break
+            self._drop(group_id)
+
+
+def create_message_mappings():
+    """Хранилище соответствий для выбранного STATE_BACKEND"""
+    if config.STATE_BACKEND == 'sqlite':
+        from state import SharedMessageMappings
+        return SharedMessageMappings()
+    return MessageMappings()
+
+
+message_mappings = create_message_mappings()
@@ -0,0 +1,50 @@
+from collections import OrderedDict
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.payload import prepare_arg
+
+import config
+
+# callback_data кнопок с именем отправителя
+BUTTON_KINDS = ('system', 'owner', 'name')
+
+
+class MarkupCache:
+    """
+    Готовые JSON-строки кнопок с именем отправителя.
+    aiogram передаёт строковый reply_markup как есть, поэтому
+    рассылка на тысячу получателей собирает и сериализует кнопку один раз.
+    """
+
+    def __init__(self, max_size=None):
+        self._max_size = max_size or config.MARKUP_CACHE_SIZE
+        self._payloads = OrderedDict()  # {(kind, display_name): JSON}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def get(self, kind, display_name):
+        key = (kind, display_name)
+        payload = self._payloads.get(key)
+        if payload is not None:
+            self._payloads.move_to_end(key)
+            self.hits += 1
+            return payload
+
+        self.misses += 1
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton(display_name, callback_data=kind))
+        payload = self._payloads[key] = prepare_arg(markup)
+        while len(self._payloads) > self._max_size:
+            self._payloads.popitem(last=False)
+        return payload
+
+    def invalidate(self, display_name):
+        """Сбрасывает кнопки со старым именем (после смены имени или эмодзи)"""
+        for kind in BUTTON_KINDS:
+            self._payloads.pop((kind, display_name), None)
+
+
+markup_cache = MarkupCache()
@@ -1,64 +1,501 @@
-from peewee import *
-import json
-import time
-
-messages_db = SqliteDatabase('messages.db')
-
-class BaseModel(Model):
-    class Meta:
-        database = messages_db
-
-class StoredMessage(BaseModel):
-    sender_id = BigIntegerField()
-    sender_name = TextField()  # Добавляем имя отправителя
-    message_data = TextField()  # Строка с парами user_id:message_id
-    message = TextField()
-    timestamp = BigIntegerField()
-    
-    @classmethod
-    def save_message_with_timestamp(cls, sender_id, sender_name, results, message, timestamp):
-        return cls.create(
-            sender_id=sender_id,
-            sender_name=sender_name,
-            message_data=" ".join(results),
-            message=message,
-            timestamp=timestamp
-        )
-        
-    @classmethod
-    def find_message_details(cls, sender_id, message_id):
-        """Ищем сообщение по ID отправителя и ID сообщения"""
-        try:
-            message = cls.select().where(
-                cls.message_data.contains(f"{sender_id}:{message_id}")
-            ).first()
-            
-            if message:
-                # Разбираем message_data на пары user_id:message_id
-                pairs = message.message_data.split()
-                recipient_messages = []
-                for pair in pairs:
-                    user_id, msg_id = pair.split(':')
-                    recipient_messages.append((int(user_id), int(msg_id)))
-                    
-                return message.sender_id, message_id, message.message, message.timestamp, recipient_messages
-                
-        except Exception as e:
-            print(f"Error finding message: {e}")
-            
-        return None
-
-def init_messages_db():
-    messages_db.connect()
-    
-    # Проверяем существование таблицы и столбца sender_name
-    cursor = messages_db.execute_sql('PRAGMA table_info(storedmessage)')
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    if 'sender_name' not in columns:
-        # Если нет столбца sender_name, пересоздаем таблицу
-        messages_db.drop_tables([StoredMessage], safe=True)
-        messages_db.create_tables([StoredMessage], safe=True)
-        print("Messages database schema updated successfully")
-    else:
-        messages_db.create_tables([StoredMessage], safe=True)
\ No newline at end of file
+from peewee import *
+import asyncio
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import config
+from migrations import run_migrations, add_column, create_index
+
+messages_db = SqliteDatabase('messages.db', pragmas=config.SQLITE_PRAGMAS)
+
+# Копий в одном INSERT: по 3 параметра на строку, SQLite по умолчанию принимает до 32766
+DELIVERY_BATCH = 300
+
+class BaseModel(Model):
+    class Meta:
+        database = messages_db
+
+class StoredMessage(BaseModel):
+    sender_id = BigIntegerField()
+    sender_name = TextField()  # Добавляем имя отправителя
+    sender_message_id = BigIntegerField(null=True)  # ID оригинального сообщения у отправителя
+    message_data = TextField(default='')  # Устарело: строка с парами user_id:message_id, см. Delivery
+    message = TextField()
+    timestamp = BigIntegerField(index=True)
+
+    class Meta:
+        indexes = (
+            (('sender_id', 'sender_message_id'), False),
+        )
+
+    @classmethod
+    def save_message_with_timestamp(cls, sender_id, sender_name, results, message, timestamp, sender_message_id=None):
+        """Сохраняет сообщение и его копии, results - пары (user_id, message_id)"""
+        Delivery = cls.delivery_model
+        with cls._meta.database.atomic():
+            stored = cls.create(
+                sender_id=sender_id,
+                sender_name=sender_name,
+                sender_message_id=sender_message_id,
+                message=message,
+                timestamp=timestamp
+            )
+            deliveries = [(stored.id, user_id, msg_id) for user_id, msg_id in results]
+            for batch in chunked(deliveries, DELIVERY_BATCH):
+                Delivery.insert_many(
+                    batch,
+                    fields=[Delivery.stored_message, Delivery.recipient_id, Delivery.recipient_message_id]
+                ).execute()
+        return stored
+
+    @classmethod
+    def save_many(cls, rows):
+        """Сохраняет пачку сообщений одной транзакцией, rows - аргументы save_message_with_timestamp"""
+        Delivery = cls.delivery_model
+        with cls._meta.database.atomic():
+            deliveries = []
+            for sender_id, sender_name, results, message, timestamp, sender_message_id in rows:
+                stored_id = cls.insert(
+                    sender_id=sender_id,
+                    sender_name=sender_name,
+                    sender_message_id=sender_message_id,
+                    message=message,
+                    timestamp=timestamp
+                ).execute()
+                deliveries.extend((stored_id, user_id, msg_id) for user_id, msg_id in results)
+
+            for batch in chunked(deliveries, DELIVERY_BATCH):
+                Delivery.insert_many(
+                    batch,
+                    fields=[Delivery.stored_message, Delivery.recipient_id, Delivery.recipient_message_id]
+                ).execute()
+
+    @classmethod
+    def find_message_details(cls, sender_id, message_id):
+        """Ищем сообщение по ID отправителя и ID сообщения"""
+        Delivery = cls.delivery_model
+        try:
+            delivery = (Delivery
+                        .select(Delivery, cls)
+                        .join(cls)
+                        .where(
+                            (Delivery.recipient_id == sender_id) &
+                            (Delivery.recipient_message_id == message_id)
+                        )
+                        .first())
+
+            if delivery:
+                message = delivery.stored_message
+            else:
+                # Может быть, это оригинал у самого отправителя
+                message = cls.select().where(
+                    (cls.sender_id == sender_id) & (cls.sender_message_id == message_id)
+                ).first()
+
+            if message:
+                recipient_messages = list(
+                    Delivery
+                    .select(Delivery.recipient_id, Delivery.recipient_message_id)
+                    .where(Delivery.stored_message == message.id)
+                    .order_by(Delivery.id)
+                    .tuples()
+                )
+
+                return message.sender_id, message_id, message.message, message.timestamp, recipient_messages
+
+        except Exception as e:
+            print(f"Error finding message: {e}")
+
+        return None
+
+class Delivery(BaseModel):
+    """Копия сообщения, доставленная одному получателю"""
+    stored_message = ForeignKeyField(StoredMessage, backref='deliveries', on_delete='CASCADE')
+    recipient_id = BigIntegerField()
+    recipient_message_id = BigIntegerField()
+
+    class Meta:
+        indexes = (
+            (('recipient_id', 'recipient_message_id'), True),
+        )
+
+StoredMessage.delivery_model = Delivery
+
+def item_copies(recipient_messages, chat_id, message_id):
+    """
+    Копии того же элемента, что message_id в чате chat_id, по записи истории.
+    У альбома в истории копии всех элементов подряд для каждого получателя,
+    поэтому берём у остальных элемент с тем же номером.
+    """
+    by_chat = {}
+    for recipient_id, recipient_message_id in recipient_messages:
+        by_chat.setdefault(recipient_id, []).append(recipient_message_id)
+    own = by_chat.get(chat_id, ())
+    index = own.index(message_id) if message_id in own else 0
+    return {recipient_id: message_ids[index] for recipient_id, message_ids in by_chat.items() if index < len(message_ids)}
+
+def partition_models(partition_db):
+    """Модели истории, привязанные к файлу-разделу"""
+    class PartitionMessage(StoredMessage):
+        class Meta:
+            database = partition_db
+            table_name = 'storedmessage'
+
+    class PartitionDelivery(Delivery):
+        stored_message = ForeignKeyField(PartitionMessage, backref='deliveries', on_delete='CASCADE')
+
+        class Meta:
+            database = partition_db
+            table_name = 'delivery'
+
+    PartitionMessage.delivery_model = PartitionDelivery
+    return PartitionMessage, PartitionDelivery
+
+class HistoryPartitions:
+    """
+    История, разбитая на файлы по периодам: history/messages_<период>.db.
+    Новые сообщения пишутся в раздел своего месяца (или дня, см.
+    HISTORY_PARTITION). Поиск идёт от новых разделов к старым и
+    заканчивается в messages.db, где осталась история до разбиения.
+    Истёкший раздел удаляется целиком - это удаление файла, а не строк.
+    Запись и очистка идут в потоке-писателе messages.db, поиск - в читателях.
+    """
+
+    def __init__(self, directory=None, period=None):
+        self._directory = directory or config.HISTORY_DIR
+        self._period = period or config.HISTORY_PARTITION
+        self._partitions = {}  # {ключ периода: (database, StoredMessage, Delivery)}
+        self._lock = threading.Lock()
+
+    def _key(self, timestamp):
+        return datetime.fromtimestamp(timestamp).strftime('%Y_%m_%d' if self._period == 'day' else '%Y_%m')
+
+    def _end(self, key):
+        """Время (unix), когда заканчивается период раздела"""
+        # Период определяем по самому ключу: после смены HISTORY_PARTITION остаются старые разделы
+        if key.count('_') == 2:
+            end = datetime.strptime(key, '%Y_%m_%d') + timedelta(days=1)
+        else:
+            start = datetime.strptime(key, '%Y_%m')
+            end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        return end.timestamp()
+
+    def _path(self, key):
+        return os.path.join(self._directory, f'messages_{key}.db')
+
+    def _open(self, key):
+        # auto_vacuum задаётся до создания таблиц, иначе он не включится
+        database = SqliteDatabase(self._path(key), pragmas={'auto_vacuum': 2, **config.SQLITE_PRAGMAS})
+        message, delivery = partition_models(database)
+        self._partitions[key] = (database, message, delivery)
+        return self._partitions[key]
+
+    def refresh(self):
+        """Сверяет список разделов с файлами (их могли создать или удалить другие процессы)"""
+        os.makedirs(self._directory, exist_ok=True)
+        keys = {
+            name[len('messages_'):-len('.db')] for name in os.listdir(self._directory)
+            if name.startswith('messages_') and name.endswith('.db')
+        }
+        with self._lock:
+            for key in keys - self._partitions.keys():
+                self._open(key)
+            for key in self._partitions.keys() - keys:
+                self._partitions.pop(key)[0].close()
+
+    def retained(self):
+        """Модели StoredMessage всех разделов, от новых к старым, последним - messages.db"""
+        with self._lock:
+            partitions = [self._partitions[key] for key in sorted(self._partitions, reverse=True)]
+        return [message for _, message, _ in partitions] + [StoredMessage]
+
+    def _partition(self, timestamp):
+        key = self._key(timestamp)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                os.makedirs(self._directory, exist_ok=True)
+                partition = self._open(key)
+                partition[0].connect(reuse_if_open=True)
+                partition[0].create_tables([partition[1], partition[2]], safe=True)
+        return partition[1]
+
+    def save_message_with_timestamp(self, sender_id, sender_name, results, message, timestamp, sender_message_id=None):
+        return self._partition(timestamp).save_message_with_timestamp(
+            sender_id, sender_name, results, message, timestamp, sender_message_id
+        )
+
+    def save_many(self, rows):
+        """Раскладывает пачку сообщений по разделам (обычно все в одном)"""
+        groups = {}
+        for row in rows:
+            groups.setdefault(self._partition(row[4]), []).append(row)
+        for message, group in groups.items():
+            message.save_many(group)
+
+    def find_message_details(self, chat_id, message_id):
+        """StoredMessage.find_message_details по всем хранящимся разделам"""
+        self.refresh()
+        for message in self.retained():
+            database = message._meta.database
+            if database is messages_db:
+                details = message.find_message_details(chat_id, message_id)
+            elif not self._connect(database):
+                continue  # раздел уже удалили при очистке
+            else:
+                # Соединение с разделом не держим: файл могут удалить при очистке
+                try:
+                    details = message.find_message_details(chat_id, message_id)
+                finally:
+                    database.close()
+            if details:
+                return details
+        return None
+
+    def _connect(self, database):
+        """Открывает соединение с разделом, если его файл ещё не удалён"""
+        # Под той же блокировкой, что и удаление: иначе connect() создал бы на месте
+        # удалённого раздела пустой файл, и поиск в нём падал бы с "no such table"
+        with self._lock:
+            if not any(database is partition[0] for partition in self._partitions.values()):
+                return False
+            if not os.path.exists(database.database):
+                return False  # файл удалил другой процесс
+            database.connect(reuse_if_open=True)
+            return True
+
+    def prune_step(self, cutoff, batch_size):
+        """
+        Один короткий шаг очистки: удаляет целиком истёкший раздел или
+        до batch_size сообщений старше cutoff. Возвращает 0, когда чистить нечего.
+        """
+        self.refresh()
+        with self._lock:
+            expired = [key for key in self._partitions if self._end(key) <= cutoff]
+            if expired:
+                key = min(expired)
+                self._partitions.pop(key)[0].close()
+                path = self._path(key)
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                print(f"Dropped history partition {key}")
+                return 1
+
+        # Частично истёкший раздел (или старая история в messages.db)
+        for message in reversed(self.retained()):
+            Delivery = message.delivery_model
+            database = message._meta.database
+            database.connect(reuse_if_open=True)
+            with database.atomic():
+                ids = [stored_id for (stored_id,) in
+                       message.select(message.id).where(message.timestamp < cutoff).limit(batch_size).tuples()]
+                if ids:
+                    Delivery.delete().where(Delivery.stored_message.in_(ids)).execute()
+                    message.delete().where(message.id.in_(ids)).execute()
+                    return len(ids)
+        return 0
+
+    def vacuum_step(self, pages):
+        """Возвращает системе до pages свободных страниц в каждом файле, результат - сколько ещё осталось"""
+        remaining = 0
+        for message in self.retained():
+            database = message._meta.database
+            database.connect(reuse_if_open=True)
+            database.execute_sql(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+            remaining += database.execute_sql('PRAGMA freelist_count').fetchone()[0]
+        return remaining
+
+class HistoryRetention:
+    """
+    Фоновая очистка истории старше HISTORY_RETENTION_DAYS.
+    Удаляет маленькими пачками с паузами, чтобы не держать запись
+    надолго, затем так же по частям возвращает место (incremental_vacuum).
+    """
+
+    def __init__(self, partitions, run_write, days=None):
+        self._partitions = partitions
+        self._run_write = run_write  # async run_write(fn, *args) - запуск в потоке-писателе
+        self._days = config.HISTORY_RETENTION_DAYS if days is None else days
+
+    async def prune(self):
+        """Один полный проход очистки, возвращает число удалённых сообщений и разделов"""
+        cutoff = time.time() - self._days * 86400
+        removed = 0
+        while True:
+            done = await self._run_write(self._partitions.prune_step, cutoff, config.HISTORY_PRUNE_BATCH)
+            if not done:
+                break
+            removed += done
+            await asyncio.sleep(config.HISTORY_PRUNE_PAUSE)
+
+        if removed:
+            while await self._run_write(self._partitions.vacuum_step, config.HISTORY_VACUUM_PAGES):
+                await asyncio.sleep(config.HISTORY_PRUNE_PAUSE)
+            print(f"History retention: removed {removed} old messages/partitions")
+        return removed
+
+    async def run(self):
+        while True:
+            try:
+                await self.prune()
+            except Exception as e:
+                print(f"\n{'='*50}")
+                print(f"[ERROR] History retention failed: {e}")
+                print(traceback.format_exc())
+                print(f"{'='*50}\n")
+            await asyncio.sleep(config.HISTORY_PRUNE_INTERVAL)
+
+class HistoryWriter:
+    """
+    Буфер отложенной записи истории.
+    Копит сообщения и сбрасывает их одной транзакцией каждые
+    HISTORY_BATCH_SIZE сообщений или HISTORY_FLUSH_INTERVAL_MS миллисекунд.
+    Если диск не успевает, add() ждёт, пока в буфере освободится место.
+    """
+
+    def __init__(self, run_write, batch_size=None, flush_interval_ms=None, max_pending=None):
+        self._run_write = run_write  # async run_write(fn, *args) - запуск в потоке-писателе
+        self._batch_size = batch_size or config.HISTORY_BATCH_SIZE
+        self._flush_interval = (flush_interval_ms or config.HISTORY_FLUSH_INTERVAL_MS) / 1000
+        self._space = asyncio.Semaphore(max_pending or config.HISTORY_MAX_PENDING)
+        self._flush_lock = asyncio.Lock()
+        self._rows = []
+        self._timer = None
+        self._tasks = set()  # запущенные сбросы: без ссылки задачу может собрать сборщик мусора
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _start_flush(self):
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _arm_timer(self):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._flush_interval, self._start_flush)
+
+    async def add(self, sender_id, sender_name, results, message, timestamp, sender_message_id=None):
+        """Ставит сообщение в очередь на запись"""
+        await self._space.acquire()
+        self._rows.append((sender_id, sender_name, list(results), message, timestamp, sender_message_id))
+        if len(self._rows) >= self._batch_size:
+            self._start_flush()
+        else:
+            self._arm_timer()
+
+    async def flush(self):
+        """Записывает всё накопленное (вызывается и при остановке бота)"""
+        async with self._flush_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            rows, self._rows = self._rows, []
+            if not rows:
+                return
+            try:
+                await self._run_write(history.save_many, rows)
+            except Exception as e:
+                print(f"\n{'='*50}")
+                print(f"[ERROR] Failed to flush {len(rows)} history rows: {e}")
+                print(traceback.format_exc())
+                print(f"{'='*50}\n")
+                # Возвращаем сообщения в буфер и повторяем позже, место в буфере они не освобождают
+                self._rows[:0] = rows
+                self._arm_timer()
+                return
+            for _ in rows:
+                self._space.release()
+
+    async def drain(self):
+        """Дожидается запущенных сбросов (при остановке бота, перед последним flush)"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+def migrate_message_data(batch_size=500):
+    """Переносит старые пары user_id:message_id из message_data в таблицу Delivery"""
+    migrated = 0
+    while True:
+        with messages_db.atomic():
+            rows = list(
+                StoredMessage
+                .select(StoredMessage.id, StoredMessage.message_data)
+                .where(StoredMessage.message_data != '')
+                .limit(batch_size)
+                .tuples()
+            )
+            if not rows:
+                break
+
+            deliveries = []
+            for stored_id, message_data in rows:
+                for pair in message_data.split():
+                    user_id, msg_id = pair.split(':')
+                    deliveries.append((stored_id, int(user_id), int(msg_id)))
+
+            for batch in chunked(deliveries, DELIVERY_BATCH):
+                Delivery.insert_many(
+                    batch,
+                    fields=[Delivery.stored_message, Delivery.recipient_id, Delivery.recipient_message_id]
+                ).on_conflict_ignore().execute()
+            StoredMessage.update(message_data='').where(
+                StoredMessage.id.in_([stored_id for stored_id, _ in rows])
+            ).execute()
+            migrated += len(rows)
+
+    if migrated:
+        print(f"Migrated {migrated} stored messages to the delivery table")
+
+def _create_stored_messages(database):
+    # Исходная схема таблицы; раньше без sender_name таблица пересоздавалась с потерей истории
+    database.execute_sql('''
+        CREATE TABLE IF NOT EXISTS storedmessage(
+            id INTEGER NOT NULL PRIMARY KEY,
+            sender_id BIGINT NOT NULL,
+            message_data TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp BIGINT NOT NULL
+        )
+    ''')
+    add_column(database, 'storedmessage', 'sender_name', "TEXT NOT NULL DEFAULT ''")
+
+def _add_sender_message_id(database):
+    add_column(database, 'storedmessage', 'sender_message_id', 'BIGINT NULL')
+    create_index(database, 'storedmessage_sender_id_sender_message_id', 'storedmessage',
+                 ['sender_id', 'sender_message_id'])
+
+def _create_deliveries(database):
+    database.create_tables([Delivery], safe=True)
+    migrate_message_data()
+
+def _index_timestamp(database):
+    create_index(database, 'storedmessage_timestamp', 'storedmessage', ['timestamp'])
+
+# (версия, описание, миграция)
+MIGRATIONS = [
+    (1, 'create storedmessage table, add sender_name', _create_stored_messages),
+    (2, 'add storedmessage.sender_message_id', _add_sender_message_id),
+    (3, 'move message_data pairs into delivery table', _create_deliveries),
+    (4, 'index storedmessage.timestamp for retention', _index_timestamp),
+]
+
+# Новые сообщения пишутся в разделы history/, messages.db хранит историю до разбиения
+history = HistoryPartitions()
+
+def init_messages_db():
+    messages_db.connect(reuse_if_open=True)
+    run_migrations(messages_db, MIGRATIONS)
+    
+    # incremental_vacuum работает только при auto_vacuum = INCREMENTAL,
+    # для существующей базы его включает разовый VACUUM
+    if messages_db.execute_sql('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        print("Enabling incremental vacuum for messages.db (one-time VACUUM)...")
+        messages_db.execute_sql('PRAGMA auto_vacuum = INCREMENTAL')
+        messages_db.execute_sql('VACUUM')
+    
+    history.refresh()
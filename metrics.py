@@ -0,0 +1,237 @@
+"""
+Метрики процесса в текстовом формате Prometheus.
+
+Гистограммы задержек (обработчики, рассылки, запросы к Bot API),
+счётчики ошибок и показатели очередей собираются в памяти и
+отдаются на локальном адресе METRICS_HOST:METRICS_PORT/metrics.
+Показатели, которые уже хранятся в других объектах (размеры кешей,
+очередей), не дублируются: метрика с fn читает их при каждом запросе.
+"""
+import time
+
+from aiohttp import web
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import config
+import profiling
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы гистограмм в секундах: от быстрых запросов до больших рассылок
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Размеры рассылки для меток fan-out: (верхняя граница, метка)
+FANOUT_SIZES = ((1, '1'), (10, '2-10'), (100, '11-100'), (1000, '101-1000'), (10000, '1001-10000'))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._fn = fn  # fn() -> число или {значение метки (или кортеж значений): число}
+        self._values = {}  # {кортеж значений меток: значение}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self):
+        if self._fn is None:
+            return self._values.items()
+        values = self._fn()
+        if not isinstance(values, dict):
+            return [((), values)]
+        return [(key if isinstance(key, tuple) else (key,), value) for key, value in values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self._samples()):
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=None):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets or LATENCY_BUCKETS))
+        # В _values: {кортеж значений меток: [попадания по корзинам..., сумма, количество]}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, **labels):
+        series = self._values.get(self._key(labels))
+        return series[-1] if series else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for key, series in sorted(self._values.items()):
+            # В формате Prometheus корзины накопительные
+            cumulative = 0
+            for bound, hits in zip(self.buckets, series):
+                cumulative += hits
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", _format_value(bound))])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", "+Inf")])} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {series[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    """Все метрики процесса; повторная регистрация имени возвращает ту же метрику"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None and metric._fn is None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=(), fn=None):
+        return self._register(Counter(name, help, labels, fn))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self._register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=None):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for name in sorted(self._metrics):
+            try:
+                lines.extend(self._metrics[name].render())
+            except Exception as e:
+                # Сломанный источник не должен прятать остальные метрики
+                print(f"[ERROR] Failed to collect metric {name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+handler_seconds = registry.histogram(
+    'bot_handler_seconds', 'Время работы обработчика обновления', ['handler']
+)
+fanout_seconds = registry.histogram(
+    'bot_fanout_seconds', 'Время рассылки одного сообщения всем получателям', ['size']
+)
+api_request_seconds = registry.histogram(
+    'bot_api_request_seconds', 'Время запроса к Bot API', ['method']
+)
+api_errors = registry.counter(
+    'bot_api_errors_total', 'Ошибки запросов к Bot API', ['method', 'error']
+)
+send_failures = registry.counter(
+    'bot_send_failures_total', 'Неудачные отправки в рассылках по типу ошибки', ['error']
+)
+
+
+def fanout_size(count):
+    """Метка размера рассылки для bot_fanout_seconds"""
+    for bound, label in FANOUT_SIZES:
+        if count <= bound:
+            return label
+    return f'>{FANOUT_SIZES[-1][0]}'
+
+
+def instrument_bot(bot):
+    """Замеряет каждый запрос бота к Bot API (обёртка над bot.request), в том числе для профиля обновления"""
+    request = bot.request
+
+    async def timed_request(method, data=None, files=None, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return await request(method, data, files, **kwargs)
+        except Exception as e:
+            api_errors.inc(method=method, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start_time
+            api_request_seconds.observe(elapsed, method=method)
+            profiling.record('api', elapsed)
+
+    bot.request = timed_request
+    return bot
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время обработчиков aiogram: от вызова обработчика до post_process"""
+
+    async def trigger(self, action, args):
+        if action.endswith('_update'):
+            # Обработчик обновления - сам Dispatcher, его время складывается из вложенных
+            return
+        data = args[-1]
+        if action.startswith('process_'):
+            handler = current_handler.get()
+            data['metrics_handler'] = getattr(handler, '__name__', 'unknown')
+            data['metrics_start'] = time.perf_counter()
+        elif action.startswith('post_process_') and 'metrics_start' in data:
+            handler_seconds.observe(time.perf_counter() - data['metrics_start'], handler=data['metrics_handler'])
+
+
+async def start_metrics_server(host=None, port=None):
+    """Поднимает /metrics на отдельном локальном порту, возвращает web.AppRunner"""
+    async def handle_metrics(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = port or config.METRICS_PORT
+    await web.TCPSite(runner, host or config.METRICS_HOST, port).start()
+    print(f"Metrics available at http://{host or config.METRICS_HOST}:{port}/metrics")
+    return runner
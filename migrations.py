@@ -0,0 +1,48 @@
+"""
+Версионированные миграции схемы SQLite.
+
+Каждая база хранит номер своей схемы в таблице schema_version.
+Миграция - это (версия, описание, функция(database)); все недостающие
+миграции применяются по порядку в одной транзакции, так что при ошибке
+база остаётся в прежнем состоянии. Миграции только добавляют таблицы,
+колонки и индексы или переносят данные - ничего не удаляется молча.
+"""
+
+
+def get_columns(database, table):
+    """Список колонок таблицы (пустой, если таблицы нет)"""
+    cursor = database.execute_sql(f'PRAGMA table_info("{table}")')
+    return [column[1] for column in cursor.fetchall()]
+
+
+def add_column(database, table, column, definition):
+    """Добавляет колонку, если её ещё нет"""
+    if column not in get_columns(database, table):
+        database.execute_sql(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+
+
+def create_index(database, name, table, columns, unique=False):
+    database.execute_sql(
+        f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS "{name}" '
+        f'ON "{table}" ({", ".join(columns)})'
+    )
+
+
+def get_schema_version(database):
+    database.execute_sql('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    row = database.execute_sql('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def run_migrations(database, migrations):
+    """Применяет недостающие миграции, возвращает итоговую версию схемы"""
+    with database.atomic():
+        current = get_schema_version(database)
+        for version, description, migrate in sorted(migrations, key=lambda m: m[0]):
+            if version <= current:
+                continue
+            print(f"Applying migration {database.database}#{version}: {description}")
+            migrate(database)
+            database.execute_sql('INSERT INTO schema_version (version) VALUES (?)', (version,))
+            current = version
+    return current
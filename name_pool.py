@@ -0,0 +1,93 @@
+import random
+from array import array
+from bisect import bisect_right
+
+import names
+
+import config
+
+# Списки пакета names: dist-файлы с накопленными частотами
+NAME_KINDS = ('first:male', 'first:female', 'last')
+
+
+class NamePool:
+    """
+    Списки имён в памяти с таблицами накопленных весов.
+    Пакет names перечитывает свой файл на каждое имя; здесь файлы читаются
+    один раз, а имя выбирается бинарным поиском по весам - O(log n).
+    """
+
+    def __init__(self, rng=None):
+        self._random = rng or random.Random()
+        self._names = {}  # {kind: tuple(имён)}
+        self._cumulative = {}  # {kind: array('d') накопленных весов}
+
+    def __len__(self):
+        return sum(len(pool) for pool in self._names.values())
+
+    def load_dist_file(self, kind, path):
+        """Загружает dist-файл пакета names: ИМЯ частота накопленная ранг"""
+        pool, cumulative = [], array('d')
+        with open(path) as name_file:
+            for line in name_file:
+                name, _, total, _ = line.split()
+                pool.append(name.capitalize())
+                cumulative.append(float(total))
+        self._names[kind] = tuple(pool)
+        self._cumulative[kind] = cumulative
+
+    def add(self, kind, extra_names, weights=None):
+        """
+        Дополняет список своими именами (например, кириллическими).
+        Без weights каждое имя получает средний вес уже загруженных.
+        """
+        pool = list(self._names.get(kind, ()))
+        cumulative = array('d', self._cumulative.get(kind, ()))
+        total = cumulative[-1] if cumulative else 0.0
+        if weights is None:
+            weight = total / len(pool) if pool else 1.0
+            weights = [weight] * len(extra_names)
+        for name, weight in zip(extra_names, weights):
+            total += weight
+            pool.append(name)
+            cumulative.append(total)
+        self._names[kind] = tuple(pool)
+        self._cumulative[kind] = cumulative
+
+    def draw(self, kind):
+        """Одно имя с учётом частот"""
+        cumulative = self._cumulative[kind]
+        index = bisect_right(cumulative, self._random.random() * cumulative[-1])
+        return self._names[kind][min(index, len(cumulative) - 1)]
+
+    def draw_many(self, kind, count):
+        """count имён сразу (random.choices тоже ищет по накопленным весам)"""
+        return self._random.choices(self._names[kind], cum_weights=self._cumulative[kind], k=count)
+
+    def full_name(self):
+        gender = self._random.choice(('male', 'female'))
+        return f"{self.draw(f'first:{gender}')} {self.draw('last')}"
+
+    def full_names(self, count):
+        """Имена для пачки пользователей (переключение каналов)"""
+        genders = self._random.choices(('male', 'female'), k=count)
+        first_names = {
+            gender: iter(self.draw_many(f'first:{gender}', genders.count(gender)))
+            for gender in ('male', 'female')
+        }
+        return [
+            f"{next(first_names[gender])} {last_name}"
+            for gender, last_name in zip(genders, self.draw_many('last', count))
+        ]
+
+
+def create_name_pool():
+    pool = NamePool()
+    for kind in NAME_KINDS:
+        pool.load_dist_file(kind, names.FILES[kind])
+    for kind, extra_names in config.EXTRA_NAMES.items():
+        pool.add(kind, extra_names)
+    return pool
+
+
+name_pool = create_name_pool()
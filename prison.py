@@ -0,0 +1,98 @@
+import asyncio
+import heapq
+import time
+import traceback
+
+import config
+from database import PrisonUser
+from sharding import is_local
+
+
+class PrisonIndex:
+    """
+    Заключённые в памяти процесса.
+    Отвечает на вопрос "сидит ли пользователь" без обращения к базе
+    и держит кучу сроков, по которой истёкшие приговоры пачками
+    передаются обработчику освобождения.
+    """
+
+    def __init__(self, release_handler=None, batch_size=None):
+        self._release_handler = release_handler  # async release_handler(list[user_id])
+        self._batch_size = batch_size or config.PRISON_RELEASE_BATCH_SIZE
+        self._until = {}  # {user_id: until}, None - навсегда
+        self._heap = []  # [(until, user_id)] только для срочных приговоров
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._until)
+
+    def __contains__(self, user_id):
+        return user_id in self._until
+
+    def load(self):
+        """Перестраивает индекс по таблице PrisonUser из users.db"""
+        self._until.clear()
+        self._heap.clear()
+        for user_id, until in PrisonUser.select(PrisonUser.user_id, PrisonUser.until).tuples():
+            self.jail(user_id, until)
+        print(f"Prison index loaded: {len(self._until)} prisoners")
+
+    def jail(self, user_id, until=None):
+        self._until[user_id] = until
+        if until is not None:
+            heapq.heappush(self._heap, (until, user_id))
+            if self._heap[0][1] == user_id:
+                self._wakeup.set()
+
+    def release(self, user_id):
+        """Убирает пользователя из индекса (запись в куче удалится лениво)"""
+        self._until.pop(user_id, None)
+
+    def is_jailed(self, user_id):
+        if user_id not in self._until:
+            return False
+        until = self._until[user_id]
+        return until is None or until > time.time()
+
+    def remaining_time(self, user_id):
+        """Оставшееся время в секундах, как PrisonUser.remaining_time"""
+        if user_id not in self._until:
+            return 0
+        until = self._until[user_id]
+        if until is None:
+            return float('inf')
+        return max(0, until - int(time.time()))
+
+    def _pop_expired(self, now):
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self._batch_size:
+            until, user_id = heapq.heappop(self._heap)
+            # Чужих заключённых освобождает их воркер, мы узнаем об этом из событий
+            if user_id in self._until and self._until[user_id] == until and is_local(user_id):
+                batch.append(user_id)
+        return batch
+
+    async def run(self):
+        """Освобождает заключённых, у которых закончился срок"""
+        while True:
+            batch = self._pop_expired(time.time())
+            if batch:
+                try:
+                    await self._release_handler(batch)
+                except Exception as e:
+                    print(f"\n{'='*50}")
+                    print(f"[ERROR] Failed to release prisoners {batch}: {e}")
+                    print(traceback.format_exc())
+                    print(f"{'='*50}\n")
+                    # Повторим попытку позже
+                    for user_id in batch:
+                        if user_id in self._until:
+                            self.jail(user_id, int(time.time()) + config.PRISON_RELEASE_RETRY)
+                continue
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
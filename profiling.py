@@ -0,0 +1,152 @@
+"""
+Профилирование обновлений.
+
+ProfilingMiddleware замеряет каждое обновление целиком и делит время
+на запросы к базам (async_db), запросы к Bot API (metrics.instrument_bot)
+и остальное - код обработчика. Текущий замер лежит в contextvar, поэтому
+параллельные обновления не мешают друг другу. Обновления дольше
+SLOW_UPDATE_THRESHOLD попадают в кольцевой буфер, который показывает /slow.
+
+Время запросов суммируется: при параллельной рассылке сумма запросов к
+API может быть больше общего времени обновления.
+"""
+import cProfile
+import io
+import pstats
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import config
+
+_current = ContextVar('update_profile', default=None)
+
+
+class UpdateProfile:
+    """Замер одного обновления"""
+
+    __slots__ = ('update_id', 'user_id', 'handler', 'started_at', 'total',
+                 'db_time', 'db_calls', 'api_time', 'api_calls', 'stats', 'finished')
+
+    def __init__(self, update_id, user_id):
+        self.update_id = update_id
+        self.user_id = user_id
+        self.handler = None
+        self.started_at = time.time()
+        self.total = 0.0
+        self.db_time = 0.0
+        self.db_calls = 0
+        self.api_time = 0.0
+        self.api_calls = 0
+        self.stats = None  # текст cProfile, если обновление попало в выборку
+        self.finished = False
+
+    @property
+    def code_time(self):
+        """Время обработчика без ожидания баз и API"""
+        return max(0.0, self.total - self.db_time - self.api_time)
+
+
+def record(kind, elapsed):
+    """Добавляет время запроса ('db' или 'api') к замеру текущего обновления"""
+    profile = _current.get()
+    # Фоновые задачи, запущенные обработчиком, наследуют контекст и после конца обновления
+    if profile is None or profile.finished:
+        return
+    if kind == 'db':
+        profile.db_time += elapsed
+        profile.db_calls += 1
+    else:
+        profile.api_time += elapsed
+        profile.api_calls += 1
+
+
+def _user_id(update):
+    for payload in (update.message, update.edited_message, update.callback_query):
+        if payload and payload.from_user:
+            return payload.from_user.id
+    return None
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """
+    Замеряет обновления и хранит последние медленные.
+    Доля PROFILE_SAMPLE_RATE обновлений снимается с cProfile, отчёт
+    сохраняется, если обновление оказалось медленным. Профайлер глобальный
+    для потока, поэтому одновременно работает только один и в его отчёт
+    попадает всё, что шло параллельно.
+    """
+
+    def __init__(self, threshold=None, keep=None, sample_rate=None):
+        super().__init__()
+        self._threshold = config.SLOW_UPDATE_THRESHOLD if threshold is None else threshold
+        self._sample_rate = config.PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self._slow = deque(maxlen=keep or config.SLOW_UPDATES_KEEP)
+        self._profiler = None  # активный cProfile и update_id, который он снимает
+        self.profiled = 0
+
+    def slowest(self, count=10):
+        """Самые медленные из последних медленных обновлений"""
+        return sorted(self._slow, key=lambda profile: profile.total, reverse=True)[:count]
+
+    def find(self, update_id):
+        for profile in self._slow:
+            if profile.update_id == update_id:
+                return profile
+        return None
+
+    async def on_pre_process_update(self, update, data):
+        profile = UpdateProfile(update.update_id, _user_id(update))
+        data['profile_token'] = _current.set(profile)
+        data['profile_start'] = time.perf_counter()
+        if self._profiler is None and self._sample_rate and random.random() < self._sample_rate:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            self._profiler = (profiler, update.update_id)
+
+    async def trigger(self, action, args):
+        if action.startswith('process_') and action != 'process_update':
+            profile = _current.get()
+            if profile is not None:
+                profile.handler = getattr(current_handler.get(), '__name__', None)
+        return await super().trigger(action, args)
+
+    async def on_post_process_update(self, update, results, data):
+        profile = _current.get()
+        if profile is None or 'profile_start' not in data:
+            return
+        profile.total = time.perf_counter() - data['profile_start']
+        profile.finished = True
+        _current.reset(data['profile_token'])
+
+        if self._profiler and self._profiler[1] == update.update_id:
+            profiler = self._profiler[0]
+            profiler.disable()
+            self._profiler = None
+            if profile.total >= self._threshold:
+                output = io.StringIO()
+                pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(config.PROFILE_TOP_FUNCTIONS)
+                profile.stats = output.getvalue()
+                self.profiled += 1
+
+        if profile.total >= self._threshold:
+            self._slow.append(profile)
+
+
+def format_profile(profile):
+    """Одна строка для /slow"""
+    return (
+        f"#{profile.update_id} `{profile.handler or '-'}` user `{profile.user_id}`: "
+        f"*{profile.total * 1000:.0f}ms* "
+        f"(DB {profile.db_time * 1000:.0f}ms/{profile.db_calls}, "
+        f"API {profile.api_time * 1000:.0f}ms/{profile.api_calls}, "
+        f"код {profile.code_time * 1000:.0f}ms)"
+        f"{' 🔬' if profile.stats else ''}"
+    )
+
+
+profiling_middleware = ProfilingMiddleware()
@@ -1,149 +1,209 @@
-# Словарь для замены похожих символов на стандартные латинские
-CHAR_MAP = {
-    # Кириллица -> Латиница
-    'а': 'a',
-    'в': 'b',
-    'с': 'c',
-    'е': 'e',
-    'ё': 'e',
-    'і': 'i',
-    'к': 'k',
-    'м': 'm',
-    'н': 'n',
-    'о': 'o',
-    'р': 'p',
-    'ѕ': 's',
-    'т': 't',
-    'у': 'y',
-    'х': 'x',
-    
-    # Специальные символы и цифры
-    '4': 'a',
-    '3': 'e',
-    '1': 'i',
-    '0': 'o',
-    '@': 'a',
-    '$': 's',
-    '7': 't',
-    
-    # Другие похожие символы Unicode
-    'ᴀ': 'a',
-    'ʙ': 'b',
-    'ᴄ': 'c',
-    'ᴅ': 'd',
-    'ᴇ': 'e',
-    'ɢ': 'g',
-    'ʜ': 'h',
-    'ɪ': 'i',
-    'ᴊ': 'j',
-    'ᴋ': 'k',
-    'ʟ': 'l',
-    'ᴍ': 'm',
-    'ɴ': 'n',
-    'ᴏ': 'o',
-    'ᴘ': 'p',
-    'ǫ': 'q',
-    'ʀ': 'r',
-    'ѕ': 's',
-    'ᴛ': 't',
-    'ᴜ': 'u',
-    'ᴠ': 'v',
-    'ᴡ': 'w',
-    'х': 'x',
-    'ʏ': 'y',
-    'ᴢ': 'z'
-}
-
-# Список запрещенных имен
-RESTRICTED_NAMES = {
-    "Система": [],  # Запрещено всем
-    "Владелец": [8019871856],  # Разрешено только владельцу
-    "Admin": [8019871856],
-    "Administrator": [8019871856],
-    "Администратор": [8019871856],
-    "System": [],
-    "Bot": [],
-    "Бот": [],
-    "Owner": [8019871856],
-    "Support": [],
-    "Поддержка": [],
-    "Модератор": [],
-    "Moderator": [],
-    "СИСТЕМНОЕ СООБЩЕНИЕ": [],
-    "#SYSTEM_MESSAGE": []
-}
-
-def normalize_text(text: str) -> str:
-    """
-    Нормализует текст, заменяя все похожие символы на стандартные латинские
-    и приводя к нижнему регистру
-    """
-    text = text.lower()
-    normalized = ""
-    for char in text:
-        normalized += CHAR_MAP.get(char, char)
-    return normalized
-
-def is_valid_name(name: str) -> tuple[bool, str]:
-    """
-    Проверяет валидность имени
-    
-    Args:
-        name: Имя для проверки
-    
-    Returns:
-        tuple[bool, str]: (Валидно ли имя, Сообщение об ошибке)
-    """
-    # Проверка длины
-    if len(name) > 16:
-        return False, "❌ *Ошибка*: Максимальная длина имени - 16 символов"
-    
-    # Проверка символов
-    allowed_chars = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZабвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ ')
-    invalid_chars = [char for char in name if char not in allowed_chars]
-    
-    if invalid_chars:
-        return False, f"❌ *Ошибка*: Запрещенные символы в имени: `{'`, `'.join(set(invalid_chars))}`"
-    
-    # Проверяем, что имя не состоит только из пробелов
-    if name.strip() == '':
-        return False, "❌ *Ошибка*: Имя не может состоять только из пробелов"
-    
-    return True, ""
-
-def is_name_allowed(name: str, user_id: int) -> tuple[bool, str]:
-    """
-    Проверяет, разрешено ли использование имени пользователю
-    
-    Args:
-        name: Имя для проверки
-        user_id: ID пользователя
-    
-    Returns:
-        tuple[bool, str]: (Разрешено ли имя, Сообщение об ошибке)
-    """
-    # Проверка длины
-    if len(name) > 32:  # Увеличено до 32 символов
-        return False, "❌ *Ошибка*: Максимальная длина имени - 32 символа"
-    
-    # Проверка символов
-    allowed_chars = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZабвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ 0123456789')  # Добавлены цифры
-    invalid_chars = [char for char in name if char not in allowed_chars]
-    
-    if invalid_chars:
-        return False, f"❌ *Ошибка*: Запрещенные символы в имени: `{'`, `'.join(set(invalid_chars))}`"
-    
-    # Проверяем, что имя не состоит только из пробелов
-    if name.strip() == '':
-        return False, "❌ *Ошибка*: Имя не может состоять только из пробелов"
-    
-    # Проверяем запрещенные имена
-    normalized_name = normalize_text(name)
-    
-    # Проверяем только точное совпадение с запрещенными именами
-    for restricted_name, allowed_users in RESTRICTED_NAMES.items():
-        if normalize_text(restricted_name) == normalized_name:
-            if not allowed_users or user_id not in allowed_users:
-                return False, "❌ *Ошибка*: Это имя запрещено к использованию"
-                
-    return True, "" 
\ No newline at end of file
+from collections import deque
+
+import config
+
+# Словарь для замены похожих символов на стандартные латинские
+CHAR_MAP = {
+    # Кириллица -> Латиница
+    'а': 'a',
+    'в': 'b',
+    'с': 'c',
+    'е': 'e',
+    'ё': 'e',
+    'і': 'i',
+    'к': 'k',
+    'м': 'm',
+    'н': 'n',
+    'о': 'o',
+    'р': 'p',
+    'ѕ': 's',
+    'т': 't',
+    'у': 'y',
+    'х': 'x',
+    
+    # Специальные символы и цифры
+    '4': 'a',
+    '3': 'e',
+    '1': 'i',
+    '0': 'o',
+    '@': 'a',
+    '$': 's',
+    '7': 't',
+    
+    # Другие похожие символы Unicode
+    'ᴀ': 'a',
+    'ʙ': 'b',
+    'ᴄ': 'c',
+    'ᴅ': 'd',
+    'ᴇ': 'e',
+    'ɢ': 'g',
+    'ʜ': 'h',
+    'ɪ': 'i',
+    'ᴊ': 'j',
+    'ᴋ': 'k',
+    'ʟ': 'l',
+    'ᴍ': 'm',
+    'ɴ': 'n',
+    'ᴏ': 'o',
+    'ᴘ': 'p',
+    'ǫ': 'q',
+    'ʀ': 'r',
+    'ѕ': 's',
+    'ᴛ': 't',
+    'ᴜ': 'u',
+    'ᴠ': 'v',
+    'ᴡ': 'w',
+    'х': 'x',
+    'ʏ': 'y',
+    'ᴢ': 'z'
+}
+
+# Список запрещенных имен
+RESTRICTED_NAMES = {
+    "Система": [],  # Запрещено всем
+    "Владелец": [8019871856],  # Разрешено только владельцу
+    "Admin": [8019871856],
+    "Administrator": [8019871856],
+    "Администратор": [8019871856],
+    "System": [],
+    "Bot": [],
+    "Бот": [],
+    "Owner": [8019871856],
+    "Support": [],
+    "Поддержка": [],
+    "Модератор": [],
+    "Moderator": [],
+    "СИСТЕМНОЕ СООБЩЕНИЕ": [],
+    "#SYSTEM_MESSAGE": []
+}
+
+# Таблица замен для str.translate (строится один раз)
+TRANSLATION_TABLE = str.maketrans(CHAR_MAP)
+
+# Допустимые символы имён
+NAME_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZабвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ ')
+CUSTOM_NAME_CHARS = NAME_CHARS | frozenset('0123456789')  # Добавлены цифры
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализует текст, заменяя все похожие символы на стандартные латинские
+    и приводя к нижнему регистру
+    """
+    return text.lower().translate(TRANSLATION_TABLE)
+
+class RestrictedNameMatcher:
+    """
+    Скомпилированная проверка запрещенных имен.
+    Запрещенные имена нормализуются один раз при создании; при
+    substrings=True имя проверяется и на вхождение запрещенного
+    ("xAdminx") автоматом Ахо-Корасик - за один проход по имени.
+    """
+    
+    def __init__(self, restricted_names, substrings=False):
+        self.substrings = substrings
+        self._exact = {}  # {нормализованное имя: [frozenset(разрешено)]}
+        for name, allowed_users in restricted_names.items():
+            self._exact.setdefault(normalize_text(name), []).append(frozenset(allowed_users))
+        
+        # Бор по нормализованным именам + ссылки неудач
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for pattern, allowed in self._exact.items():
+            node = 0
+            for char in pattern:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            self._output[node].extend(allowed)
+        
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+    
+    def _search(self, text):
+        """Списки разрешенных пользователей для всех запрещенных имен внутри text"""
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            if self._output[node]:
+                yield from self._output[node]
+    
+    def is_restricted(self, name: str, user_id: int) -> bool:
+        normalized_name = normalize_text(name)
+        matches = self._search(normalized_name) if self.substrings else self._exact.get(normalized_name, ())
+        for allowed_users in matches:
+            if not allowed_users or user_id not in allowed_users:
+                return True
+        return False
+
+def is_valid_name(name: str) -> tuple[bool, str]:
+    """
+    Проверяет валидность имени
+    
+    Args:
+        name: Имя для проверки
+    
+    Returns:
+        tuple[bool, str]: (Валидно ли имя, Сообщение об ошибке)
+    """
+    # Проверка длины
+    if len(name) > 16:
+        return False, "❌ *Ошибка*: Максимальная длина имени - 16 символов"
+    
+    # Проверка символов
+    invalid_chars = [char for char in name if char not in NAME_CHARS]
+    
+    if invalid_chars:
+        return False, f"❌ *Ошибка*: Запрещенные символы в имени: `{'`, `'.join(set(invalid_chars))}`"
+    
+    # Проверяем, что имя не состоит только из пробелов
+    if name.strip() == '':
+        return False, "❌ *Ошибка*: Имя не может состоять только из пробелов"
+    
+    return True, ""
+
+def is_name_allowed(name: str, user_id: int) -> tuple[bool, str]:
+    """
+    Проверяет, разрешено ли использование имени пользователю
+    
+    Args:
+        name: Имя для проверки
+        user_id: ID пользователя
+    
+    Returns:
+        tuple[bool, str]: (Разрешено ли имя, Сообщение об ошибке)
+    """
+    # Проверка длины
+    if len(name) > 32:  # Увеличено до 32 символов
+        return False, "❌ *Ошибка*: Максимальная длина имени - 32 символа"
+    
+    # Проверка символов
+    invalid_chars = [char for char in name if char not in CUSTOM_NAME_CHARS]
+    
+    if invalid_chars:
+        return False, f"❌ *Ошибка*: Запрещенные символы в имени: `{'`, `'.join(set(invalid_chars))}`"
+    
+    # Проверяем, что имя не состоит только из пробелов
+    if name.strip() == '':
+        return False, "❌ *Ошибка*: Имя не может состоять только из пробелов"
+    
+    # Проверяем запрещенные имена
+    if restricted_matcher.is_restricted(name, user_id):
+        return False, "❌ *Ошибка*: Это имя запрещено к использованию"
+    
+    return True, ""
+
+restricted_matcher = RestrictedNameMatcher(RESTRICTED_NAMES, substrings=config.RESTRICTED_NAME_SUBSTRINGS)
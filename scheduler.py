@@ -0,0 +1,81 @@
+import asyncio
+import heapq
+import random
+import time
+import traceback
+
+import config
+
+
+class SwitchScheduler:
+    """
+    Единый планировщик переключения каналов.
+    Вместо отдельной задачи на каждого пользователя держит одну кучу,
+    упорядоченную по времени следующего переключения, и отдаёт
+    подошедших пользователей обработчику пачками.
+    """
+
+    def __init__(self, handler, batch_size=None):
+        self._handler = handler  # async handler(list[user_id])
+        self._batch_size = batch_size or config.SWITCH_BATCH_SIZE
+        self._heap = []  # [(due, user_id)]
+        self._due = {}  # {user_id: due} - актуальные записи, остальные в куче устарели
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, user_id):
+        return user_id in self._due
+
+    def schedule(self, user_id, delay=None):
+        """Ставит (или переставляет) следующее переключение пользователя"""
+        if delay is None:
+            delay = random.randint(config.SWITCH_TIME_MIN, config.SWITCH_TIME_MAX)
+        due = time.monotonic() + delay
+        self._due[user_id] = due
+        heapq.heappush(self._heap, (due, user_id))
+        if self._heap[0][1] == user_id:
+            self._wakeup.set()
+
+    def unschedule(self, user_id):
+        """Убирает пользователя из расписания (запись в куче удалится лениво)"""
+        self._due.pop(user_id, None)
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._compact()
+
+    def _compact(self):
+        self._heap = [(due, user_id) for user_id, due in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_due(self, now):
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self._batch_size:
+            due, user_id = heapq.heappop(self._heap)
+            if self._due.get(user_id) != due:
+                continue
+            batch.append(user_id)
+            # Сразу планируем следующее переключение, обработчик может его отменить
+            self.schedule(user_id)
+        return batch
+
+    async def run(self):
+        """Основной цикл планировщика"""
+        while True:
+            batch = self._pop_due(time.monotonic())
+            if batch:
+                try:
+                    await self._handler(batch)
+                except Exception as e:
+                    print(f"\n{'='*50}")
+                    print(f"[ERROR] Error in channel switch batch: {e}")
+                    print(traceback.format_exc())
+                    print(f"{'='*50}\n")
+                continue
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,179 @@
+"""
+Несколько процессов-воркеров за одним webhook.
+
+Процесс-родитель готовит базы и общее состояние (state.db), запускает
+WORKERS воркеров и принимает webhook от Telegram. Каждое обновление
+пересылается воркеру user_id % WORKERS, поэтому все обновления одного
+пользователя обрабатывает один и тот же процесс со своим движком рассылки.
+"""
+import multiprocessing
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+import config
+
+# Поля обновления, в которых Telegram передаёт автора
+_UPDATE_KINDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query',
+    'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+    'poll_answer', 'my_chat_member', 'chat_member', 'chat_join_request',
+    'message_reaction',
+)
+
+
+def shard_of(user_id, workers=None):
+    return user_id % (workers or config.WORKERS)
+
+
+def is_local(user_id):
+    """Обрабатывает ли этот воркер пользователя (в одном процессе - всегда да)"""
+    return config.WORKERS <= 1 or shard_of(user_id) == config.WORKER_INDEX
+
+
+def update_user_id(data):
+    """user_id автора обновления (сырой JSON от Telegram) или None"""
+    for kind in _UPDATE_KINDS:
+        payload = data.get(kind)
+        if payload:
+            user = payload.get('from') or payload.get('user')
+            if user:
+                return user['id']
+            return None
+    return None
+
+
+def worker_port(index):
+    return config.WORKER_BASE_PORT + index
+
+
+def run_worker(index):
+    """Точка входа процесса-воркера"""
+    config.WORKER_INDEX = index
+    config.STATE_BACKEND = 'sqlite'
+
+    import main
+    from webhook import start_webhook
+
+    start_webhook(
+        main.dp, on_startup=main.on_startup, on_shutdown=main.on_shutdown,
+        host='127.0.0.1', port=worker_port(index), register=False
+    )
+
+
+class ShardRouter:
+    """Принимает webhook и пересылает обновления воркерам по user_id"""
+
+    def __init__(self, workers=None, path=None):
+        self.workers = workers or config.WORKERS
+        self.path = path or config.WEBHOOK_PATH
+        self._session = None
+        self.forwarded = [0] * self.workers
+        self.failed = 0
+
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self.handle_update)
+        self.app.router.add_get('/health', self.handle_health)
+        self.app.on_startup.append(self._open)
+        self.app.on_cleanup.append(self._close)
+
+    async def _open(self, app):
+        self._session = ClientSession(timeout=ClientTimeout(total=60))
+
+    async def _close(self, app):
+        await self._session.close()
+
+    def _url(self, index, path):
+        return f"http://127.0.0.1:{worker_port(index)}{path}"
+
+    async def handle_update(self, request):
+        body = await request.read()
+        data = await request.json()
+        user_id = update_user_id(data)
+        index = shard_of(user_id, self.workers) if user_id is not None else 0
+
+        headers = {'Content-Type': 'application/json'}
+        secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token')
+        if secret is not None:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+
+        try:
+            async with self._session.post(self._url(index, request.path_qs), data=body, headers=headers) as response:
+                self.forwarded[index] += 1
+                return web.Response(status=response.status, body=await response.read(),
+                                    content_type='application/json')
+        except Exception as e:
+            self.failed += 1
+            print(f"[ERROR] Failed to forward update {data.get('update_id')} to worker {index}: {e}")
+            # 5xx - Telegram повторит доставку обновления позже
+            return web.Response(status=502)
+
+    async def handle_health(self, request):
+        workers = []
+        for index in range(self.workers):
+            try:
+                async with self._session.get(self._url(index, '/health')) as response:
+                    workers.append(await response.json())
+            except Exception as e:
+                workers.append({'status': 'down', 'error': str(e)})
+        return web.json_response({
+            'status': 'ok' if all(worker.get('status') == 'ok' for worker in workers) else 'degraded',
+            'forwarded': self.forwarded,
+            'failed': self.failed,
+            'workers': workers,
+        })
+
+
+def prepare_shared_state():
+    """Миграции и загрузка общего состояния - один раз, до запуска воркеров"""
+    from database import init_db
+    from messages_db import init_messages_db
+    from channel_index import SharedChannelIndex
+    from state import init_state_db
+
+    init_db()
+    init_messages_db()
+    init_state_db()
+    SharedChannelIndex().rebuild()
+
+
+def run_sharded():
+    """Запускает воркеры и маршрутизатор webhook в текущем процессе"""
+    prepare_shared_state()
+
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=run_worker, args=(index,), name=f'worker-{index}', daemon=True)
+        for index in range(config.WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    print(f"Started {len(processes)} workers on ports {worker_port(0)}-{worker_port(len(processes) - 1)}")
+
+    router = ShardRouter()
+
+    async def register(app):
+        if config.WEBHOOK_URL:
+            from aiogram import Bot
+            bot = Bot(token=config.BOT_TOKEN)
+            try:
+                await bot.set_webhook(
+                    config.WEBHOOK_URL + router.path,
+                    drop_pending_updates=True,
+                    secret_token=config.WEBHOOK_SECRET or None,
+                    allowed_updates=config.ALLOWED_UPDATES
+                )
+            finally:
+                await (await bot.get_session()).close()
+
+    router.app.on_startup.append(register)
+    try:
+        web.run_app(router.app, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout=10)
+
+
+if __name__ == '__main__':
+    run_sharded()
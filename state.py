@@ -0,0 +1,231 @@
+"""
+Общее состояние для нескольких процессов-воркеров.
+
+По умолчанию (STATE_BACKEND = 'memory') всё состояние живёт в памяти
+одного процесса: ChannelIndex, MessageMappings, TokenBuckets.
+С STATE_BACKEND = 'sqlite' те же интерфейсы работают поверх state.db,
+которую делят все воркеры: состав каналов, лимиты отправки и
+соответствия копий видны всем процессам сразу. Изменения пользователей,
+которые воркеры держат в своих кешах (профили, тюрьма), передаются
+через журнал событий.
+
+Запросы горячего пути (лимиты отправки, соответствия копий) идут через
+поток-писатель state.db в async_db: при нескольких воркерах запись ждёт
+блокировку до busy_timeout, и поток событий не должен ждать вместе с ней.
+Индекс каналов каждый воркер читает из своей копии в памяти, а изменения
+раз в STATE_EVENT_POLL_INTERVAL обменивает с state.db пачкой.
+"""
+import asyncio
+import random
+import time
+import traceback
+
+from peewee import *
+
+import async_db
+import config
+from messages_db import item_copies
+from migrations import add_column
+
+state_db = SqliteDatabase('state.db', pragmas=config.SQLITE_PRAGMAS)
+async_db.register_writer(state_db, 'state')
+
+
+def is_shared():
+    return config.STATE_BACKEND == 'sqlite'
+
+
+class StateModel(Model):
+    class Meta:
+        database = state_db
+
+
+class ChannelMember(StateModel):
+    user_id = BigIntegerField(primary_key=True)
+    channel = IntegerField(index=True)
+
+
+class ChannelChange(StateModel):
+    """Журнал изменений индекса каналов, по нему воркеры догоняют друг друга"""
+    user_id = BigIntegerField()
+    channel = IntegerField(null=True)  # None - пользователь удалён
+    worker = IntegerField()
+    created_at = FloatField(index=True)
+
+
+class RateBucket(StateModel):
+    key = CharField(primary_key=True)
+    tokens = FloatField()
+    updated = FloatField()  # time.time(), общее для всех процессов
+    paused_until = FloatField(default=0)  # после RetryAfter корзина закрыта до этого времени
+
+
+class CopyMapping(StateModel):
+    chat_id = BigIntegerField()
+    message_id = BigIntegerField()
+    group_id = BigIntegerField(index=True)
+    expires_at = FloatField(index=True)
+
+    class Meta:
+        primary_key = CompositeKey('chat_id', 'message_id')
+
+
+class StateEvent(StateModel):
+    kind = CharField()
+    user_id = BigIntegerField()
+    worker = IntegerField()  # кто опубликовал - свои события не применяем
+    created_at = FloatField(index=True)
+
+
+def init_state_db():
+    state_db.connect(reuse_if_open=True)
+    state_db.create_tables([ChannelMember, ChannelChange, RateBucket, CopyMapping, StateEvent])
+    add_column(state_db, 'ratebucket', 'paused_until', 'REAL NOT NULL DEFAULT 0')
+
+
+class SharedTokenBuckets:
+    """TokenBuckets поверх state.db: лимиты общие для всех воркеров"""
+
+    async def acquire(self, limits, cost=1):
+        """
+        limits - [(key, rate, capacity)]. Берёт по cost токенов из каждой
+        корзины, если токены есть во всех, и возвращает 0; иначе ничего
+        не берёт и возвращает, сколько секунд ждать.
+        """
+        return await async_db.run_write(state_db, self._acquire, limits, cost)
+
+    async def pause(self, key, seconds):
+        """Закрывает корзину key на seconds секунд для всех воркеров (после RetryAfter)"""
+        await async_db.run_write(state_db, self._pause, key, time.time() + seconds)
+
+    def _acquire(self, limits, cost):
+        now = time.time()
+        with state_db.atomic(lock_type='IMMEDIATE'):
+            rows = {
+                key: (tokens, updated, paused_until) for key, tokens, updated, paused_until in
+                RateBucket.select(RateBucket.key, RateBucket.tokens, RateBucket.updated, RateBucket.paused_until)
+                .where(RateBucket.key.in_([key for key, _, _ in limits]))
+                .tuples()
+            }
+            buckets = []
+            wait = 0.0
+            for key, rate, capacity in limits:
+                tokens, updated, paused_until = rows.get(key, (capacity, now, 0.0))
+                tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                need = min(cost, capacity)  # как в TokenBucket: остаток сверх корзины уходит в долг
+                if tokens < need:
+                    wait = max(wait, (need - tokens) / rate)
+                wait = max(wait, paused_until - now)
+                buckets.append((key, tokens - cost, paused_until))
+            if wait > 0:
+                return wait
+            RateBucket.replace_many(
+                [(key, tokens, now, paused_until) for key, tokens, paused_until in buckets],
+                fields=[RateBucket.key, RateBucket.tokens, RateBucket.updated, RateBucket.paused_until]
+            ).execute()
+        return 0.0
+
+    def _pause(self, key, until):
+        # Новая корзина начинает пустой и наполняется после паузы
+        RateBucket.insert(key=key, tokens=0, updated=until, paused_until=until).on_conflict(
+            conflict_target=[RateBucket.key],
+            update={RateBucket.paused_until: fn.MAX(RateBucket.paused_until, until)}
+        ).execute()
+
+
+class SharedMessageMappings:
+    """MessageMappings поверх state.db: свежие копии видны всем воркерам"""
+
+    def __init__(self, ttl=None):
+        self._ttl = ttl or config.MAPPING_CACHE_TTL
+        self._puts = 0
+        self._size = 0  # живых копий на момент последнего пересчёта (для метрик)
+
+    def __len__(self):
+        # Без запроса к базе: метрики читают размер в потоке событий
+        return self._size
+
+    async def put(self, copies):
+        copies = dict(copies)
+        if copies:
+            await async_db.run_write(state_db, self._put, copies)
+
+    def _put(self, copies):
+        group_id = random.getrandbits(62)
+        now = time.time()
+        with state_db.atomic():
+            CopyMapping.replace_many(
+                [(chat_id, message_id, group_id, now + self._ttl) for chat_id, message_id in copies.items()],
+                fields=[CopyMapping.chat_id, CopyMapping.message_id, CopyMapping.group_id, CopyMapping.expires_at]
+            ).execute()
+            # Истёкшие записи чистим изредка, а не на каждой записи
+            self._puts += 1
+            if self._puts % 1000 == 0:
+                CopyMapping.delete().where(CopyMapping.expires_at < now).execute()
+            # Размер пересчитываем тоже изредка - он приблизительный, копии пишут все воркеры
+            if self._puts % 100 == 1:
+                self._size = CopyMapping.select().where(CopyMapping.expires_at > now).count()
+
+    def _get(self, chat_id, message_id):
+        group_id = (CopyMapping
+                    .select(CopyMapping.group_id)
+                    .where((CopyMapping.chat_id == chat_id) &
+                           (CopyMapping.message_id == message_id) &
+                           (CopyMapping.expires_at > time.time()))
+                    .scalar())
+        if group_id is None:
+            return None
+        return dict(
+            CopyMapping.select(CopyMapping.chat_id, CopyMapping.message_id)
+            .where(CopyMapping.group_id == group_id)
+            .tuples()
+        )
+
+    async def get(self, chat_id, message_id):
+        copies = await async_db.run_read(state_db, self._get, chat_id, message_id)
+        if copies is not None:
+            return copies
+
+        details = await async_db.find_message_details(chat_id, message_id)
+        if not details:
+            return None
+        copies = item_copies(details[4], chat_id, message_id)
+        await self.put(copies)
+        return copies
+
+
+async def publish_event(kind, user_id):
+    """Сообщает остальным воркерам об изменении пользователя (в памяти - ничего не делает)"""
+    if not is_shared():
+        return
+    await async_db.run_write(state_db, _publish_event, kind, user_id)
+
+
+def _publish_event(kind, user_id):
+    now = time.time()
+    StateEvent.create(kind=kind, user_id=user_id, worker=config.WORKER_INDEX, created_at=now)
+    if random.random() < 0.01:
+        StateEvent.delete().where(StateEvent.created_at < now - config.STATE_EVENT_TTL).execute()
+
+
+async def watch_events(handler):
+    """Применяет события других воркеров: await handler(kind, user_id)"""
+    last_id = StateEvent.select(fn.MAX(StateEvent.id)).scalar() or 0
+    while True:
+        await asyncio.sleep(config.STATE_EVENT_POLL_INTERVAL)
+        try:
+            events = await async_db.run_read(state_db, lambda: list(
+                StateEvent.select(StateEvent.id, StateEvent.kind, StateEvent.user_id, StateEvent.worker)
+                .where(StateEvent.id > last_id)
+                .order_by(StateEvent.id)
+                .tuples()
+            ))
+            for event_id, kind, user_id, worker in events:
+                last_id = event_id
+                if worker != config.WORKER_INDEX:
+                    await handler(kind, user_id)
+        except Exception as e:
+            print(f"\n{'='*50}")
+            print(f"[ERROR] Failed to apply state events: {e}")
+            print(traceback.format_exc())
+            print(f"{'='*50}\n")
@@ -0,0 +1,14 @@
+"""
+Регрессионные тесты. Запуск из корня репозитория:
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+
+# main создаёт Bot при импорте, а aiogram проверяет формат токена
+config.BOT_TOKEN = '123456:TESTS'
+config.METRICS_PORT = 0
@@ -0,0 +1,23 @@
+import asyncio
+from types import SimpleNamespace
+
+from albums import AlbumCollector
+
+
+def test_drain_sends_pending_albums():
+    handled = []
+
+    async def handle_album(messages):
+        await asyncio.sleep(0.05)
+        handled.append([message.message_id for message in messages])
+
+    async def scenario():
+        collector = AlbumCollector(handle_album, delay=60)
+        for message_id in (3, 1, 2):
+            collector.add(SimpleNamespace(media_group_id='album', message_id=message_id))
+        assert len(collector) == 1
+        await collector.drain()
+        assert len(collector) == 0 and not collector._tasks
+
+    asyncio.run(scenario())
+    assert handled == [[1, 2, 3]]
@@ -0,0 +1,61 @@
+from channel_index import ChannelIndex
+
+
+def create_channel_index(pairs):
+    index = ChannelIndex()
+    index._fill(pairs)
+    return index
+
+
+def test_move_updates_members_and_snapshots():
+    index = create_channel_index([(1, 100), (2, 100), (3, 200)])
+    snapshot = index.members(100)
+    assert sorted(snapshot) == [1, 2]
+
+    index.set_channel(2, 200)
+    # Старый снимок не меняется под рассылкой, новый берётся заново
+    assert sorted(snapshot) == [1, 2]
+    assert index.members(100) == (1,)
+    assert sorted(index.members(200)) == [2, 3]
+    assert index.get_channel(2) == 200
+
+    index.remove(1)
+    assert index.count(100) == 0 and 100 not in index.channels()
+    assert index.populations() == {200: 2}
+
+
+def test_heap_is_rebuilt_when_stale_entries_pile_up():
+    index = create_channel_index([(1, 100), (2, 200)])
+    for step in range(1000):
+        index.set_channel(1, 300 + step % 2)
+    # Каждый переход оставляет в куче устаревшие записи, но куча не растёт без предела
+    assert len(index._heap) <= 2 * len(index._members) + 64 + 1
+    assert index.populations() == {200: 1, 301: 1}
+
+
+def test_least_populated_skips_stale_entries_lazily():
+    index = create_channel_index([(1, 100), (2, 100), (3, 200), (4, 200), (5, 200)])
+    assert index.least_populated() == 100
+
+    # Канал 100 вырос - его старая запись (2, 100) устарела и отбрасывается при поиске
+    index.set_channel(3, 100)
+    index.set_channel(4, 100)
+    assert index.least_populated() == 200
+    assert all(index.count(channel) == population for population, channel in index._heap[:1])
+
+    # Опустевший канал из выбора пропадает
+    index.remove(5)
+    assert index.least_populated() == 100
+
+
+def test_least_populated_excludes_prison_channel():
+    prison = 666
+    index = create_channel_index([(1, prison), (2, 100), (3, 100)])
+    assert index.least_populated() == prison
+    assert index.least_populated(exclude=(prison,)) == 100
+    # Пропущенная запись возвращается в кучу
+    assert index.least_populated() == prison
+
+    index.remove(2)
+    index.remove(3)
+    assert index.least_populated(exclude=(prison,)) is None
@@ -0,0 +1,64 @@
+import asyncio
+
+from delivery import TokenBuckets
+from flood import FloodControl
+
+
+def create_flood_control():
+    return FloodControl(windows=[(10, 3)], channel_rate=100, channel_burst=100, buckets=TokenBuckets())
+
+
+def check(flood, user_id, now):
+    return asyncio.run(flood.check(user_id, now=now))
+
+
+def test_refund_only_hit_then_later_check():
+    flood = create_flood_control()
+    assert check(flood, 1, now=100) == 0
+    flood.refund(1)
+    assert len(flood) == 0
+    # Раньше пустая очередь пользователя 1 роняла _expire с IndexError
+    assert check(flood, 2, now=200) == 0
+    assert check(flood, 1, now=200) == 0
+
+
+def test_refund_keeps_earlier_hits():
+    flood = create_flood_control()
+    for now in (100, 101, 102):
+        assert check(flood, 1, now=now) == 0
+    assert check(flood, 1, now=103) > 0
+    flood.refund(1)
+    assert check(flood, 1, now=103) == 0
+
+
+def test_channel_charged_by_recipients():
+    flood = FloodControl(windows=[(10, 3)], channel_rate=15, channel_burst=150, buckets=TokenBuckets())
+
+    async def scenario():
+        # Сообщение в канал на 1000 человек забирает весь запас канала и уходит в долг
+        assert await flood.check(1, channel=1, recipients=1000, now=100) == 0
+        assert await flood.check(2, channel=1, recipients=1000, now=100) > 60
+        # Маленький канал рядом не задет
+        for user_id in range(10, 20):
+            assert await flood.check(user_id, channel=2, recipients=5, now=100) == 0
+
+    asyncio.run(scenario())
+    assert flood.rejected_channel == 1
+
+
+def test_channel_reject_charges_nothing():
+    buckets = TokenBuckets()
+    flood = FloodControl(windows=[(10, 3)], channel_rate=1000, channel_burst=10, buckets=buckets)
+
+    async def scenario():
+        assert await flood.check(1, channel=1, recipients=10, now=100) == 0
+        wait = await flood.check(2, channel=1, recipients=10, now=100)
+        assert wait > 0
+        # Отказ канала не засчитан ни в окна пользователя, ни в корзину канала
+        assert 2 not in flood._users
+        assert buckets._buckets['flood:1'].tokens > -1
+        await asyncio.sleep(wait)
+        assert await flood.check(2, channel=1, recipients=10, now=100) == 0
+        assert len(flood._users[2]) == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import threading
+from datetime import datetime
+
+from messages_db import HistoryPartitions
+
+
+def test_partition_end_follows_key_after_period_change(tmp_path):
+    # Разделы, созданные до смены HISTORY_PARTITION, читаются по своему периоду
+    for period in ('month', 'day'):
+        partitions = HistoryPartitions(directory=str(tmp_path), period=period)
+        assert partitions._end('2026_01') == datetime(2026, 2, 1).timestamp()
+        assert partitions._end('2026_12') == datetime(2027, 1, 1).timestamp()
+        assert partitions._end('2026_01_31') == datetime(2026, 2, 1).timestamp()
+
+
+def test_prune_drops_partitions_of_both_periods(tmp_path):
+    partitions = HistoryPartitions(directory=str(tmp_path), period='month')
+    partitions.save_message_with_timestamp(1, 'a', [(2, 10)], 'old month', int(datetime(2026, 1, 5).timestamp()))
+    partitions = HistoryPartitions(directory=str(tmp_path), period='day')
+    partitions.save_message_with_timestamp(1, 'a', [(2, 11)], 'old day', int(datetime(2026, 2, 5).timestamp()))
+    partitions.save_message_with_timestamp(1, 'a', [(2, 12)], 'new day', int(datetime(2026, 3, 5).timestamp()))
+
+    cutoff = datetime(2026, 3, 1).timestamp()
+    assert partitions.prune_step(cutoff, 100) == 1
+    assert partitions.prune_step(cutoff, 100) == 1
+    assert sorted(path.name for path in tmp_path.glob('*.db')) == ['messages_2026_03_05.db']
+
+
+def test_lookup_does_not_keep_partition_open(tmp_path):
+    partitions = HistoryPartitions(directory=str(tmp_path), period='month')
+    partitions.save_message_with_timestamp(1, 'a', [(2, 10)], 'text', int(datetime(2026, 1, 5).timestamp()))
+    database = partitions.retained()[0]._meta.database
+
+    # Поиск идёт в потоке-читателе, очистка - в потоке-писателе
+    result = {}
+    def lookup():
+        result['details'] = partitions.find_message_details(2, 10)
+        result['closed'] = database.is_closed()
+    reader = threading.Thread(target=lookup)
+    reader.start()
+    reader.join()
+    assert result['details'] is not None
+    assert result['closed']
+
+
+def test_removed_partition_is_not_recreated(tmp_path):
+    partitions = HistoryPartitions(directory=str(tmp_path), period='month')
+    partitions.save_message_with_timestamp(1, 'a', [(2, 10)], 'text', int(datetime(2026, 1, 5).timestamp()))
+    database = partitions.retained()[0]._meta.database
+
+    # Читатель взял список разделов, а очистка успела удалить файл
+    assert partitions.prune_step(datetime(2026, 3, 1).timestamp(), 100) == 1
+    assert not partitions._connect(database)
+    assert list(tmp_path.glob('*.db')) == []
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+import async_db
+from mappings import MessageMappings
+
+
+@pytest.fixture
+def history(monkeypatch):
+    """Подменяет поиск в истории: {(chat_id, message_id): пары (получатель, копия)}"""
+    found = {}
+    lookups = []
+
+    async def find_message_details(chat_id, message_id):
+        lookups.append((chat_id, message_id))
+        deliveries = found.get((chat_id, message_id))
+        return deliveries and (1, 100, 'text', 0, deliveries)
+
+    monkeypatch.setattr(async_db, 'find_message_details', find_message_details)
+    return found, lookups
+
+
+def test_expired_copies_are_dropped(history, monkeypatch):
+    mappings = MessageMappings(max_entries=100, ttl=10)
+    clock = [1000.0]
+    monkeypatch.setattr('mappings.time.monotonic', lambda: clock[0])
+
+    async def scenario():
+        await mappings.put({1: 10, 2: 20})
+        assert await mappings.get(2, 20) == {1: 10, 2: 20}
+        clock[0] += 11
+        assert await mappings.get(2, 20) is None
+        assert len(mappings) == 0
+
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_group_is_evicted(history):
+    mappings = MessageMappings(max_entries=4, ttl=60)
+
+    async def scenario():
+        await mappings.put({1: 10, 2: 20})
+        await mappings.put({1: 11, 2: 21})
+        await mappings.get(1, 10)  # первая группа становится свежей
+        await mappings.put({1: 12, 2: 22})
+        assert len(mappings) == 4
+        assert await mappings.get(1, 10) == {1: 10, 2: 20}
+        assert await mappings.get(1, 12) == {1: 12, 2: 22}
+        assert await mappings.get(1, 11) is None
+
+    asyncio.run(scenario())
+    assert history[1] == [(1, 11)]
+
+
+def test_missing_copies_fall_back_to_history(history):
+    found, lookups = history
+    # Альбом из двух элементов: у каждого получателя копии подряд
+    found[(2, 21)] = [(1, 10), (1, 11), (2, 20), (2, 21), (3, 30), (3, 31)]
+    mappings = MessageMappings(max_entries=100, ttl=60)
+
+    async def scenario():
+        assert await mappings.get(2, 21) == {1: 11, 2: 21, 3: 31}
+        # Найденное запомнено - второй раз в историю не идём
+        assert await mappings.get(3, 31) == {1: 11, 2: 21, 3: 31}
+
+    asyncio.run(scenario())
+    assert lookups == [(2, 21)]
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from messages_db import Delivery, HistoryWriter, StoredMessage, _add_sender_message_id, _create_stored_messages, \
+    messages_db, migrate_message_data
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    messages_db.connect()
+    _create_stored_messages(messages_db)
+    _add_sender_message_id(messages_db)
+    messages_db.create_tables([Delivery])
+    yield messages_db
+    messages_db.close()
+
+
+def test_migrate_message_data_many_recipients(legacy_db):
+    # 600 сообщений по 299 копий: без разбиения INSERT превышает лимит переменных SQLite
+    recipients = 299
+    rows = [
+        (sender_id, 'Sender', ' '.join(f'{user_id}:{sender_id * 1000 + user_id}' for user_id in range(1, recipients + 1)),
+         'text', 0)
+        for sender_id in range(1, 601)
+    ]
+    with legacy_db.atomic():
+        for row in rows:
+            legacy_db.execute_sql(
+                'INSERT INTO storedmessage (sender_id, sender_name, message_data, message, timestamp) '
+                'VALUES (?, ?, ?, ?, ?)', row
+            )
+
+    migrate_message_data()
+
+    assert Delivery.select().count() == 600 * recipients
+    assert StoredMessage.select().where(StoredMessage.message_data != '').count() == 0
+
+
+def test_save_message_large_channel(legacy_db):
+    # 300 000 параметров - больше лимита переменных SQLite в любой сборке
+    results = [(user_id, user_id + 1) for user_id in range(100000)]
+    stored = StoredMessage.save_message_with_timestamp(1, 'Sender', results, 'text', 0, sender_message_id=5)
+    assert Delivery.select().where(Delivery.stored_message == stored.id).count() == len(results)
+
+
+def test_history_writer_requeues_failed_batch():
+    written = []
+
+    async def run_write(fn, rows):
+        await asyncio.sleep(0.01)
+        if not written:
+            written.append(None)
+            raise OSError('disk I/O error')
+        written.append([row[3] for row in rows])
+
+    async def scenario():
+        writer = HistoryWriter(run_write, batch_size=2, flush_interval_ms=60000, max_pending=10)
+        await writer.add(1, 'a', [], 'first', 0)
+        await writer.add(1, 'a', [], 'second', 0)
+        # Сброс по размеру пачки запущен фоном, при остановке его дожидается drain()
+        assert writer._tasks
+        await writer.drain()
+        assert not writer._tasks
+        assert len(writer) == 2  # неудачная запись вернулась в буфер
+
+        await writer.add(1, 'a', [], 'third', 0)
+        await writer.drain()
+        await writer.flush()
+        assert len(writer) == 0 and writer._space._value == 10
+
+    asyncio.run(scenario())
+    assert written == [None, ['first', 'second', 'third']]
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+from aiogram import Bot
+
+import async_db
+import config
+import main
+from prison import PrisonIndex
+
+
+def test_expired_sentences_are_released_in_batches():
+    prison = PrisonIndex(batch_size=2)
+    now = time.time()
+    for user_id in range(1, 6):
+        prison.jail(user_id, now - 10 + user_id)
+    prison.jail(6)  # навсегда - в куче сроков его нет
+    prison.jail(7, now + 3600)
+
+    assert prison._pop_expired(now) == [1, 2]
+    assert prison._pop_expired(now) == [3, 4]
+    assert prison._pop_expired(now) == [5]
+    assert prison._pop_expired(now) == []
+    assert prison.is_jailed(6) and prison.is_jailed(7)
+
+
+def test_changed_sentences_leave_stale_entries_behind():
+    prison = PrisonIndex()
+    now = time.time()
+    prison.jail(1, now - 5)
+    prison.jail(1, now + 3600)  # срок продлили
+    prison.jail(2, now - 5)
+    prison.release(2)  # освободили досрочно
+
+    assert prison._pop_expired(now) == []
+    assert prison.remaining_time(1) > 3500
+    assert 2 not in prison
+
+
+def test_failed_release_is_retried(monkeypatch):
+    monkeypatch.setattr(config, 'PRISON_RELEASE_RETRY', 0)
+    attempts = []
+
+    async def release_handler(user_ids):
+        attempts.append(user_ids)
+        if len(attempts) == 1:
+            raise OSError('database is locked')
+        for user_id in user_ids:
+            prison.release(user_id)
+
+    prison = PrisonIndex(release_handler)
+
+    async def scenario():
+        prison.jail(1, time.time() - 1)
+        task = asyncio.create_task(prison.run())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert attempts == [[1], [1]]
+    assert 1 not in prison
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    calls = []
+
+    async def request(method, data=None, files=None, **kwargs):
+        calls.append((method, data))
+        return {'message_id': 1, 'date': 0, 'chat': {'id': data['chat_id'], 'type': 'private'}}
+
+    monkeypatch.setattr(main.bot, 'request', request)
+    Bot.set_current(main.bot)
+    return calls
+
+
+def test_release_prisoners_moves_users_out_of_prison(requests, monkeypatch):
+    released = []
+
+    async def release_prisoners(changes):
+        released.extend(changes)
+
+    monkeypatch.setattr(async_db, 'release_prisoners', release_prisoners)
+    monkeypatch.setattr(config, 'CHANNEL_CREATION_CHANCE', 0)
+    main.channel_index.set_channel(11, 4000)
+    main.channel_index.set_channel(12, config.PRISON_CHANNEL)
+    main.prison_index.jail(12, time.time() - 1)
+    main.prison_index.jail(13, time.time() - 1)  # уже удалён из индекса каналов
+
+    try:
+        asyncio.run(main.release_prisoners([12, 13]))
+
+        assert [user_id for user_id, _ in released] == [12, 13]
+        assert 12 not in main.prison_index and 13 not in main.prison_index
+        assert main.channel_index.get_channel(12) == dict(released)[12] != config.PRISON_CHANNEL
+        assert main.channel_index.get_channel(13) is None
+        # Сообщение об освобождении получает только тот, кто есть в индексе
+        assert [data['chat_id'] for method, data in requests if method == 'sendMessage'] == [12]
+    finally:
+        for user_id in (11, 12):
+            main.channel_index.remove(user_id)
@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import pytest
+from aiogram import Bot, Dispatcher, types
+
+import main
+import mappings
+from database import User
+from user_cache import make_profile
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    calls = []
+
+    async def request(method, data=None, files=None, **kwargs):
+        calls.append((method, data))
+        return True
+
+    monkeypatch.setattr(main.bot, 'request', request)
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+    return calls
+
+
+def reaction_update(chat_id, message_id, emoji):
+    return types.Update(**{
+        'update_id': 1,
+        'message_reaction': {
+            'chat': {'id': chat_id, 'type': 'private'},
+            'message_id': message_id,
+            'user': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+            'date': 1,
+            'old_reaction': [],
+            'new_reaction': [{'type': 'emoji', 'emoji': emoji}] if emoji else [],
+        },
+    })
+
+
+def test_reaction_is_mirrored_to_all_copies(requests):
+    main.user_cache.put(make_profile(User(user_id=2, channel=5000, name='User')))
+
+    async def scenario():
+        await main.message_mappings.put({1: 10, 2: 20, 3: 30})
+        await main.dp.updates_handler.notify(reaction_update(2, 20, '👍'))
+
+    asyncio.run(scenario())
+
+    reactions = {(data['chat_id'], data['message_id']): json.loads(data['reaction'])
+                 for method, data in requests if method == 'setMessageReaction'}
+    assert reactions == {
+        (1, 10): [{'type': 'emoji', 'emoji': '👍'}],
+        (3, 30): [{'type': 'emoji', 'emoji': '👍'}],
+        (2, 20): [{'type': 'emoji', 'emoji': '👍'}],
+    }
+
+
+def test_removed_reaction_is_removed_everywhere(requests):
+    main.user_cache.put(make_profile(User(user_id=4, channel=5000, name='User')))
+
+    async def scenario():
+        await main.message_mappings.put({4: 40, 5: 50})
+        await main.dp.updates_handler.notify(reaction_update(4, 40, None))
+
+    asyncio.run(scenario())
+    assert sorted((data['chat_id'], data['reaction']) for _, data in requests) == [(4, '[]'), (5, '[]')]
+
+
+def test_album_copies_from_history_are_per_item(monkeypatch):
+    # В истории альбом - одна запись со всеми копиями всех элементов
+    recipients = [(1, 101), (1, 102), (1, 103), (2, 201), (2, 202), (2, 203), (3, 301), (3, 302)]
+
+    async def find_message_details(chat_id, message_id):
+        return 1, message_id, 'album', 0, recipients
+
+    monkeypatch.setattr(mappings.async_db, 'find_message_details', find_message_details)
+    store = mappings.MessageMappings()
+    assert asyncio.run(store.get(2, 202)) == {1: 102, 2: 202, 3: 302}
+    assert asyncio.run(store.get(1, 103)) == {1: 103, 2: 203}
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import pytest
+
+import config
+from scheduler import SwitchScheduler
+
+
+@pytest.fixture(autouse=True)
+def long_switch_time(monkeypatch):
+    # Следующее переключение после сработавшего - заведомо за пределами теста
+    monkeypatch.setattr(config, 'SWITCH_TIME_MIN', 1000)
+    monkeypatch.setattr(config, 'SWITCH_TIME_MAX', 1000)
+
+
+async def handle(batch):
+    pass
+
+
+def test_reschedule_replaces_previous_due():
+    scheduler = SwitchScheduler(handle)
+    now = time.monotonic()
+    scheduler.schedule(1, delay=10)
+    scheduler.schedule(1, delay=1)
+    assert len(scheduler) == 1
+
+    assert scheduler._pop_due(now + 5) == [1]
+    # Старая запись на +10 устарела и не срабатывает второй раз
+    assert scheduler._pop_due(now + 20) == []
+    assert 1 in scheduler
+
+
+def test_unschedule_cancels_and_compacts():
+    scheduler = SwitchScheduler(handle)
+    now = time.monotonic()
+    for user_id in range(3000):
+        scheduler.schedule(user_id, delay=1)
+    for user_id in range(1, 3000):
+        scheduler.unschedule(user_id)
+
+    assert len(scheduler) == 1 and 2 not in scheduler
+    assert len(scheduler._heap) <= 2 * len(scheduler) + 1024
+    assert scheduler._pop_due(now + 5) == [0]
+
+
+def test_due_batches_are_limited():
+    scheduler = SwitchScheduler(handle, batch_size=2)
+    now = time.monotonic()
+    for user_id in range(5):
+        scheduler.schedule(user_id, delay=user_id)
+    assert scheduler._pop_due(now + 10) == [0, 1]
+    assert scheduler._pop_due(now + 10) == [2, 3]
+    assert scheduler._pop_due(now + 10) == [4]
+
+
+def test_earlier_schedule_wakes_running_loop():
+    batches = []
+
+    async def record(batch):
+        batches.append(batch)
+
+    async def scenario():
+        scheduler = SwitchScheduler(record)
+        scheduler.schedule(1, delay=60)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+        # Цикл спит до +60 секунд, новое раннее переключение должно его разбудить
+        scheduler.schedule(2, delay=0.01)
+        await asyncio.sleep(0.1)
+        scheduler.unschedule(1)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert batches == [[2]]
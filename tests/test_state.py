@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import async_db
+import config
+from channel_index import SharedChannelIndex
+from state import SharedMessageMappings, SharedTokenBuckets, StateEvent, init_state_db, publish_event, state_db
+
+
+@pytest.fixture
+def shared_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, 'STATE_BACKEND', 'sqlite')
+    init_state_db()
+    yield state_db
+    # У потока-писателя своё соединение - закрываем и его, следующий тест в другом каталоге
+    asyncio.run(async_db.run_write(state_db, state_db.close))
+    state_db.close()
+
+
+def as_worker(monkeypatch, index, coroutine):
+    monkeypatch.setattr(config, 'WORKER_INDEX', index)
+    return asyncio.run(coroutine)
+
+
+def test_channel_index_syncs_between_workers(shared_state, monkeypatch):
+    first, second = SharedChannelIndex(), SharedChannelIndex()
+    first.load()
+    second.load()
+
+    first.set_channel(1, 100)
+    first.set_channel(2, 100)
+    second.set_channel(3, 200)
+    assert first.get_channel(3) is None  # до синхронизации видно только своё
+
+    as_worker(monkeypatch, 0, first.sync())
+    as_worker(monkeypatch, 1, second.sync())
+    as_worker(monkeypatch, 0, first.sync())
+
+    for index in (first, second):
+        assert index.populations() == {100: 2, 200: 1}
+        assert index.least_populated() == 200
+
+    second.remove(1)
+    as_worker(monkeypatch, 1, second.sync())
+    as_worker(monkeypatch, 0, first.sync())
+    assert first.get_channel(1) is None
+    assert first.members(100) == (2,)
+
+    # Новый воркер видит всё, что уже записано
+    late = SharedChannelIndex()
+    late.load()
+    assert late.populations() == {100: 1, 200: 1}
+
+
+def test_own_pending_change_wins_over_older_remote(shared_state, monkeypatch):
+    first, second = SharedChannelIndex(), SharedChannelIndex()
+    first.load()
+    second.load()
+
+    second.set_channel(1, 200)
+    as_worker(monkeypatch, 1, second.sync())
+    first.set_channel(1, 100)
+    as_worker(monkeypatch, 0, first.sync())
+    as_worker(monkeypatch, 1, second.sync())
+
+    assert first.get_channel(1) == 100
+    assert second.get_channel(1) == 100
+
+
+def test_pause_is_shared(shared_state):
+    limits = [('global', 30, 30)]
+    first, second = SharedTokenBuckets(), SharedTokenBuckets()
+
+    async def scenario():
+        assert await first.acquire(limits) == 0
+        await first.pause('global', 5)
+        assert await second.acquire(limits) > 4
+        assert await second.acquire([('chat:1', 1, 3)]) == 0
+
+    asyncio.run(scenario())
+
+
+def test_publish_event_goes_through_writer(shared_state, monkeypatch):
+    as_worker(monkeypatch, 1, publish_event('user', 42))
+    assert list(StateEvent.select(StateEvent.kind, StateEvent.user_id, StateEvent.worker).tuples()) == [('user', 42, 1)]
+
+
+def test_mappings_size_is_cached(shared_state):
+    mappings = SharedMessageMappings()
+    assert len(mappings) == 0
+    asyncio.run(mappings.put({1: 10, 2: 20}))
+    assert len(mappings) == 2
+    assert asyncio.run(mappings.get(2, 20)) == {1: 10, 2: 20}
@@ -0,0 +1,35 @@
+import asyncio
+
+from aiogram import Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+import main
+from webhook import WebhookServer
+
+
+def test_drain_waits_for_background_updates():
+    dp = Dispatcher(main.bot)
+    processed = []
+
+    async def slow_handler(update):
+        await asyncio.sleep(0.1)
+        processed.append(update.update_id)
+
+    dp.updates_handler.register(slow_handler, index=0)
+    server = WebhookServer(dp, secret_token='')
+
+    async def scenario():
+        client = TestClient(TestServer(server.app))
+        await client.start_server()
+        try:
+            for update_id in (1, 2):
+                response = await client.post(server.path, json={'update_id': update_id})
+                assert (await response.json()) == {'ok': True}
+            assert processed == []
+            await server.drain()
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
+    assert sorted(processed) == [1, 2]
+    assert not server._tasks
@@ -0,0 +1,112 @@
+from collections import OrderedDict, namedtuple
+
+import async_db
+import config
+from database import User, db
+from sharding import is_local
+
+# Всё, что обработчикам нужно знать о пользователе на горячем пути
+UserProfile = namedtuple('UserProfile', [
+    'user_id', 'channel', 'name', 'custom_name', 'emoji', 'display_name'
+])
+
+
+def _display_name(name, custom_name, emoji):
+    display_name = custom_name if custom_name else name
+    if emoji:
+        display_name = f"{emoji} {display_name}"
+    return display_name
+
+
+def make_profile(user):
+    """Собирает профиль из модели User"""
+    return UserProfile(
+        user_id=user.user_id,
+        channel=user.channel,
+        name=user.name,
+        custom_name=user.custom_name,
+        emoji=user.emoji,
+        display_name=_display_name(user.name, user.custom_name, user.emoji)
+    )
+
+
+def update_profile(profile, **changes):
+    """Копия профиля с изменёнными полями и пересчитанным отображаемым именем"""
+    profile = profile._replace(**changes)
+    return profile._replace(display_name=_display_name(profile.name, profile.custom_name, profile.emoji))
+
+
+def load_profiles(user_ids):
+    """Загружает профили одним запросом (выполняется в потоке базы)"""
+    return {
+        user.user_id: make_profile(user)
+        for user in User.select().where(User.user_id.in_(list(user_ids)))
+    }
+
+
+class UserCache:
+    """LRU-кеш профилей пользователей со счётчиками попаданий"""
+
+    def __init__(self, max_size=None):
+        self._max_size = max_size or config.USER_CACHE_SIZE
+        self._profiles = OrderedDict()  # {user_id: UserProfile}
+        self._generation = 0  # растёт при каждой инвалидации
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._profiles)
+
+    @property
+    def generation(self):
+        """Номер поколения: меняется при каждой инвалидации"""
+        return self._generation
+
+    async def get(self, user_id):
+        """Профиль пользователя или None, если он не зарегистрирован"""
+        return (await self.get_many([user_id])).get(user_id)
+
+    async def get_many(self, user_ids):
+        """Профили сразу нескольких пользователей, промахи грузятся одним запросом"""
+        profiles = {}
+        missing = []
+        for user_id in user_ids:
+            profile = self._profiles.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                self._profiles.move_to_end(user_id)
+                profiles[user_id] = profile
+        self.hits += len(profiles)
+        self.misses += len(missing)
+
+        if missing:
+            generation = self._generation
+            loaded = await async_db.run_read(db, load_profiles, missing)
+            # Пока шёл запрос, профиль могли изменить - тогда не кешируем устаревшие данные
+            if generation == self._generation:
+                for profile in loaded.values():
+                    self.put(profile)
+            profiles.update(loaded)
+        return profiles
+
+    def peek(self, user_id):
+        """Профиль из кеша без обращения к базе и без учёта в статистике"""
+        return self._profiles.get(user_id)
+
+    def put(self, profile):
+        # Чужих пользователей меняют другие воркеры - их не кешируем
+        if not is_local(profile.user_id):
+            return
+        self._profiles[profile.user_id] = profile
+        self._profiles.move_to_end(profile.user_id)
+        while len(self._profiles) > self._max_size:
+            self._profiles.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Сбрасывает профиль; вызывается всеми, кто меняет пользователя"""
+        self._generation += 1
+        self._profiles.pop(user_id, None)
+
+
+user_cache = UserCache()
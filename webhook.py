@@ -0,0 +1,125 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+import config
+import metrics
+
+
+class WebhookServer:
+    """
+    Приём обновлений через webhook вместо long polling.
+    Обновления передаются в тот же Dispatcher; одновременно
+    обрабатывается не больше WEBHOOK_CONCURRENCY обновлений.
+    """
+
+    def __init__(self, dp, path=None, concurrency=None, secret_token=None):
+        self.dp = dp
+        self.path = path or config.WEBHOOK_PATH
+        self._secret_token = secret_token if secret_token is not None else config.WEBHOOK_SECRET
+        self._semaphore = asyncio.Semaphore(concurrency or config.WEBHOOK_CONCURRENCY)
+        self._latencies = deque(maxlen=1000)  # секунды обработки последних обновлений
+        self._tasks = set()  # фоновая обработка: ссылки держим, чтобы задачи не собрал сборщик мусора
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self.handle_update)
+        self.app.router.add_get('/health', self.handle_health)
+
+        metrics.registry.gauge('bot_webhook_in_flight', 'Обновления webhook в обработке', fn=lambda: self.in_flight)
+        metrics.registry.counter('bot_webhook_failed_total', 'Обновления webhook, упавшие с ошибкой', fn=lambda: self.failed)
+
+    async def process(self, update):
+        """Обрабатывает одно обновление, возвращает время обработки в секундах"""
+        self.in_flight += 1
+        try:
+            async with self._semaphore:
+                start_time = time.perf_counter()
+                Bot.set_current(self.dp.bot)
+                Dispatcher.set_current(self.dp)
+                try:
+                    # Как и polling, через updates_handler - иначе не сработают middleware обновлений
+                    await self.dp.updates_handler.notify(update)
+                except Exception as e:
+                    self.failed += 1
+                    print(f"\n{'='*50}")
+                    print(f"[ERROR] Failed to process webhook update {update.update_id}: {e}")
+                    print(traceback.format_exc())
+                    print(f"{'='*50}\n")
+                latency = time.perf_counter() - start_time
+                self._latencies.append(latency)
+                self.processed += 1
+                return latency
+        finally:
+            self.in_flight -= 1
+
+    async def handle_update(self, request):
+        if self._secret_token and \
+                request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self._secret_token:
+            return web.Response(status=401)
+
+        update = types.Update(**(await request.json()))
+
+        # ?wait=1 - дождаться обработки и вернуть её время (для локальных замеров)
+        if request.query.get('wait'):
+            latency = await self.process(update)
+            return web.json_response({'ok': True, 'latency_ms': round(latency * 1000, 3)})
+
+        # Telegram ждёт быстрый ответ, поэтому обрабатываем в фоне
+        task = asyncio.create_task(self.process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({'ok': True})
+
+    async def drain(self):
+        """Дожидается обновлений, принятых до остановки"""
+        if self._tasks:
+            print(f"Waiting for {len(self._tasks)} webhook updates...")
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def handle_health(self, request):
+        latencies = sorted(self._latencies)
+        return web.json_response({
+            'status': 'ok',
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'failed': self.failed,
+            'latency_ms_p50': round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+            'latency_ms_max': round(latencies[-1] * 1000, 3) if latencies else None,
+        })
+
+
+def start_webhook(dp, on_startup=None, on_shutdown=None, host=None, port=None, register=True):
+    """
+    Запускает aiohttp-сервер webhook и регистрирует его в Telegram.
+    Воркеры за маршрутизатором (register=False) webhook не регистрируют.
+    """
+    server = WebhookServer(dp)
+
+    async def startup(app):
+        if on_startup:
+            await on_startup(dp)
+        if register and config.WEBHOOK_URL:
+            await dp.bot.set_webhook(
+                config.WEBHOOK_URL + server.path,
+                drop_pending_updates=True,
+                secret_token=config.WEBHOOK_SECRET or None,
+                allowed_updates=config.ALLOWED_UPDATES
+            )
+
+    async def shutdown(app):
+        await server.drain()
+        if on_shutdown:
+            await on_shutdown(dp)
+        session = await dp.bot.get_session()
+        await session.close()
+
+    server.app.on_startup.append(startup)
+    server.app.on_shutdown.append(shutdown)
+    web.run_app(server.app, host=host or config.WEBHOOK_HOST, port=port or config.WEBHOOK_PORT)